@@ -20,6 +20,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
+import json
 import os
 SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'dev-key-change-in-production')
 
@@ -42,11 +43,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so it times everything else (see grades/metrics.py)
+    'grades.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    # Inside the session middleware, which saves its read-the-primary window
+    'grades.replicas.ReplicaMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # After authentication, to let superusers ask for a profile
+    'grades.profiling.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -55,7 +62,8 @@ ROOT_URLCONF = 'graderific.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for the metrics
+        'BACKEND': 'grades.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -79,9 +87,60 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file rather than memory, since an in-memory database shared
+        # between threads locks whole tables and the tests use threads
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# More databases that courses can be moved to (see grades/courses.py), as a
+# JSON object mapping each alias to a SQLite file name or a full DATABASES
+# entry, e.g. {"shard1": "shard1.sqlite3"}. Run `migrate --database <alias>`
+# for each before moving a course there.
+for alias, database in json.loads(os.environ.get('GRADES_SHARDS', '{}')).items():
+    if isinstance(database, str):
+        database = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / database}
+    DATABASES[alias] = database
+
+# Read replicas (see grades/replicas.py), as a JSON object mapping a
+# database's alias to a list of copies of it, each a SQLite file name or a
+# full DATABASES entry, e.g. {"default": ["replica1.sqlite3"]}. Replica n of
+# a database gets the alias <alias>_replica<n>. GET requests read from them,
+# except for GRADES_REPLICA_STICKY_SECONDS after the same session's last POST.
+GRADES_READ_REPLICAS = {}
+for primary, copies in json.loads(os.environ.get('GRADES_REPLICAS', '{}')).items():
+    for number, database in enumerate(copies, 1):
+        if isinstance(database, str):
+            database = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / database}
+        alias = f'{primary}_replica{number}'
+        # Tests read the primary's test database instead
+        DATABASES[alias] = {**database, 'TEST': {'MIRROR': primary}}
+        GRADES_READ_REPLICAS.setdefault(primary, []).append(alias)
+GRADES_REPLICA_STICKY_SECONDS = float(os.environ.get('GRADES_REPLICA_STICKY_SECONDS', 10))
+
+# Production SQLite mode (see grades/sqlite/base.py): WAL journaling so pages
+# aren't held up by writes, and one writer at a time per process, retried
+# while another process writes. The busy timeout is in seconds, the memory
+# map size in bytes; synchronous is SQLite's level (NORMAL is safe with WAL).
+GRADES_SQLITE_PRODUCTION = bool(os.environ.get('GRADES_SQLITE_PRODUCTION'))
+GRADES_SQLITE_BUSY_TIMEOUT = float(os.environ.get('GRADES_SQLITE_BUSY_TIMEOUT', 5))
+GRADES_SQLITE_MMAP_SIZE = int(os.environ.get('GRADES_SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+GRADES_SQLITE_SYNCHRONOUS = os.environ.get('GRADES_SQLITE_SYNCHRONOUS', 'NORMAL')
+if GRADES_SQLITE_PRODUCTION:
+    for database in DATABASES.values():
+        if database['ENGINE'] == 'django.db.backends.sqlite3':
+            database['ENGINE'] = 'grades.sqlite'
+            database['OPTIONS'] = {
+                'timeout': GRADES_SQLITE_BUSY_TIMEOUT,
+                'pragmas': {
+                    'mmap_size': GRADES_SQLITE_MMAP_SIZE,
+                    'synchronous': GRADES_SQLITE_SYNCHRONOUS,
+                },
+                **database.get('OPTIONS', {}),
+            }
+
+DATABASE_ROUTERS = ['grades.courses.CourseRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -131,4 +190,60 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_ROOT = "uploads/"
 MEDIA_URL = "uploads/"
 
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    # Submission files, stored once per distinct content
+    "submissions": {
+        "BACKEND": "grades.storage.ContentAddressedStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
+# Let the front-end web server deliver uploaded files once Django has checked
+# permissions: None, "x-sendfile" (Apache, lighttpd) or "x-accel-redirect" (nginx)
+SENDFILE_MODE = os.environ.get('SENDFILE_MODE') or None
+# Internal nginx location mapped onto MEDIA_ROOT, used by x-accel-redirect
+SENDFILE_URL = '/protected-uploads/'
+
+# Serve the index, assignment, profile and download views from
+# grades/async_views.py. Only worth it when running under ASGI (asgi.py).
+GRADES_ASYNC_VIEWS = bool(os.environ.get('GRADES_ASYNC_VIEWS'))
+
+# Seconds to share each user's group names across requests in the default
+# cache (see grades/roles.py); 0 loads them once per request. Use a shared
+# cache backend when running more than one process.
+GRADES_ROLE_CACHE_TIMEOUT = int(os.environ.get('GRADES_ROLE_CACHE_TIMEOUT', 0))
+
+# Seconds to keep rendered pages and fragments (the assignment list, grade
+# tables, assignment headers) in the default cache; 0 turns it off. Entries
+# are invalidated when the data behind them changes (see grades/fragments.py),
+# so this needs a shared cache backend when running more than one process.
+GRADES_FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('GRADES_FRAGMENT_CACHE_TIMEOUT', 0))
+
+# Fingerprint each new upload for the similarity reports (see
+# grades/similarity.py) before the upload's response is sent, instead of in
+# a background thread of the worker process
+GRADES_INDEX_IN_REQUEST = bool(os.environ.get('GRADES_INDEX_IN_REQUEST'))
+
+# Directory where each worker process writes its request metrics, which
+# /metrics/ adds up (see grades/metrics.py). Every process must use the same
+# directory; empty turns metrics off.
+GRADES_METRICS_DIR = os.environ.get('GRADES_METRICS_DIR', str(BASE_DIR / '.metrics'))
+# Lets a Prometheus scraper read /metrics/ with "Authorization: Bearer <token>"
+# instead of an admin session
+GRADES_METRICS_TOKEN = os.environ.get('GRADES_METRICS_TOKEN', '')
+
+# Where request profiles are kept (see grades/profiling.py), and how many.
+# Superusers profile a request with ?profile=1; with a sample rate of N, one
+# in N of all requests is profiled too (0 for none). Empty turns it off.
+GRADES_PROFILE_DIR = os.environ.get('GRADES_PROFILE_DIR', str(BASE_DIR / '.profiles'))
+GRADES_PROFILE_KEEP = int(os.environ.get('GRADES_PROFILE_KEEP', 50))
+GRADES_PROFILE_SAMPLE_RATE = int(os.environ.get('GRADES_PROFILE_SAMPLE_RATE', 0))
+# Record the values of SQL parameters in profiles, not just their types
+GRADES_PROFILE_SQL_PARAMS = bool(os.environ.get('GRADES_PROFILE_SQL_PARAMS'))
+
 LOGIN_URL = "/profile/login/"
\ No newline at end of file
@@ -14,17 +14,37 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path
-from grades import views
+from django.urls import include, path
+from grades import views, async_views, api
+
+# Under ASGI, the async views keep slow clients from each holding a thread
+pages = async_views if settings.GRADES_ASYNC_VIEWS else views
+
+# Everything in a course, under /<course slug>/
+course_urls = [
+    path('', pages.index, name='index'),
+    path('profile/', pages.profile, name='profile'),
+    path('export/', views.export_gradebook, name='export_gradebook'),
+    path('<int:assignment_id>/', pages.assignment, name='assignment'),
+    path('<int:assignment_id>/submissions/', views.submissions, name='submissions'),
+    path('<int:assignment_id>/submissions/import/', views.import_grades, name='import_grades'),
+    path('<int:assignment_id>/similar/', views.similar_submissions, name='similar_submissions'),
+    path('api/<int:assignment_id>/status/', api.status, name='api_status'),
+    path('api/<int:assignment_id>/submission/', api.upload, name='api_upload'),
+    path('api/<int:assignment_id>/grades/', api.grades, name='api_grades'),
+    path('api/<int:assignment_id>/stats/', api.stats, name='api_stats'),
+    path('uploads/submissions/<str:filename>', pages.show_upload, name='show_upload'),
+]
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('', views.index),
-    path('profile/', views.profile),
+    path('', views.course_list, name='courses'),
     path('profile/login/', views.login_form),
     path('profile/logout/', views.logout_form),
-    path('<int:assignment_id>/', views.assignment, name='assignment'),
-    path('<int:assignment_id>/submissions/', views.submissions, name='submissions'),
-    path('uploads/submissions/<str:filename>', views.show_upload),
+    path('metrics/', views.show_metrics, name='metrics'),
+    path('profiles/', views.profiles, name='profiles'),
+    path('profiles/<str:profile_id>/', views.show_profile, name='show_profile'),
+    path('<slug:course>/', include(course_urls)),
 ]
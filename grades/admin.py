@@ -1,5 +1,25 @@
-from django.contrib import admin
-from .models import Assignment, Submission
+from django.contrib import admin, messages
+from .models import Assignment, Course, Submission
+from . import courses, rebalance
+
+@admin.register(Course)
+class CourseAdmin(admin.ModelAdmin):
+    list_display = ['slug', 'title', 'database', 'moving']
+    # Changed by the move_course command, which also copies the course's data
+    readonly_fields = ['database', 'moving']
+
+@admin.register(Assignment)
+class AssignmentAdmin(admin.ModelAdmin):
+    actions = ['rebalance_graders']
+    # Follows the deadline (see grades/deadlines.py)
+    readonly_fields = ['past_due']
+
+    @admin.action(description="Rebalance ungraded submissions across TAs")
+    def rebalance_graders(self, request, queryset):
+        moved = 0
+        for assignment in queryset:
+            with courses.activate(assignment.course):
+                moved += len(rebalance.rebalance(assignment))
+        self.message_user(request, f"Moved {moved} submission(s)", messages.SUCCESS)
 
-admin.site.register(Assignment)
 admin.site.register(Submission)
@@ -0,0 +1,127 @@
+"""
+JSON versions of the assignment page's upload form and the submissions
+page's grading form, used by static/main.js in place of a full page
+reload. Each response carries only what the page needs to update: the
+student's new status line, any errors keyed by form field, and the
+assignment's counters.
+
+The forms still post to the HTML views when JavaScript is off; these
+endpoints share their code (views.submission_status_message,
+views.save_upload and grade_import) so the two can't disagree.
+"""
+from django.shortcuts import get_object_or_404
+from django.http import JsonResponse
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_GET, require_POST
+from . import models, counters, grade_import, grade_stats, roles, uploads, views
+from .courses import course_view
+from .gradebook import is_due
+
+def _assignment_with_counts(course, assignment_id, user):
+    return get_object_or_404(
+        counters.with_counts(models.Assignment.objects.filter(course=course), user, course), id=assignment_id
+    )
+
+def _counts(assignment, user):
+    """The counters shown on the assignment and profile pages."""
+    return {
+        'total_submissions': assignment.total_submissions,
+        'graded_submissions': assignment.graded_submissions,
+        'total_students': assignment.total_students,
+        'your_submissions': assignment.total_submissions if user.is_superuser else assignment.your_submissions,
+        'your_graded': assignment.graded_submissions if user.is_superuser else assignment.your_graded,
+    }
+
+def _submission(submission):
+    if submission is None:
+        return None
+    return {
+        'id': submission.id,
+        'served_name': submission.served_name,
+        'download_url': submission.download_url,
+        'score': submission.score,
+    }
+
+def _status(course, assignment, user):
+    """The user's status line and submission, or the counters for graders."""
+    if roles.is_ta(user, course) or user.is_superuser:
+        return {'counts': _counts(assignment, user)}
+    submission = assignment.submission_set.filter(author=user).order_by('id').first()
+    past_due = is_due(assignment.deadline)
+    return {
+        'status': views.submission_status_message(assignment, submission, past_due),
+        'past_due': past_due,
+        'submission': _submission(submission),
+    }
+
+@login_required
+@require_GET
+@course_view
+def status(request, course, assignment_id):
+    assignment = _assignment_with_counts(course, assignment_id, request.user)
+    return JsonResponse(_status(course, assignment, request.user))
+
+@login_required
+@csrf_exempt
+@require_POST
+@course_view
+def upload(request, course, assignment_id):
+    # Same as views.assignment: the upload handler goes in before anything
+    # reads request.POST, so the CSRF check happens inside
+    request.upload_handlers = [uploads.PdfUploadHandler(request)]
+    return _upload(request, course, assignment_id)
+
+@csrf_protect
+def _upload(request, course, assignment_id):
+    user = request.user
+    if not roles.is_student(user, course):
+        raise PermissionDenied("Only students can submit assignments")
+    assignment = _assignment_with_counts(course, assignment_id, user)
+
+    uploaded_file = request.FILES.get('submission_file')
+    upload_error = getattr(request, 'upload_error', None)
+    if upload_error or not uploaded_file:
+        return JsonResponse({
+            'errors': {'submission_file': [upload_error or "Please choose a PDF file to upload"]}
+        }, status=400)
+
+    submission = assignment.submission_set.filter(author=user).order_by('id').first()
+    views.save_upload(assignment, user, submission, uploaded_file)
+    return JsonResponse(_status(course, assignment, user))
+
+@login_required
+@require_POST
+@course_view
+def grades(request, course, assignment_id):
+    """
+    Saves the grade-<id> fields of the submissions form. Valid grades are
+    saved even if others fail, in which case the response is a 400 listing
+    the errors by submission id, alongside the updated counters.
+    """
+    user = request.user
+    if not (roles.is_ta(user, course) or user.is_superuser):
+        raise PermissionDenied("Only TAs can grade submissions")
+    assignment = get_object_or_404(models.Assignment, course=course, id=assignment_id)
+
+    result = grade_import.import_grades(assignment, user, grade_import.form_rows(request.POST))
+    response = result.as_dict()
+    # Read the counters after the save, in one more query
+    response['counts'] = _counts(_assignment_with_counts(course, assignment_id, user), user)
+    failed = result.errors or result.general_errors
+    return JsonResponse(response, status=400 if failed else 200)
+
+@login_required
+@require_GET
+@course_view
+def stats(request, course, assignment_id):
+    """The assignment's score statistics and the course's final grade statistics (see grade_stats.py)."""
+    user = request.user
+    if not (roles.is_ta(user, course) or user.is_superuser):
+        raise PermissionDenied("Only TAs can see grade statistics")
+    assignment = _assignment_with_counts(course, assignment_id, user)
+    return JsonResponse({
+        'assignment': grade_stats.assignment_stats(course, assignment),
+        'final_grades': grade_stats.final_grade_stats(course),
+    })
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class GradesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'grades'
+
+    def ready(self):
+        # Keep the denormalized tables in sync with model changes
+        from . import signals
+        # Count and time the SQL of every request for the metrics, and
+        # record the SQL of profiled requests
+        from django.db.backends.signals import connection_created
+        from . import metrics, profiling
+        connection_created.connect(metrics.install_sql_hook)
+        connection_created.connect(profiling.install_sql_hook)
@@ -0,0 +1,154 @@
+"""
+Async versions of the index, assignment, profile and show_upload views,
+for serving under ASGI (graderific/asgi.py). graderific/urls.py routes to
+them instead of the ones in views.py when GRADES_ASYNC_VIEWS is set.
+
+Django's ASGI handler reads the request body before calling any view, so
+a slow uploader never holds a thread. What does hold resources is
+everything after that: a sync view gets a thread of its own for the whole
+request, and its file response is read into memory in full before
+sending. These views only leave the event loop for database work and
+file reads, and stream files a chunk at a time.
+
+Simple queries use the async ORM. Anything that needs a transaction or
+several queries in a row (creating a submission, the cached index page
+and grade table) runs through sync_to_async in one hop, since Django's
+async ORM can't run transactions and each async query is its own trip to
+a worker thread. Templates render through sync_to_async too, so rendering
+never blocks the event loop and a template may touch the database.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, aget_object_or_404
+from django.http import Http404, HttpResponse
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from . import models, counters, roles, serving, uploads, views
+from .courses import course_view
+from .gradebook import is_due
+from .views import is_pdf
+
+async def is_student(user, course):
+    return course.students_id in await roles.agroup_ids(user)
+
+async def is_ta(user, course):
+    return course.teaching_assistants_id in await roles.agroup_ids(user)
+
+@login_required
+@course_view
+async def index(request, course):
+    return HttpResponse(await sync_to_async(views.index_page)(course))
+
+@login_required
+@course_view
+@csrf_exempt
+async def assignment(request, course, assignment_id):
+    # Same as views.assignment: the upload handler goes in before anything
+    # reads request.POST, so the CSRF check happens inside
+    request.upload_handlers = [uploads.PdfUploadHandler(request)]
+    if request.method == "POST":
+        # Parsing writes the upload out to the staging directory
+        await asyncio.to_thread(lambda: request.POST)
+    return await _assignment(request, course, assignment_id)
+
+@csrf_protect
+async def _assignment(request, course, assignment_id):
+    user = await request.auser()
+    # The assignment and all of its counters come back in a single query
+    assignment = await aget_object_or_404(
+        counters.with_counts(models.Assignment.objects.filter(course=course), user, course), id=assignment_id
+    )
+    is_authenticated = user.is_authenticated
+    is_student_user = await is_student(user, course) or not is_authenticated
+    is_ta_user = await is_ta(user, course)
+    is_admin = user.is_superuser
+
+    total_submissions = assignment.total_submissions
+    total_students = assignment.total_students
+    your_submissions = total_submissions if is_admin else assignment.your_submissions
+
+    # Get the user's own submission if they're a student
+    user_submission = None
+    submission_status = "No current submission"
+    past_due = is_due(assignment.deadline)
+    file_error = None
+
+    if is_authenticated and is_student_user:
+        user_submission = await assignment.submission_set.filter(author=user).order_by('id').afirst()
+
+        submission_status = views.submission_status_message(assignment, user_submission, past_due)
+
+    # Handle file upload
+    if request.method == "POST" and is_authenticated:
+        uploaded_file = request.FILES.get('submission_file')
+        upload_error = getattr(request, 'upload_error', None)
+
+        if upload_error and is_student_user:
+            file_error = upload_error
+        elif uploaded_file and is_student_user:
+            await sync_to_async(views.save_upload)(assignment, user, user_submission, uploaded_file)
+            return redirect(f"/{course.slug}/{assignment_id}/")
+
+    return await sync_to_async(render)(request, "assignment.html", {
+        'title': f'{assignment.title} - {course.title}',
+        'course': course,
+        'assignment': assignment,
+        'total_submissions': total_submissions,
+        'your_submissions': your_submissions,
+        'total_students': total_students,
+        'user_submission': user_submission,
+        'submission_status': submission_status,
+        'past_due': past_due,
+        'file_error': file_error,
+        'user': user,
+        'is_student': is_student_user,
+        'is_ta': is_ta_user,
+        'is_admin': is_admin
+    })
+
+@login_required
+@course_view
+async def profile(request, course):
+    user = await request.auser()
+    is_authenticated = user.is_authenticated
+    is_student_user = await is_student(user, course) or not is_authenticated
+    is_ta_user = await is_ta(user, course)
+    is_admin = user.is_superuser
+
+    return await sync_to_async(render)(request, "profile.html", {
+        'title': f'Your Grades - {course.title}',
+        'course': course,
+        'grade_table': await sync_to_async(views.grade_table)(user, course, is_student_user, is_ta_user, is_admin),
+        'user': user,
+        'is_student': is_student_user,
+        'is_ta': is_ta_user,
+        'is_admin': is_admin
+    })
+
+@login_required
+@course_view
+async def show_upload(request, course, filename):
+    try:
+        submission = await models.Submission.objects.filter(assignment__course=course, served_name=filename).afirst()
+
+        if not submission:
+            raise Http404(f"File {filename} not found")
+
+        try:
+            file = submission.view_submission(await request.auser())
+        except PermissionDenied:
+            raise PermissionDenied("You are not authorized to view this file")
+
+        # Verify it's a PDF, unless it was already checked when uploaded
+        if not submission.sha256 and not await asyncio.to_thread(is_pdf, file):
+            raise Http404("Invalid PDF file")
+
+        return await serving.aserve_file(
+            request, file, submission.served_name, content_type='application/pdf',
+            etag=f'"{submission.sha256}"' if submission.sha256 else None
+        )
+
+    except Exception as e:
+        raise Http404(f"Error retrieving file: {str(e)}")
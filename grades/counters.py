@@ -0,0 +1,167 @@
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from . import courses, models
+
+def _bump(model, lookup, **deltas):
+    """Atomically add the deltas to the counter row matching lookup, creating it if needed."""
+    changes = {name: F(name) + delta for name, delta in deltas.items() if delta}
+    if not changes:
+        return
+    if not model.objects.filter(**lookup).update(**changes):
+        model.objects.get_or_create(**lookup)
+        model.objects.filter(**lookup).update(**changes)
+
+def _is_graded(score):
+    return 1 if score is not None else 0
+
+def record_change(old, new, claimed=False):
+    """
+    Update the counters for one submission going from `old` to `new`, each a
+    dict of assignment_id, grader_id and score (None for a created or
+    deleted submission). `claimed` means the new grader's load was already
+    counted by grader_assignment.claim_grader.
+    """
+    for state, sign in ((old, -1), (new, 1)):
+        if state is None:
+            continue
+        graded = _is_graded(state['score'])
+        _bump(models.AssignmentCounter, {'assignment_id': state['assignment_id']},
+              submissions=sign, graded=sign * graded)
+        if state['grader_id'] is not None:
+            assigned = 0 if claimed and state is new else sign
+            _bump(models.GraderLoad, {'assignment_id': state['assignment_id'], 'grader_id': state['grader_id']},
+                  assigned=assigned, graded=sign * graded)
+
+def record_save(submission, old, created):
+    """Counter bookkeeping for Submission.save(); `old` is the state as loaded."""
+    new = {
+        'assignment_id': submission.assignment_id,
+        'grader_id': submission.grader_id,
+        'score': submission.score
+    }
+    if created:
+        record_change(None, new, claimed=getattr(submission, '_grader_claimed', False))
+        return
+    if old is None:
+        # Instance wasn't loaded from the database, so we can't tell what changed
+        return
+    if (old['assignment_id'], old['grader_id'], _is_graded(old['score'])) != \
+            (new['assignment_id'], new['grader_id'], _is_graded(new['score'])):
+        record_change(old, new)
+
+def record_regrades(submissions):
+    """
+    Counter bookkeeping for a bulk_update of scores, which skips the save
+    signals. Every submission must have been loaded from the database.
+    """
+    graded = {}
+    loads = {}
+    for submission in submissions:
+        delta = _is_graded(submission.score) - _is_graded(submission._loaded['score'])
+        submission._loaded['score'] = submission.score
+        if not delta:
+            continue
+        graded[submission.assignment_id] = graded.get(submission.assignment_id, 0) + delta
+        if submission.grader_id is not None:
+            key = (submission.assignment_id, submission.grader_id)
+            loads[key] = loads.get(key, 0) + delta
+
+    for assignment_id, delta in graded.items():
+        _bump(models.AssignmentCounter, {'assignment_id': assignment_id}, graded=delta)
+    for (assignment_id, grader_id), delta in loads.items():
+        _bump(models.GraderLoad, {'assignment_id': assignment_id, 'grader_id': grader_id}, graded=delta)
+
+def recount_grader_loads(assignment):
+    """Recount every grader's load for one assignment after bulk reassignments."""
+    graded = Count('id', filter=Q(score__isnull=False))
+    rows = {
+        row['grader']: row
+        for row in assignment.submission_set.filter(grader__isnull=False)
+            .values('grader').annotate(total=Count('id'), done=graded).order_by()
+    }
+    models.GraderLoad.objects.filter(assignment=assignment).exclude(grader_id__in=rows).update(assigned=0, graded=0)
+    models.GraderLoad.objects.bulk_create(
+        [
+            models.GraderLoad(assignment=assignment, grader_id=grader_id, assigned=row['total'], graded=row['done'])
+            for grader_id, row in rows.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['assignment', 'grader'],
+        update_fields=['assigned', 'graded']
+    )
+
+def recount_groups(group_ids):
+    """Recount the members of the given groups. Membership changes are rare, so a COUNT is fine."""
+    for group in models.Group.objects.filter(id__in=group_ids):
+        models.GroupSize.objects.update_or_create(
+            group=group, defaults={'size': group.user_set.count()}
+        )
+
+def with_counts(assignments, user, course):
+    """
+    Annotates an Assignment queryset with its submission counters, the
+    user's grading load and the size of the course's students group, all
+    read in the same query: total_submissions, graded_submissions,
+    your_submissions, your_graded and total_students.
+    """
+    counter = models.AssignmentCounter.objects.filter(assignment=OuterRef('pk'))
+    load = models.GraderLoad.objects.filter(assignment=OuterRef('pk'), grader_id=user.id)
+    # Read from the course's database, which has a copy of the group sizes
+    students = models.GroupSize.objects.filter(group_id=course.students_id)
+    return assignments.annotate(
+        total_submissions=Coalesce(Subquery(counter.values('submissions')), 0),
+        graded_submissions=Coalesce(Subquery(counter.values('graded')), 0),
+        your_submissions=Coalesce(Subquery(load.values('assigned')), 0),
+        your_graded=Coalesce(Subquery(load.values('graded')), 0),
+        total_students=Coalesce(Subquery(students.values('size')), 0)
+    )
+
+def _groups(course):
+    return [course.students_id, course.teaching_assistants_id]
+
+def snapshot(course):
+    """
+    All of the course's nonzero counter rows as sets of tuples, used to
+    check for drift. A row of zeros means the same thing as a missing row.
+    Reads the course tables from the active course's database.
+    """
+    return {
+        'assignments': set(
+            models.AssignmentCounter.objects.filter(assignment__course=course).exclude(submissions=0, graded=0)
+            .values_list('assignment_id', 'submissions', 'graded')
+        ),
+        'graders': set(
+            models.GraderLoad.objects.filter(assignment__course=course).exclude(assigned=0, graded=0)
+            .values_list('assignment_id', 'grader_id', 'assigned', 'graded')
+        ),
+        'groups': set(
+            models.GroupSize.objects.filter(group_id__in=_groups(course)).exclude(size=0)
+            .values_list('group_id', 'size')
+        )
+    }
+
+def rebuild(course):
+    """
+    Recompute the course's counters from its submissions and groups, with
+    the course active. The group sizes are copied to the course's database.
+    """
+    submissions = models.Submission.objects.filter(assignment__course=course)
+    models.AssignmentCounter.objects.filter(assignment__course=course).delete()
+    models.GraderLoad.objects.filter(assignment__course=course).delete()
+
+    graded = Count('id', filter=Q(score__isnull=False))
+    models.AssignmentCounter.objects.bulk_create(
+        models.AssignmentCounter(assignment_id=row['assignment'], submissions=row['total'], graded=row['done'])
+        for row in submissions.values('assignment').annotate(total=Count('id'), done=graded).order_by()
+    )
+    models.GraderLoad.objects.bulk_create(
+        models.GraderLoad(assignment_id=row['assignment'], grader_id=row['grader'], assigned=row['total'], graded=row['done'])
+        for row in submissions.filter(grader__isnull=False)
+            .values('assignment', 'grader').annotate(total=Count('id'), done=graded).order_by()
+    )
+    models.GroupSize.objects.filter(group_id__in=_groups(course)).delete()
+    models.GroupSize.objects.bulk_create(
+        models.GroupSize(group=group, size=group.members)
+        for group in models.Group.objects.filter(id__in=_groups(course)).annotate(members=Count('user'))
+    )
+    courses.sync_members(course)
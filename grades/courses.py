@@ -0,0 +1,328 @@
+"""
+Courses, and the databases their data lives in.
+
+Every course has its own assignments and two groups: its students and its
+teaching assistants. Users, groups, sessions and the Course rows
+themselves are kept in the default database. A course's assignments,
+submissions and the tables derived from them (COURSE_MODELS) live in the
+database its `database` field names, which can be any alias in DATABASES,
+including those added with GRADES_SHARDS in settings.py. Courses can share
+a database, and the move_course command moves one to another, so a course
+in the middle of a deadline rush can have a database to itself.
+
+CourseRouter sends the course tables' queries to the database of the
+active course. Views get their course from the URL and activate it with
+the course_view decorator; commands use `with activate(course)`. Queries
+through an object loaded from one database stay on that database.
+Transactions have to name the database as well, so course code uses
+atomic() and database() from here rather than Django's defaults. Reads
+may then go to a replica of the database (see grades/replicas.py).
+
+The course tables refer to users and to the course, and the grading page
+sorts by username, so a course outside the default database gets copies
+of its Course row, its groups and their sizes, and their members, made by
+sync_members and kept up to date by the handlers in grades/signals.py.
+The copies of users have unusable passwords: logging in and role checks
+always read the default database.
+"""
+import contextlib
+import contextvars
+import functools
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import Group, User
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import CharField, Q, Value
+from django.db.models.functions import Cast, Concat
+from django.http import Http404, HttpResponse
+from . import replicas, roles
+
+# The tables that belong to a course and live in its database
+COURSE_MODELS = {
+    'grades.Assignment',
+    'grades.Submission',
+    'grades.AssignmentCounter',
+    'grades.GraderLoad',
+    'grades.StudentGrade',
+}
+
+# Top-level URLs that a course with the same slug would hide
+RESERVED_SLUGS = {'admin', 'metrics', 'profile', 'profiles', 'static', 'uploads'}
+
+# Rows copied per query by sync_members and copy_users
+BATCH_SIZE = 2000
+
+# The course whose database the course tables are read from and written to
+_active = contextvars.ContextVar('grades_course', default=None)
+
+def validate_slug(slug):
+    if slug in RESERVED_SLUGS:
+        raise ValidationError(f"The address /{slug}/ is already used by another page")
+
+def current():
+    """The active course, or None."""
+    return _active.get()
+
+def database():
+    """The active course's database, or the default one if no course is active."""
+    course = _active.get()
+    return course.database if course is not None else DEFAULT_DB_ALIAS
+
+@contextlib.contextmanager
+def activate(course):
+    """Routes the course tables to this course's database inside the block."""
+    token = _active.set(course)
+    try:
+        yield course
+    finally:
+        _active.reset(token)
+
+def atomic(**kwargs):
+    """transaction.atomic() on the active course's database."""
+    return transaction.atomic(using=database(), **kwargs)
+
+def course_of(assignment):
+    """The assignment's course: the active one if it is, otherwise read it."""
+    from .models import Course
+    course = _active.get()
+    if course is not None and course.id == assignment.course_id:
+        return course
+    return Course.objects.get(id=assignment.course_id)
+
+def create(slug, title, database=DEFAULT_DB_ALIAS):
+    """
+    Creates a course, with new groups for its students and teaching
+    assistants. Raises ValidationError for a slug that isn't one, is taken
+    or is the address of another page.
+    """
+    from .models import Course
+    with transaction.atomic():
+        course = Course(
+            slug=slug, title=title, database=database,
+            students=Group.objects.create(name=f"{title} Students"),
+            teaching_assistants=Group.objects.create(name=f"{title} Teaching Assistants")
+        )
+        course.full_clean()
+        course.save()
+        return course
+
+def databases():
+    """The databases that hold at least one course, for work that covers every course."""
+    from .models import Course
+    return sorted(set(Course.objects.values_list('database', flat=True)))
+
+def add_argument(parser):
+    """Adds the --course option that course-level management commands take."""
+    parser.add_argument('--course', help="Slug of the course (default: the only course)")
+
+def from_options(options):
+    """The course named by a command's --course option, or the only course there is."""
+    from .models import Course
+    slug = options['course']
+    if slug:
+        try:
+            return Course.objects.get(slug=slug)
+        except Course.DoesNotExist:
+            raise CommandError(f"Course {slug} does not exist")
+    found = list(Course.objects.all()[:2])
+    if not found:
+        raise CommandError("There are no courses")
+    if len(found) > 1:
+        raise CommandError("There are several courses; choose one with --course")
+    return found[0]
+
+def visible_courses(user):
+    """The courses the user is a student or TA in, or every course for an admin."""
+    from .models import Course
+    courses = Course.objects.order_by('title')
+    if user.is_superuser:
+        return courses
+    group_ids = roles.group_ids(user)
+    return courses.filter(Q(students__in=group_ids) | Q(teaching_assistants__in=group_ids))
+
+class CourseRouter:
+    """Routes the COURSE_MODELS to their course's database; see the module docstring."""
+
+    def _database(self, model, hints):
+        if model._meta.label not in COURSE_MODELS:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None:
+            database = self._database_of(instance)
+            if database is None and instance._meta.label in COURSE_MODELS:
+                # A new row goes where the course or assignment it was given is
+                for related in instance._state.fields_cache.values():
+                    database = related and self._database_of(related)
+                    if database:
+                        break
+            if database:
+                return database
+        course = _active.get()
+        return course.database if course is not None else None
+
+    def _database_of(self, instance):
+        if instance._meta.label == 'grades.Course':
+            return instance.database
+        if instance._meta.label in COURSE_MODELS:
+            return instance._state.db
+        return None
+
+    def db_for_read(self, model, **hints):
+        return replicas.for_read(model, self._database(model, hints))
+
+    def db_for_write(self, model, **hints):
+        # Objects read from a replica are saved to its primary
+        return replicas.primary(self._database(model, hints))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._meta.label in COURSE_MODELS and obj2._meta.label in COURSE_MODELS:
+            return replicas.primary(obj1._state.db) == replicas.primary(obj2._state.db)
+        # Courses, groups and users have copies in the course's database
+        return True
+
+def _find(user, slug):
+    from .models import Course
+    course = Course.objects.filter(slug=slug).first()
+    if course is None:
+        raise Http404(f"No course {slug}")
+    if not (user.is_superuser or roles.is_student(user, course) or roles.is_ta(user, course)):
+        raise PermissionDenied("You are not in this course")
+    return course
+
+def _moving(request, course):
+    """While the course is being moved, anything that could write waits."""
+    if course.moving and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        return HttpResponse(
+            "This course is being moved; please try again in a minute.",
+            status=503, headers={'Retry-After': '60'}
+        )
+    return None
+
+def course_view(view):
+    """
+    Replaces the `course` slug from the URL with the Course, after checking
+    that the user is in it, and activates it while the view runs.
+    """
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, course, *args, **kwargs):
+            course = await sync_to_async(_find)(await request.auser(), course)
+            response = _moving(request, course)
+            if response is not None:
+                return response
+            with activate(course):
+                return await view(request, course, *args, **kwargs)
+        return wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, course, *args, **kwargs):
+        course = _find(request.user, course)
+        response = _moving(request, course)
+        if response is not None:
+            return response
+        with activate(course):
+            return view(request, course, *args, **kwargs)
+    return wrapper
+
+def clone(obj):
+    """An unsaved copy of a model instance, with the same primary key."""
+    return type(obj)(**{field.attname: getattr(obj, field.attname) for field in obj._meta.concrete_fields})
+
+def _upsert(model, objects, database):
+    """Inserts the objects into `database`, or updates the rows with their primary keys."""
+    model.objects.using(database).bulk_create(
+        objects,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=[model._meta.pk.name],
+        update_fields=[field.name for field in model._meta.concrete_fields if not field.primary_key]
+    )
+
+def _rename_stale(model, objects, field, database):
+    """
+    Copies of rows since deleted from the default database can hold a
+    unique name that one of `objects` has now. They keep their rows, which
+    old submissions can still refer to, with their id added to the name.
+    """
+    model.objects.using(database).filter(
+        **{f'{field}__in': [getattr(obj, field) for obj in objects]}
+    ).exclude(pk__in=[obj.pk for obj in objects]).update(
+        **{field: Concat(field, Value('#'), Cast('pk', CharField()))}
+    )
+
+def copy_users(users, database):
+    """Copies the users (a queryset) into `database`, without their passwords. Returns how many."""
+    count = 0
+    batch = []
+    for user in users.iterator(chunk_size=BATCH_SIZE):
+        user = clone(user)
+        user.password = '!'
+        batch.append(user)
+        if len(batch) == BATCH_SIZE:
+            _rename_stale(User, batch, 'username', database)
+            _upsert(User, batch, database)
+            count += len(batch)
+            batch = []
+    if batch:
+        _rename_stale(User, batch, 'username', database)
+        _upsert(User, batch, database)
+        count += len(batch)
+    return count
+
+def sync_members(course, user_ids=None, database=None):
+    """
+    Copies the course, its groups and their sizes, and its members (all of
+    them, or only those in `user_ids`) and their memberships into the
+    course's database, or `database`. Does nothing for the default database.
+    """
+    from .models import Course, GroupSize
+    database = database or course.database
+    if database == DEFAULT_DB_ALIAS:
+        return
+    group_ids = [course.students_id, course.teaching_assistants_id]
+    Membership = User.groups.through
+    members = User.objects.filter(groups__in=group_ids).distinct()
+    memberships = Membership.objects.filter(group_id__in=group_ids)
+    copied = Membership.objects.using(database).filter(group_id__in=group_ids)
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        members = members.filter(id__in=user_ids)
+        memberships = memberships.filter(user_id__in=user_ids)
+        copied = copied.filter(user_id__in=user_ids)
+
+    with transaction.atomic(using=database):
+        groups = [clone(group) for group in Group.objects.filter(id__in=group_ids)]
+        _rename_stale(Group, groups, 'name', database)
+        _upsert(Group, groups, database)
+        _upsert(Course, [clone(course)], database)
+        _upsert(GroupSize, [clone(size) for size in GroupSize.objects.filter(group_id__in=group_ids)], database)
+        copy_users(members, database)
+        # Users who left keep their copy, which old submissions still refer to
+        copied.delete()
+        Membership.objects.using(database).bulk_create(
+            (Membership(user_id=user_id, group_id=group_id)
+             for user_id, group_id in memberships.values_list('user_id', 'group_id').iterator()),
+            batch_size=BATCH_SIZE
+        )
+
+def _elsewhere(courses):
+    return courses.exclude(database=DEFAULT_DB_ALIAS)
+
+def sync_groups(group_ids, user_ids=None):
+    """sync_members for every course outside the default database that uses these groups."""
+    from .models import Course
+    group_ids = list(group_ids)
+    for course in _elsewhere(Course.objects.filter(
+        Q(students__in=group_ids) | Q(teaching_assistants__in=group_ids)
+    )):
+        sync_members(course, user_ids)
+
+def sync_user(user):
+    """Copies a changed user into the databases of their courses outside the default one."""
+    from .models import Course
+    for course in _elsewhere(Course.objects.filter(
+        Q(students__user=user) | Q(teaching_assistants__user=user)
+    ).distinct()):
+        sync_members(course, [user.id])
@@ -0,0 +1,68 @@
+"""
+The work that falls due at a deadline, done once by a worker rather than
+by whichever request comes first.
+
+Whether an assignment is past due is one rule, is_due() (from
+grades/gradebook.py): its deadline has passed. Every page, grade, export
+and statistic applies it, so they agree with each other whether or not
+the worker is running. What the worker saves is the cost of the crossing.
+The run_deadlines command sleeps until the next deadline of any course and
+then calls close_due, which closes every assignment whose deadline has
+passed: it recomputes the stored grades of the course's students and bumps
+the fragment versions of everything that shows a status, so the first
+requests after a deadline read fresh rows and cached fragments instead of
+each recomputing them. If the worker is behind or stopped, stored grades
+and cached fragments still expire at the next deadline (see
+StudentGrade.valid_until and fragments.next_deadline), only at the cost of
+recomputing them on read.
+
+An assignment's `past_due` flag records that it was closed, and so which
+deadline comes next. Saving an assignment whose deadline is already past
+(or no longer past) sets the flag at once; see the handler in
+grades/signals.py.
+"""
+from django.utils import timezone
+from . import courses, fragments, models, student_grades
+
+def _open(database):
+    """The open assignments of the courses that keep their data in `database`."""
+    course_ids = models.Course.objects.filter(database=database).values_list('id', flat=True)
+    return models.Assignment.objects.using(database).filter(course_id__in=list(course_ids), past_due=False)
+
+def next_deadline():
+    """The earliest deadline of an assignment that isn't closed yet, in any course, or None."""
+    deadlines = [
+        _open(database).order_by('deadline').values_list('deadline', flat=True).first()
+        for database in courses.databases()
+    ]
+    return min((deadline for deadline in deadlines if deadline is not None), default=None)
+
+def close(course, now=None):
+    """Closes the course's assignments whose deadline has passed. Returns them."""
+    with courses.activate(course), courses.atomic():
+        # is_due, in SQL
+        due = list(models.Assignment.objects.filter(
+            course=course, past_due=False, deadline__lt=now or timezone.now()
+        ).order_by('deadline'))
+        if not due:
+            return []
+        # update() skips the save handlers; the grades and fragments follow here
+        models.Assignment.objects.filter(id__in=[assignment.id for assignment in due]).update(past_due=True)
+        student_grades.refresh_grades(course)
+        fragments.bump(
+            f'assignments:{course.id}', f'grading:{course.id}',
+            *(f'assignment:{course.id}:{assignment.id}' for assignment in due)
+        )
+    return due
+
+def close_due(now=None):
+    """Closes every course's assignments whose deadline has passed. Returns {course: [assignment, ...]}."""
+    now = now or timezone.now()
+    closed = {}
+    for database in courses.databases():
+        course_ids = set(_open(database).filter(deadline__lt=now).values_list('course_id', flat=True))
+        for course in models.Course.objects.filter(id__in=course_ids).order_by('id'):
+            due = close(course, now)
+            if due:
+                closed[course] = due
+    return closed
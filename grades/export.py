@@ -0,0 +1,161 @@
+import csv
+import json
+from decimal import Decimal
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import CharField
+from django.db.models.functions import Cast
+from django.utils import timezone
+from . import models
+from .gradebook import is_due
+
+# Rows fetched per round trip; memory use depends on these, not on the
+# size of the course
+STUDENT_CHUNK = 2000
+SUBMISSION_CHUNK = 5000
+
+# Submission.score's places, as the database backend would return it
+SCORE_PLACES = Decimal(1).scaleb(-models.Submission._meta.get_field('score').decimal_places)
+
+FORMATS = {
+    'csv': ('text/csv', 'gradebook.csv'),
+    'jsonl': ('application/jsonl', 'gradebook.jsonl'),
+}
+
+def _status(score, submitted, past_due):
+    if score is not None:
+        return "Graded"
+    if submitted:
+        return "Ungraded" if past_due else "Submitted"
+    return "Missing" if past_due else "Not Due"
+
+class _Echo:
+    """A file-like object for csv.writer that hands back each line."""
+
+    def write(self, value):
+        return value
+
+def _assignments(course):
+    # The rows are read as a response streams, after the view has returned
+    # and its course is no longer active, so name the database. Whether each
+    # is past due is fixed once, so every row of the export agrees.
+    now = timezone.now()
+    return [
+        (assignment_id, title, weight, points, is_due(deadline, now))
+        for assignment_id, title, weight, points, deadline in
+        models.Assignment.objects.using(course.database).filter(course=course).order_by('deadline', 'id')
+        .values_list('id', 'title', 'weight', 'points', 'deadline')
+    ]
+
+def gradebook_rows(course, assignments=None):
+    """
+    Yields one dict per student in the course's students group, in id
+    order: their score and status on every assignment (ordered by deadline)
+    and their final grade, computed with the same Decimal arithmetic as
+    CourseGradebook. Students and submissions are each read through one
+    chunked iterator, merged by student id, so only one student's row is
+    held at a time. `assignments` saves reading the course's assignments
+    again if the caller has them.
+    """
+    if assignments is None:
+        assignments = _assignments(course)
+    # Primary key order keeps the Decimal sums identical to compute_grade
+    due = [
+        (assignment_id, weight, points)
+        for assignment_id, _, weight, points, past_due in sorted(assignments) if past_due
+    ]
+    available_points = sum(weight for _, weight, _ in due)
+
+    students = models.User.objects.filter(groups=course.students_id).order_by('id').values_list(
+        'id', 'username', 'first_name', 'last_name'
+    ).iterator(chunk_size=STUDENT_CHUNK)
+    # Newest first within each student, so the oldest submission wins. The
+    # students can be in another database; the merge skips everyone else.
+    submissions = models.Submission.objects.using(course.database).filter(
+        assignment__in=[assignment_id for assignment_id, *_ in assignments]
+    ).order_by(
+        'author_id', '-id'
+    ).values_list(
+        # As text: making the Decimal here costs less than the backend's converter
+        'author_id', 'assignment_id', Cast('score', CharField())
+    ).iterator(chunk_size=SUBMISSION_CHUNK)
+
+    pending = next(submissions, None)
+    for user_id, username, first_name, last_name in students:
+        scores = {}
+        while pending is not None and pending[0] <= user_id:
+            author_id, assignment_id, score = pending
+            if author_id == user_id:
+                scores[assignment_id] = None if score is None else Decimal(score).quantize(SCORE_PLACES)
+            pending = next(submissions, None)
+
+        earned = 0
+        for assignment_id, weight, points in due:
+            score = scores.get(assignment_id)
+            if score is not None:
+                earned += (score / points) * weight
+        percentage = (earned / available_points) * 100 if available_points > 0 else 100
+
+        yield {
+            'username': username,
+            'name': f"{first_name} {last_name}".strip(),
+            'assignments': [
+                {
+                    'id': assignment_id,
+                    'title': title,
+                    'score': scores.get(assignment_id),
+                    'status': _status(scores.get(assignment_id), assignment_id in scores, past_due),
+                }
+                for assignment_id, title, _, _, past_due in assignments
+            ],
+            'percentage': round(percentage, 1),
+            'earned_points': round(earned, 1),
+            'available_points': available_points,
+        }
+
+def csv_lines(rows, titles):
+    """
+    CSV lines for gradebook_rows: a score and a status column per
+    assignment, titled in `titles`. The header comes first even if there
+    are no students.
+    """
+    writer = csv.writer(_Echo())
+    header = ['username', 'name']
+    for title in titles:
+        header += [title, f"{title} status"]
+    header += ['percentage', 'earned_points', 'available_points']
+    yield writer.writerow(header)
+    for row in rows:
+        line = [row['username'], row['name']]
+        for assignment in row['assignments']:
+            line += ['' if assignment['score'] is None else assignment['score'], assignment['status']]
+        line += [row['percentage'], row['earned_points'], row['available_points']]
+        yield writer.writerow(line)
+
+def jsonl_lines(rows):
+    """One JSON object per line for gradebook_rows."""
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+def export_lines(course, format):
+    """The course's whole gradebook as lines of text in the given format."""
+    assignments = _assignments(course)
+    rows = gradebook_rows(course, assignments)
+    if format == 'csv':
+        return csv_lines(rows, [title for _, title, *_ in assignments])
+    return jsonl_lines(rows)
+
+async def aexport_lines(lines, batch_size=500):
+    """
+    Serves export lines to an ASGI response without collecting them first:
+    each batch is read in the request's database thread, so the underlying
+    cursors stay on one connection.
+    """
+    def next_batch():
+        return list(islice(lines, batch_size))
+
+    while batch := await sync_to_async(next_batch)():
+        for line in batch:
+            yield line
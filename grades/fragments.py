@@ -0,0 +1,146 @@
+"""
+Cache for rendered pages and page fragments that change rarely.
+
+Each fragment's key includes the current version of every scope it
+depends on. Saving something bumps the versions of the scopes it touches
+(see grades/signals.py), so the next request misses and renders again
+rather than serving stale content. Every scope belongs to one course,
+since assignment ids are only unique within a course's database:
+
+- "assignments:<course id>": any of the course's assignments was created,
+  changed or deleted
+- "assignment:<course id>:<id>": that assignment changed
+- "student:<course id>:<id>": one of that student's submissions changed
+- "grading:<course id>": any of the course's submissions or graders changed
+- "scores:<course id>:<id>": a score on that assignment changed
+
+Fragments showing past-due statuses also expire when the course's next
+deadline passes, so they are right even if run_deadlines, which bumps the
+course's scopes at each deadline, is behind (see grades/deadlines.py).
+Versions are bumped even when caching is off, so
+turning it on never picks up old entries. A fragment is rendered from the
+primary databases even on a request that may read replicas, since a
+replica can lag behind the versions. With several server processes, use a
+shared cache backend such as Redis or Memcached.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from . import courses, models, replicas
+
+# Fragment names, for the statistics
+FRAGMENTS = [
+    'index', 'profile_student', 'profile_grader', 'assignment_header', 'assignment_description',
+    'assignment_stats', 'final_grade_stats',
+]
+
+def timeout():
+    """Seconds to keep a fragment, or 0 when caching is off."""
+    return getattr(settings, 'GRADES_FRAGMENT_CACHE_TIMEOUT', 0)
+
+def _version_key(scope):
+    return f'grades:version:{scope}'
+
+def versions(scopes):
+    """The current version of each scope, in one cache round trip."""
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # Start from the clock, so a version that was evicted can never
+            # come back as one an old fragment was stored under
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+def bump(*scopes):
+    """
+    Invalidate every fragment that depends on any of these scopes, once the
+    current transaction on the active course's database commits. Bumping
+    earlier would let a request that still sees the old data cache it under
+    the new version.
+    """
+    def invalidate():
+        for scope in scopes:
+            try:
+                cache.incr(_version_key(scope))
+            except ValueError:
+                cache.set(_version_key(scope), time.time_ns(), None)
+    transaction.on_commit(invalidate, using=courses.database())
+
+def _count(name, outcome):
+    key = f'grades:fragment-stats:{name}:{outcome}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+def cached(name, parts, scopes, render, expires=None):
+    """
+    Returns the fragment `name` for the key `parts` (e.g. the user id),
+    calling `render` to produce it on a miss. `expires` is a datetime after
+    which it must be rendered again, such as the next deadline.
+    """
+    seconds = timeout()
+    if not seconds:
+        return render()
+    if expires is not None:
+        left = (expires - timezone.now()).total_seconds()
+        if left <= 0:
+            return render()
+        seconds = min(seconds, int(left) + 1)
+
+    key = ':'.join([
+        'grades:fragment', name, *map(str, parts),
+        *(f'{scope}={version}' for scope, version in zip(scopes, versions(scopes)))
+    ])
+    content = cache.get(key)
+    if content is not None:
+        _count(name, 'hits')
+        return content
+    _count(name, 'misses')
+    # From the primary, which has everything the versions above cover
+    with replicas.primary_reads():
+        content = render()
+    cache.set(key, content, seconds)
+    return content
+
+def next_deadline(course):
+    """
+    The course's next deadline still to come, when past-due statuses
+    change, or None. Cached until it passes or an assignment changes, and
+    not looked up at all while caching is off.
+    """
+    if not timeout():
+        return None
+    key = f'grades:next-deadline:{course.id}:{versions([f"assignments:{course.id}"])[0]}'
+    deadline = cache.get(key)
+    if deadline is None:
+        deadline = models.Assignment.objects.filter(course=course, deadline__gte=timezone.now()) \
+            .order_by('deadline').values_list('deadline', flat=True).first()
+        if deadline is None:
+            return None
+        cache.set(key, deadline, max(int((deadline - timezone.now()).total_seconds()), 1))
+    return deadline
+
+def stats():
+    """{name: (hits, misses)} for every fragment."""
+    keys = {
+        (name, outcome): f'grades:fragment-stats:{name}:{outcome}'
+        for name in FRAGMENTS for outcome in ('hits', 'misses')
+    }
+    found = cache.get_many(keys.values())
+    return {
+        name: (found.get(keys[name, 'hits'], 0), found.get(keys[name, 'misses'], 0))
+        for name in FRAGMENTS
+    }
+
+def reset_stats():
+    cache.delete_many([
+        f'grades:fragment-stats:{name}:{outcome}'
+        for name in FRAGMENTS for outcome in ('hits', 'misses')
+    ])
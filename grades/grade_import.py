@@ -0,0 +1,196 @@
+import codecs
+import csv
+import json
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from . import models, counters, courses, fragments, roles, student_grades
+
+# Rows are checked and saved this many at a time, with a fixed number of
+# queries per batch
+BATCH_SIZE = 1000
+
+ID_COLUMNS = ('submission_id', 'submission', 'id')
+SCORE_COLUMNS = ('score', 'grade')
+
+# One grade to apply. `submission_id` is None when it couldn't be read; rows
+# from an import may name the student by `username` instead.
+GradeRow = namedtuple('GradeRow', ['label', 'submission_id', 'username', 'score'])
+
+class GradeResult:
+    """What happened to a batch of grades: per-submission and general errors."""
+
+    def __init__(self):
+        self.updated = 0
+        self.errors = {}
+        self.general_errors = []
+
+    def add_error(self, submission_id, message):
+        self.errors.setdefault(submission_id, []).append(message)
+
+    def as_dict(self):
+        return {
+            'updated': self.updated,
+            'errors': {str(submission_id): messages for submission_id, messages in self.errors.items()},
+            'general_errors': self.general_errors,
+        }
+
+def _submission_id(value):
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        return None
+
+def form_rows(post):
+    """Rows from the grade-<id> fields of the submissions page form."""
+    for key in post:
+        if key.startswith('grade-'):
+            yield GradeRow(key, _submission_id(key.removeprefix('grade-')), None, post[key])
+
+def _record_row(label, record):
+    if not isinstance(record, dict):
+        raise ValueError(f"{label.capitalize()} is not an object")
+    record = {str(key).strip().lower(): value for key, value in record.items()}
+    if 'score' not in record and 'grade' not in record:
+        raise ValueError(f"{label.capitalize()} has no score column")
+    score = next(record[column] for column in SCORE_COLUMNS if column in record)
+    for column in ID_COLUMNS:
+        if record.get(column) not in (None, ''):
+            return GradeRow(label, _submission_id(record[column]), None, score)
+    if record.get('username'):
+        return GradeRow(label, None, str(record['username']).strip(), score)
+    raise ValueError(f"{label.capitalize()} needs a submission_id or username")
+
+def csv_rows(lines):
+    """
+    Rows from CSV text lines with a header row, naming each submission by a
+    submission_id (or id) or a username column, and its score (or grade).
+    """
+    reader = csv.DictReader(lines)
+    try:
+        for record in reader:
+            yield _record_row(f"line {reader.line_num}", record)
+    except csv.Error as e:
+        raise ValueError(f"Line {reader.line_num}: {e}")
+
+def json_rows(lines):
+    """
+    Rows from JSON objects with the same keys as the CSV columns, given as
+    JSON Lines (read one line at a time) or as a single JSON array.
+    """
+    lines = iter(lines)
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        if line.lstrip().startswith('['):
+            records = json.loads(line + ''.join(lines), parse_float=Decimal)
+            for index, record in enumerate(records, 1):
+                yield _record_row(f"row {index}", record)
+            return
+        yield _record_row(f"line {number}", json.loads(line, parse_float=Decimal))
+
+def decode_lines(stream):
+    """Decodes an iterable of UTF-8 byte lines, such as an upload or a request body."""
+    return codecs.iterdecode(stream, 'utf-8-sig')
+
+def parse_score(value, points):
+    """Returns (score, error): None for an empty score, or the reason it's invalid."""
+    if value is None or str(value).strip() == '':
+        return None, None
+    try:
+        score = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        return None, "Grade must be a valid number"
+    if not score.is_finite():
+        return None, "Grade must be a valid number"
+    if score < 0:
+        return None, "Grade cannot be negative"
+    if score > points:
+        return None, f"Grade cannot exceed {points} points"
+    return score, None
+
+def save_grades(course, submissions):
+    """
+    Writes new scores in one bulk update, along with the counters, stored
+    grades and cached fragments that the save signals would otherwise have
+    updated.
+    """
+    with courses.atomic():
+        models.Submission.objects.bulk_update(submissions, ['score'], batch_size=500)
+        counters.record_regrades(submissions)
+        student_grades.refresh_student_grades(course, (s.author_id for s in submissions))
+    fragments.bump(
+        f'grading:{course.id}',
+        *{f'student:{course.id}:{s.author_id}' for s in submissions},
+        *{f'scores:{course.id}:{s.assignment_id}' for s in submissions}
+    )
+
+def _grade_batch(assignment, user, rows, result, dry_run):
+    by_username = {}
+    usernames = {row.username for row in rows if row.username}
+    if usernames:
+        # The student's oldest submission, as in the gradebook
+        by_username = dict(
+            assignment.submission_set.filter(author__username__in=usernames)
+            .order_by('-id').values_list('author__username', 'id')
+        )
+        rows = [row._replace(submission_id=by_username.get(row.username)) if row.username else row for row in rows]
+
+    ids = {row.submission_id for row in rows if row.submission_id is not None}
+    # Only this assignment's submissions, with the permission check done in
+    # the same query
+    found = assignment.submission_set.annotate(can_grade=roles.gradable_by(user)).in_bulk(ids)
+    missing = ids - found.keys()
+    elsewhere = set(
+        models.Submission.objects.filter(id__in=missing, assignment__course=assignment.course_id)
+        .values_list('id', flat=True)
+    ) if missing else set()
+
+    changed = {}
+    for row in rows:
+        submission_id = row.submission_id
+        if row.username and submission_id is None:
+            result.general_errors.append(f"No submission from {row.username} for this assignment")
+            continue
+        if submission_id is None:
+            result.general_errors.append(f"Invalid submission ID format in {row.label}")
+            continue
+        if submission_id in elsewhere:
+            result.general_errors.append(f"Submission {submission_id} does not belong to this assignment")
+            continue
+        if submission_id not in found:
+            result.general_errors.append(f"Submission ID {submission_id} does not exist")
+            continue
+
+        score, error = parse_score(row.score, assignment.points)
+        if error:
+            result.add_error(submission_id, error)
+            continue
+        submission = found[submission_id]
+        if not submission.can_grade:
+            result.general_errors.append(f"You are not authorized to grade submission {submission_id}")
+            continue
+        submission.score = score
+        if score != submission._loaded['score']:
+            changed[submission_id] = submission
+        else:
+            changed.pop(submission_id, None)
+
+    if changed and not dry_run:
+        save_grades(courses.course_of(assignment), list(changed.values()))
+    result.updated += len(changed)
+
+def import_grades(assignment, user, rows, dry_run=False):
+    """
+    Checks and applies grades for one assignment of the active course,
+    BATCH_SIZE rows at a time, with the same rules as
+    Submission.change_grade (roles.can_grade). Valid rows are saved even if
+    others fail. Returns a GradeResult. May raise ValueError for rows that
+    can't be read at all.
+    """
+    result = GradeResult()
+    rows = iter(rows)
+    while batch := list(islice(rows, BATCH_SIZE)):
+        _grade_batch(assignment, user, batch, result, dry_run)
+    return result
@@ -0,0 +1,122 @@
+"""
+Score statistics for an assignment and for the course's final grades,
+shown on the submissions page and served by api.stats.
+
+Each distribution is read as one column of floats, already sorted by the
+database, so the median and percentiles are lookups by position and each
+histogram bin is two binary searches; the mean and standard deviation are
+single passes with math.fsum. Tens of thousands of scores cost one query
+and a few list passes, with no model instances. The distributions are
+cached like fragments (see grades/fragments.py): an assignment's under its
+"scores:<course id>:<id>" and "assignment:<course id>:<id>" scopes, the
+final grades under the course's "grading" and "assignments" scopes. The
+submitted, graded and missing counts come from the live counters.
+"""
+import math
+from bisect import bisect_left
+
+from django.db.models import FloatField, OuterRef, Q, Subquery
+from django.db.models.functions import Cast
+from django.utils import timezone
+from . import fragments, models
+from .gradebook import CourseGradebook, is_due
+
+PERCENTILES = (10, 25, 75, 90)
+
+# Histogram bins between 0 and full marks
+BINS = 10
+
+def _percentile(values, percent):
+    """Linear interpolation between the two nearest ranks, like a spreadsheet's PERCENTILE."""
+    position = (len(values) - 1) * percent / 100
+    low = math.floor(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+def summarize(values, top):
+    """
+    Statistics of `values`, a sorted list of floats, with a histogram of
+    BINS equal bins from 0 to `top`; the last bin also counts anything
+    above `top`, such as extra credit.
+    """
+    count = len(values)
+    edges = [top * i / BINS for i in range(BINS + 1)]
+    cuts = [0, *(bisect_left(values, edge) for edge in edges[1:-1]), count]
+    histogram = [
+        {'from': round(edges[i], 2), 'to': round(edges[i + 1], 2), 'count': cuts[i + 1] - cuts[i]}
+        for i in range(BINS)
+    ]
+    if not count:
+        return {
+            'count': 0, 'mean': None, 'std': None, 'median': None, 'min': None, 'max': None,
+            'percentiles': {str(percent): None for percent in PERCENTILES}, 'histogram': histogram,
+        }
+    mean = math.fsum(values) / count
+    return {
+        'count': count,
+        'mean': round(mean, 2),
+        # Of the whole class, not a sample of it
+        'std': round(math.sqrt(math.fsum((value - mean) ** 2 for value in values) / count), 2),
+        'median': round(_percentile(values, 50), 2),
+        'min': round(values[0], 2),
+        'max': round(values[-1], 2),
+        'percentiles': {str(percent): round(_percentile(values, percent), 2) for percent in PERCENTILES},
+        'histogram': histogram,
+    }
+
+def _scores(assignment):
+    return list(
+        assignment.submission_set.exclude(score=None).order_by('score')
+        .values_list(Cast('score', FloatField()), flat=True)
+    )
+
+def assignment_stats(course, assignment):
+    """
+    The assignment's score distribution (in points) and its counts. The
+    assignment must come from counters.with_counts.
+    """
+    stats = fragments.cached(
+        'assignment_stats', [course.id, assignment.id],
+        [f'scores:{course.id}:{assignment.id}', f'assignment:{course.id}:{assignment.id}'],
+        lambda: summarize(_scores(assignment), assignment.points)
+    )
+    return {
+        **stats,
+        'points': assignment.points,
+        'submitted': assignment.total_submissions,
+        'graded': assignment.graded_submissions,
+        'ungraded': assignment.total_submissions - assignment.graded_submissions,
+        # Students without a submission, once it is too late to submit one
+        'missing': max(assignment.total_students - assignment.total_submissions, 0)
+                   if is_due(assignment.deadline) else None,
+    }
+
+def _final_grades(course):
+    # Each student with their stored grade, if any and still current, in one query
+    stored = models.StudentGrade.objects.filter(
+        Q(valid_until=None) | Q(valid_until__gte=timezone.now()), course=course, student=OuterRef('pk')
+    ).values('percentage')[:1]
+    rows = (
+        models.User.objects.filter(groups=course.students_id)
+        .annotate(percentage=Cast(Subquery(stored), FloatField()))
+        .order_by('percentage').values_list('id', 'percentage')
+    )
+    values, unstored = [], []
+    for student_id, percentage in rows:
+        if percentage is None:
+            unstored.append(student_id)
+        else:
+            values.append(percentage)
+    # Grades not stored yet are computed without being saved, and merged in
+    if unstored:
+        computed = CourseGradebook(course, students=models.User.objects.filter(id__in=unstored)).grades()
+        values = sorted(values + [float(grade['percentage']) for grade in computed.values()])
+    return summarize(values, 100)
+
+def final_grade_stats(course):
+    """The distribution of the course's students' current grades, in percent."""
+    return fragments.cached(
+        'final_grade_stats', [course.id],
+        [f'grading:{course.id}', f'assignments:{course.id}'],
+        lambda: _final_grades(course), expires=fragments.next_deadline(course)
+    )
@@ -0,0 +1,178 @@
+from django.utils import timezone
+from . import models
+
+# CourseGradebook reads only these students' submissions when there are at
+# most this many, and otherwise every submission to the course
+FILTER_AUTHORS_UP_TO = 500
+
+def is_due(deadline, now=None):
+    """
+    Whether an assignment with this deadline is past due: the one rule every
+    page, grade, export and statistic uses.
+    """
+    return deadline < (now or timezone.now())
+
+def student_gradebook(user, course):
+    """
+    Returns every assignment of the course ordered by deadline, each with
+    the student's submission (or None) attached as `assignment.user_submission`.
+    Always runs exactly two queries, however many assignments there are.
+    """
+    assignments = list(models.Assignment.objects.filter(course=course).order_by('deadline'))
+
+    # Newest first, so the oldest submission wins like `.first()` did
+    submissions = {}
+    for submission in models.Submission.objects.filter(
+        author=user, assignment__in=[assignment.id for assignment in assignments]
+    ).order_by('-id'):
+        submissions[submission.assignment_id] = submission
+
+    for assignment in assignments:
+        assignment.user_submission = submissions.get(assignment.id)
+
+    return assignments
+
+def user_submission(assignment, user):
+    """Returns the user's submission for a single assignment, or None."""
+    return assignment.submission_set.filter(author=user).order_by('id').first()
+
+def submission_status(assignment, submission, now=None):
+    """Short status string shown in the student's grade table."""
+    past_due = is_due(assignment.deadline, now)
+
+    if submission and submission.score is not None:
+        # Graded submission
+        percentage = (submission.score / assignment.points) * 100
+        return f"{percentage:.1f}%"
+    elif submission and past_due:
+        # Submitted, not graded, past due
+        return "Ungraded"
+    elif submission:
+        # Submitted, not due
+        return "Submitted"
+    elif past_due:
+        # Not submitted, past due
+        return "Missing"
+    else:
+        # Not submitted, not due
+        return "Not Due"
+
+def grade_from_gradebook(assignments, now=None):
+    """Compute a student's current grade from a loaded gradebook."""
+    if now is None:
+        now = timezone.now()
+    available_points = 0
+    earned_points = 0
+
+    # Sum in primary key order so Decimal rounding matches the old per-query loop
+    for assignment in sorted(assignments, key=lambda a: a.id):
+        submission = assignment.user_submission
+
+        # Assignment is past due date
+        if is_due(assignment.deadline, now):
+            available_points += assignment.weight
+
+            # If student has a graded submission
+            if submission and submission.score is not None:
+                percentage = submission.score / assignment.points
+                earned_points += percentage * assignment.weight
+
+        # Assignment isn't past due and isn't graded - ignore
+
+    # Calculate percentage (prevent division by zero)
+    if available_points > 0:
+        grade_percentage = (earned_points / available_points) * 100
+    else:
+        grade_percentage = 100  # No assignments due yet
+
+    return {
+        'percentage': round(grade_percentage, 1),
+        'available_points': available_points,
+        'earned_points': round(earned_points, 1)
+    }
+
+class CourseGradebook:
+    """
+    A course's whole score matrix, loaded in three queries: the students
+    from the default database, the assignments and submissions from the
+    active course's.
+
+    `scores[j][i]` is student i's score on assignment j (None when missing
+    or ungraded). Grades are computed one assignment column at a time across
+    every student, with the same Decimal arithmetic as compute_grade so the
+    results match it exactly.
+    """
+
+    def __init__(self, course, students=None, now=None):
+        if now is None:
+            now = timezone.now()
+        if students is None:
+            students = models.User.objects.filter(groups=course.students_id)
+        self.course = course
+        self.now = now
+        self.students = list(students.order_by('id').values_list('id', 'username'))
+
+        # Primary key order keeps the Decimal sums identical to compute_grade
+        self.assignments = list(
+            models.Assignment.objects.filter(course=course).order_by('id')
+            .values_list('id', 'weight', 'points', 'deadline')
+        )
+        self.weights = [weight for _, weight, _, _ in self.assignments]
+        self.points = [points for _, _, points, _ in self.assignments]
+        self.past_due = [is_due(deadline, now) for _, _, _, deadline in self.assignments]
+        # Grades computed now stay correct until the next deadline passes
+        self.next_deadline = min(
+            (deadline for _, _, _, deadline in self.assignments if not is_due(deadline, now)),
+            default=None
+        )
+
+        row = {user_id: i for i, (user_id, _) in enumerate(self.students)}
+        column = {assignment_id: j for j, (assignment_id, _, _, _) in enumerate(self.assignments)}
+        self.scores = [[None] * len(self.students) for _ in self.assignments]
+        self.submitted = [[False] * len(self.students) for _ in self.assignments]
+
+        # Oldest submission wins, like `.first()` in the per-student path.
+        # The students can be in another database, so this can't join them.
+        submissions = models.Submission.objects.filter(assignment__in=list(column))
+        if len(row) <= FILTER_AUTHORS_UP_TO:
+            submissions = submissions.filter(author_id__in=list(row))
+        submissions = submissions.order_by('-id').values_list('author_id', 'assignment_id', 'score')
+        for author_id, assignment_id, score in submissions.iterator(chunk_size=5000):
+            i = row.get(author_id)
+            if i is None:
+                # Not (or no longer) one of the students
+                continue
+            j = column[assignment_id]
+            self.scores[j][i] = score
+            self.submitted[j][i] = True
+
+    def grades(self):
+        """Returns a dict of user id to the same dict compute_grade returns."""
+        count = len(self.students)
+        earned = [0] * count
+        available_points = 0
+
+        for j, past_due in enumerate(self.past_due):
+            # Assignments that aren't past due are ignored
+            if not past_due:
+                continue
+            weight, points = self.weights[j], self.points[j]
+            available_points += weight
+            earned = [
+                total if score is None else total + (score / points) * weight
+                for total, score in zip(earned, self.scores[j])
+            ]
+
+        if available_points > 0:
+            percentages = [(total / available_points) * 100 for total in earned]
+        else:
+            percentages = [100] * count  # No assignments due yet
+
+        return {
+            user_id: {
+                'percentage': round(percentage, 1),
+                'available_points': available_points,
+                'earned_points': round(total, 1)
+            }
+            for (user_id, _), percentage, total in zip(self.students, percentages, earned)
+        }
@@ -0,0 +1,65 @@
+from django.db import connections
+from django.db.models import F
+from . import courses, models
+
+def _locked_loads(assignment):
+    """
+    Returns the assignment's GraderLoad rows, locked so that only one claim
+    for this assignment runs at a time. Must be called inside a transaction.
+    """
+    if connections[courses.database()].vendor == 'sqlite':
+        # SQLite has no row locks, but the first write in a transaction takes
+        # the database write lock, which holds off every other claimer until
+        # we commit. Writing before reading also avoids lock-upgrade deadlocks.
+        models.GraderLoad.objects.filter(assignment=assignment).update(assigned=F('assigned'))
+        return models.GraderLoad.objects.filter(assignment=assignment)
+    return models.GraderLoad.objects.select_for_update().filter(assignment=assignment)
+
+def claim_grader(assignment):
+    """
+    Returns the course's TA with the fewest assigned submissions for this
+    assignment and counts one more submission against them, atomically.
+    Returns None if there are no TAs. Cost depends on the number of TAs,
+    not submissions. The assignment's course must be active.
+    """
+    with courses.atomic():
+        loads = _locked_loads(assignment)
+        ta_ids = set(
+            models.User.objects.filter(groups=courses.course_of(assignment).teaching_assistants_id)
+            .values_list('id', flat=True)
+        )
+        if not ta_ids:
+            return None
+
+        current = {load.grader_id: load for load in loads.filter(grader_id__in=ta_ids)}
+        missing = ta_ids - current.keys()
+        if missing:
+            # First claim since these TAs joined; start their load at zero
+            models.GraderLoad.objects.bulk_create(
+                [models.GraderLoad(assignment=assignment, grader_id=grader_id) for grader_id in missing],
+                ignore_conflicts=True
+            )
+            current = {load.grader_id: load for load in loads.filter(grader_id__in=ta_ids)}
+
+        # Pick in Python: row locks can leave a database-side ORDER BY stale
+        load = min(current.values(), key=lambda load: (load.assigned, load.grader_id))
+        models.GraderLoad.objects.filter(pk=load.pk).update(assigned=F('assigned') + 1)
+        return models.User.objects.get(pk=load.grader_id)
+
+def create_submission(assignment, author, file):
+    """Creates a new submission, assigning it to the least-loaded TA."""
+    submission = models.Submission(
+        assignment=assignment,
+        author=author,
+        score=None,
+        file=file
+    )
+    # Write the file out before taking any locks
+    submission.store_file()
+
+    with courses.atomic():
+        submission.grader = claim_grader(assignment)
+        # claim_grader already counted this submission in the grader's load
+        submission._grader_claimed = True
+        submission.save()
+    return submission
@@ -0,0 +1,218 @@
+import asyncio
+import datetime
+import importlib
+import statistics
+import threading
+import time
+import tracemalloc
+import warnings
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.asgi import get_asgi_application
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import clear_url_caches
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from grades import courses, models
+
+BODY_CHUNK = 64 * 1024
+BOUNDARY = 'benchmark-asgi-boundary'
+
+def _use_urlconf():
+    # The URLconf picks its views when imported
+    clear_url_caches()
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+
+def _fake_pdf(size):
+    body = b'%PDF-1.4\n'
+    return body + b'%' * max(size - len(body), 0)
+
+def _multipart(token, pdf):
+    return b''.join([
+        f'--{BOUNDARY}\r\n'.encode(),
+        b'Content-Disposition: form-data; name="csrfmiddlewaretoken"\r\n\r\n',
+        token.encode(), b'\r\n',
+        f'--{BOUNDARY}\r\n'.encode(),
+        b'Content-Disposition: form-data; name="submission_file"; filename="benchmark.pdf"\r\n',
+        b'Content-Type: application/pdf\r\n\r\n',
+        pdf, b'\r\n',
+        f'--{BOUNDARY}--\r\n'.encode(),
+    ])
+
+async def _slow_request(app, method, path, headers, body, rate):
+    """
+    Sends one request straight to the ASGI application the way a server like
+    uvicorn would, as a client that sends and receives `rate` bytes a second.
+    Returns (status, bytes received, seconds).
+    """
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': b'', 'root_path': '', 'headers': headers,
+        'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+    }
+    chunks = [body[i:i + BODY_CHUNK] for i in range(0, len(body), BODY_CHUNK)] or [b'']
+    pending = iter(enumerate(chunks))
+    finished = asyncio.Event()
+    result = {'status': None, 'received': 0}
+
+    async def receive():
+        for i, chunk in pending:
+            await asyncio.sleep(len(chunk) / rate)
+            return {'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+        # Django listens for a disconnect while the view runs
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            result['status'] = message['status']
+        elif message.get('body'):
+            result['received'] += len(message['body'])
+            await asyncio.sleep(len(message['body']) / rate)
+
+    start = time.perf_counter()
+    try:
+        await app(scope, receive, send)
+    finally:
+        finished.set()
+    return result['status'], result['received'], time.perf_counter() - start
+
+class Command(BaseCommand):
+    help = (
+        "Serve downloads and uploads to many slow clients through the ASGI "
+        "application, once with the sync views and once with the async views "
+        "(GRADES_ASYNC_VIEWS), and compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=50,
+                            help="Number of concurrent clients (default: 50)")
+        parser.add_argument('--size', type=int, default=1024,
+                            help="Size of each file in KiB (default: 1024)")
+        parser.add_argument('--rate', type=int, default=2048,
+                            help="Bandwidth of each client in KiB/s (default: 2048)")
+        parser.add_argument('--scenario', choices=['download', 'upload', 'both'], default='both')
+        parser.add_argument('--views', choices=['sync', 'async', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        clients = options['clients']
+        pdf = _fake_pdf(options['size'] * 1024)
+        rate = options['rate'] * 1024
+
+        suffix = get_random_string(6).lower()
+        course = courses.create(f"asgi-benchmark-{suffix}", f"ASGI benchmark {suffix}")
+        students = course.students
+        assignment = models.Assignment.objects.create(
+            course=course,
+            title="ASGI benchmark",
+            description="Scratch assignment created by benchmark_asgi",
+            deadline=timezone.now() + datetime.timedelta(days=365),
+            weight=0,
+            points=1
+        )
+        users = []
+        session_keys = []
+        try:
+            # One student per client, each with a session and a submission
+            requests = {'download': [], 'upload': []}
+            for i in range(clients):
+                user = models.User.objects.create_user(f"asgi-benchmark-{i}-{get_random_string(6)}")
+                users.append(user)
+                user.groups.add(students)
+                submission = models.Submission(assignment=assignment, author=user, file=ContentFile(pdf, name='benchmark.pdf'))
+                submission.save()
+
+                client = Client()
+                client.force_login(user)
+                session_key = client.cookies[settings.SESSION_COOKIE_NAME].value
+                session_keys.append(session_key)
+                token = get_random_string(32)
+                body = _multipart(token, pdf)
+                cookie = f'{settings.SESSION_COOKIE_NAME}={session_key}; {settings.CSRF_COOKIE_NAME}={token}'
+                with courses.activate(course):
+                    download_url = submission.download_url
+                requests['download'].append((
+                    'GET', download_url,
+                    [(b'host', b'localhost'), (b'cookie', cookie.encode())], b''
+                ))
+                requests['upload'].append((
+                    'POST', f'/{course.slug}/{assignment.id}/',
+                    [(b'host', b'localhost'), (b'cookie', cookie.encode()),
+                     (b'content-type', f'multipart/form-data; boundary={BOUNDARY}'.encode()),
+                     (b'content-length', str(len(body)).encode())], body
+                ))
+
+            scenarios = ['download', 'upload'] if options['scenario'] == 'both' else [options['scenario']]
+            modes = ['sync', 'async'] if options['views'] == 'both' else [options['views']]
+
+            self.stdout.write(
+                f"{clients} clients at {options['rate']} KiB/s each, {options['size']} KiB files"
+            )
+            self.stdout.write(
+                f"{'scenario':<10}{'views':<7}{'wall s':>8}{'median s':>10}{'max s':>8}"
+                f"{'threads':>9}{'peak MiB':>10}{'failed':>8}"
+            )
+            for scenario in scenarios:
+                for mode in modes:
+                    row = self.run(scenario, mode, requests[scenario], rate)
+                    self.stdout.write(
+                        f"{scenario:<10}{mode:<7}{row['wall']:>8.2f}{row['median']:>10.2f}{row['max']:>8.2f}"
+                        f"{row['threads']:>9}{row['memory'] / 2**20:>10.1f}{row['failed']:>8}"
+                    )
+        finally:
+            course.delete()
+            course.students.delete()
+            course.teaching_assistants.delete()
+            Session.objects.filter(session_key__in=session_keys).delete()
+            for user in users:
+                user.delete()
+            _use_urlconf()
+
+    def run(self, scenario, mode, requests, rate):
+        with override_settings(GRADES_ASYNC_VIEWS=(mode == 'async')), warnings.catch_warnings():
+            # The sync views' file responses are buffered; that's what we measure
+            warnings.filterwarnings('ignore', 'StreamingHttpResponse must consume synchronous iterators')
+            _use_urlconf()
+            app = get_asgi_application()
+            expected = 200 if scenario == 'download' else 302
+
+            async def main():
+                # Warm up templates, URL resolution and connections first
+                await _slow_request(app, *requests[0], rate=rate * 1000)
+
+                peak_threads = threading.active_count()
+                done = asyncio.Event()
+
+                async def watch_threads():
+                    nonlocal peak_threads
+                    while not done.is_set():
+                        peak_threads = max(peak_threads, threading.active_count())
+                        await asyncio.sleep(0.005)
+
+                watcher = asyncio.create_task(watch_threads())
+                tracemalloc.start()
+                start = time.perf_counter()
+                results = await asyncio.gather(
+                    *(_slow_request(app, *request, rate=rate) for request in requests)
+                )
+                wall = time.perf_counter() - start
+                memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                done.set()
+                await watcher
+
+                times = [seconds for _, _, seconds in results]
+                return {
+                    'wall': wall,
+                    'median': statistics.median(times),
+                    'max': max(times),
+                    'threads': peak_threads,
+                    'memory': memory,
+                    'failed': sum(status != expected for status, _, _ in results),
+                }
+
+            return asyncio.run(main())
@@ -0,0 +1,294 @@
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver
+from grades import courses, models, similarity, synthetic
+
+SCALES = {
+    'small': {'students': 100, 'assignments': 10, 'tas': 4},
+    'medium': {'students': 2000, 'assignments': 30, 'tas': 10},
+    'large': {'students': 20000, 'assignments': 60, 'tas': 40},
+}
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'views.json'
+
+# One request to benchmark. `route` is its full pattern in graderific/urls.py,
+# `user` who makes it (None for anonymous), and `budget` the most queries
+# it may take at any scale. `path` and `data` are called with the Fixture.
+Case = namedtuple('Case', ['name', 'route', 'user', 'method', 'path', 'data', 'budget'])
+
+CASES = [
+    Case('courses', '', 'student', 'GET', lambda f: '/', None, 4),
+    Case('index', '<slug:course>/', 'student', 'GET', lambda f: f'/{f.course.slug}/', None, 5),
+    Case('profile (student)', '<slug:course>/profile/', 'student', 'GET',
+         lambda f: f'/{f.course.slug}/profile/', None, 7),
+    Case('profile (TA)', '<slug:course>/profile/', 'ta', 'GET',
+         lambda f: f'/{f.course.slug}/profile/', None, 5),
+    Case('login', 'profile/login/', None, 'GET', lambda f: '/profile/login/', None, 0),
+    Case('logout', 'profile/logout/', None, 'GET', lambda f: '/profile/logout/', None, 0),
+    Case('metrics', 'metrics/', 'admin', 'GET', lambda f: '/metrics/', None, 2),
+    Case('profiles', 'profiles/', 'admin', 'GET', lambda f: '/profiles/', None, 2),
+    Case('profile detail', 'profiles/<str:profile_id>/', 'admin', 'GET',
+         lambda f: f'/profiles/{f.profile_id()}/', None, 2),
+    Case('export', '<slug:course>/export/', 'admin', 'GET', lambda f: f'/{f.course.slug}/export/', None, 7),
+    Case('assignment (student)', '<slug:course>/<int:assignment_id>/', 'student', 'GET',
+         lambda f: f'/{f.course.slug}/{f.assignment.id}/', None, 6),
+    Case('assignment (TA)', '<slug:course>/<int:assignment_id>/', 'ta', 'GET',
+         lambda f: f'/{f.course.slug}/{f.assignment.id}/', None, 5),
+    Case('upload', '<slug:course>/<int:assignment_id>/', 'student', 'POST',
+         lambda f: f'/{f.course.slug}/{f.assignment.id}/', lambda f: {'submission_file': f.upload()}, 15),
+    Case('submissions', '<slug:course>/<int:assignment_id>/submissions/', 'ta', 'GET',
+         lambda f: f'/{f.course.slug}/{f.assignment.id}/submissions/', None, 8),
+    Case('submissions (admin, page 2)', '<slug:course>/<int:assignment_id>/submissions/', 'admin', 'GET',
+         lambda f: f'/{f.course.slug}/{f.assignment.id}/submissions/?after={f.cursor}', None, 10),
+    Case('save grades', '<slug:course>/<int:assignment_id>/submissions/', 'ta', 'POST',
+         lambda f: f'/{f.course.slug}/{f.assignment.id}/submissions/', lambda f: f.grade_form(), 13),
+    Case('import grades', '<slug:course>/<int:assignment_id>/submissions/import/', 'ta', 'POST',
+         lambda f: f'/{f.course.slug}/{f.assignment.id}/submissions/import/', lambda f: {'grades': f.grade_csv()}, 13),
+    Case('similar submissions', '<slug:course>/<int:assignment_id>/similar/', 'ta', 'GET',
+         lambda f: f'/{f.course.slug}/{f.assignment.id}/similar/', None, 9),
+    Case('api status', '<slug:course>/api/<int:assignment_id>/status/', 'student', 'GET',
+         lambda f: f'/{f.course.slug}/api/{f.assignment.id}/status/', None, 6),
+    Case('api upload', '<slug:course>/api/<int:assignment_id>/submission/', 'student', 'POST',
+         lambda f: f'/{f.course.slug}/api/{f.assignment.id}/submission/', lambda f: {'submission_file': f.upload()}, 17),
+    Case('api grades', '<slug:course>/api/<int:assignment_id>/grades/', 'ta', 'POST',
+         lambda f: f'/{f.course.slug}/api/{f.assignment.id}/grades/', lambda f: f.grade_form(), 14),
+    Case('api stats', '<slug:course>/api/<int:assignment_id>/stats/', 'ta', 'GET',
+         lambda f: f'/{f.course.slug}/api/{f.assignment.id}/stats/', None, 7),
+    Case('download', '<slug:course>/uploads/submissions/<str:filename>', 'student', 'GET',
+         lambda f: f.download_url(), None, 6),
+]
+
+class Fixture:
+    """The users and objects the cases request, picked from the generated course."""
+
+    def __init__(self):
+        self.course = models.Course.objects.get()
+        # The latest past-due assignment, with a full set of submissions
+        self.assignment = models.Assignment.objects.filter(
+            submission__score__isnull=False
+        ).order_by('-deadline').first()
+        self.submission = self.assignment.submission_set.filter(grader__isnull=False) \
+            .select_related('author', 'grader').order_by('id').first()
+        self.admin = models.User.objects.create_superuser('benchmark-admin', password='benchmark')
+        self.users = {
+            'student': self.submission.author,
+            'ta': self.submission.grader,
+            'admin': self.admin,
+        }
+        # One page of the TA's grades, sent back unchanged
+        self.grades = list(
+            self.assignment.submission_set.filter(grader=self.submission.grader)
+            .order_by('id').values_list('id', 'score')[:50]
+        )
+        ids = self.assignment.submission_set.order_by('author__username', 'id').values_list('id', flat=True)
+        self.cursor = ids[49] if len(ids) > 50 else ids[0]
+        self.pdf = synthetic.pdf_stub(0)
+
+    def profile_id(self):
+        # Profile one request the first time a profile is needed
+        if not hasattr(self, '_profile_id'):
+            client = Client()
+            client.force_login(self.admin)
+            self._profile_id = client.get(f'/{self.course.slug}/?profile=1')['X-Profile-Id']
+        return self._profile_id
+
+    def download_url(self):
+        # The upload benchmarks replace the file, and with it the served name
+        self.submission.refresh_from_db(fields=['served_name'])
+        with courses.activate(self.course):
+            return self.submission.download_url
+
+    def upload(self):
+        return SimpleUploadedFile('benchmark.pdf', self.pdf, content_type='application/pdf')
+
+    def grade_form(self):
+        return {f'grade-{id}': '' if score is None else str(score) for id, score in self.grades}
+
+    def grade_csv(self):
+        lines = ['submission_id,score'] + [f"{id},{'' if score is None else score}" for id, score in self.grades]
+        return SimpleUploadedFile('grades.csv', '\n'.join(lines).encode(), content_type='text/csv')
+
+def _consume(response):
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+        response.close()
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic course at each scale in a scratch test database and "
+        "measure the latency, SQL queries and peak memory of every URL, failing "
+        "when a view goes over its query budget or regresses from the baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', nargs='+', choices=list(SCALES), default=['small', 'medium'],
+                            help="Course sizes to run (default: small medium)")
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="Timed requests per URL; the median is reported (default: 5)")
+        parser.add_argument('--only', nargs='+', metavar='NAME',
+                            help="Only run the benchmarks whose names start with these")
+        parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE,
+                            help=f"Baseline file (default: {DEFAULT_BASELINE.relative_to(settings.BASE_DIR)})")
+        parser.add_argument('--save-baseline', action='store_true',
+                            help="Record these results as the new baseline instead of comparing")
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help="Allowed slowdown or memory growth over the baseline, as a "
+                                 "fraction (default: 0.5)")
+
+    def handle(self, *args, **options):
+        self.check_coverage()
+        cases = [
+            case for case in CASES
+            if not options['only'] or case.name.startswith(tuple(options['only']))
+        ]
+        baseline = {}
+        if options['baseline'].exists():
+            baseline = json.loads(options['baseline'].read_text())
+
+        results = {}
+        failures = []
+        # Everything happens in a throwaway database, like the test runner's
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # The test client's requests come from "testserver", read only the
+        # scratch database, and their metrics and profiles are kept apart
+        # from the real ones
+        scratch = tempfile.TemporaryDirectory()
+        hosts = override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            GRADES_METRICS_DIR=os.path.join(scratch.name, 'metrics'),
+            GRADES_PROFILE_DIR=os.path.join(scratch.name, 'profiles'),
+            GRADES_PROFILE_SAMPLE_RATE=0,
+            GRADES_READ_REPLICAS={}
+        )
+        hosts.enable()
+        try:
+            for scale in options['scale']:
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    f"{scale}: " + ", ".join(f"{count} {what}" for what, count in SCALES[scale].items())
+                ))
+                call_command('flush', interactive=False, verbosity=0)
+                synthetic.generate(**SCALES[scale])
+                fixture = Fixture()
+
+                self.stdout.write(
+                    f"  {'view':<30}{'median ms':>10}{'queries':>10}{'peak KiB':>10}"
+                )
+                results[scale] = {}
+                for case in cases:
+                    row = self.measure(case, fixture, options['repeat'])
+                    results[scale][case.name] = row
+                    problems = self.compare(case, row, baseline.get(scale, {}).get(case.name),
+                                            options['tolerance'], options['save_baseline'])
+                    failures += [f"{scale} {case.name}: {problem}" for problem in problems]
+                    line = (
+                        f"  {case.name:<30}{row['median_ms']:>10.1f}"
+                        f"{row['queries']:>5}/{case.budget:<4}{row['peak_kib']:>10.0f}"
+                    )
+                    self.stdout.write(self.style.ERROR(line) if problems else line)
+        finally:
+            hosts.disable()
+            # The uploads' fingerprints are still read from the scratch files
+            similarity.wait_for_index()
+            scratch.cleanup()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['save_baseline']:
+            # Keep the other scales' entries when only some were run
+            for scale, rows in results.items():
+                baseline.setdefault(scale, {}).update(rows)
+            options['baseline'].parent.mkdir(parents=True, exist_ok=True)
+            options['baseline'].write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(f"Saved the baseline to {options['baseline']}")
+
+        if failures:
+            for failure in failures:
+                self.stderr.write(failure)
+            raise CommandError(f"{len(failures)} benchmark(s) failed")
+        self.stdout.write(self.style.SUCCESS("All benchmarks within their budgets"))
+
+    def check_coverage(self):
+        """Every URL must have a benchmark, so new views get budgets too."""
+        def routes(patterns, prefix=''):
+            for pattern in patterns:
+                if not isinstance(pattern, URLResolver):
+                    yield prefix + str(pattern.pattern)
+                elif pattern.namespace is None:
+                    # Included URLs of our own, not another app's like the admin
+                    yield from routes(pattern.url_patterns, prefix + str(pattern.pattern))
+
+        missing = set(routes(get_resolver().url_patterns)) - {case.route for case in CASES}
+        if missing:
+            raise CommandError(f"No benchmark for these URLs: {', '.join(sorted(missing))}")
+
+    def measure(self, case, fixture, repeat):
+        client = Client()
+        if case.user:
+            client.force_login(fixture.users[case.user])
+
+        def request():
+            send = client.post if case.method == 'POST' else client.get
+            data = case.data(fixture) if case.data else None
+            response = send(case.path(fixture), data) if data is not None else send(case.path(fixture))
+            _consume(response)
+            if response.status_code >= 400:
+                raise CommandError(f"{case.name} returned {response.status_code}")
+            return response
+
+        # Warm up templates, URL resolution and caches
+        request()
+
+        # Each request clears the query log as it starts, so start from empty
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            request()
+        # Count now: the captured queries are read from the log lazily
+        query_count = len(queries)
+
+        tracemalloc.start()
+        try:
+            request()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            request()
+            times.append(time.perf_counter() - start)
+
+        return {
+            'median_ms': round(statistics.median(times) * 1000, 2),
+            'queries': query_count,
+            'peak_kib': round(peak / 1024, 1),
+        }
+
+    def compare(self, case, row, baseline, tolerance, saving):
+        problems = []
+        if row['queries'] > case.budget:
+            problems.append(f"{row['queries']} queries, over the budget of {case.budget}")
+        if baseline is None or saving:
+            return problems
+        if row['queries'] > baseline['queries']:
+            problems.append(f"{row['queries']} queries, up from {baseline['queries']}")
+        # Small absolute slack, so noise in very fast views doesn't fail them
+        if row['median_ms'] > baseline['median_ms'] * (1 + tolerance) + 5:
+            problems.append(f"{row['median_ms']:.1f} ms, up from {baseline['median_ms']:.1f} ms")
+        if row['peak_kib'] > baseline['peak_kib'] * (1 + tolerance) + 64:
+            problems.append(f"{row['peak_kib']:.0f} KiB peak, up from {baseline['peak_kib']:.0f} KiB")
+        return problems
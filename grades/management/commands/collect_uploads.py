@@ -0,0 +1,41 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from grades import courses, models, storage
+
+class Command(BaseCommand):
+    help = "Delete stored submission files that no submission references any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help="Only delete files untouched for this many seconds (default: 3600)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="List what would be deleted without deleting it")
+        parser.add_argument('--recount', action='store_true',
+                            help="Recompute every reference count from the submissions table first")
+
+    def handle(self, *args, **options):
+        if options['recount'] and not options['dry_run']:
+            # Files are shared between courses, whichever database they're in
+            totals = Counter()
+            for database in courses.databases():
+                for row in (models.Submission.objects.using(database).exclude(file='')
+                            .values('file').annotate(total=Count('id')).order_by()):
+                    totals[row['file']] += row['total']
+            models.StoredFile.objects.all().delete()
+            models.StoredFile.objects.bulk_create(
+                (models.StoredFile(name=name, refcount=total) for name, total in totals.items()),
+                batch_size=1000
+            )
+
+        deleted = storage.collect_garbage(
+            storage.submission_storage(),
+            min_age=options['min_age'],
+            dry_run=options['dry_run']
+        )
+        if options['verbosity'] > 1:
+            for name in deleted:
+                self.stdout.write(f"  {name}")
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(deleted)} unreferenced file(s)"))
@@ -0,0 +1,53 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from grades import courses, gradebook, models
+from grades.views import compute_grade
+
+class Command(BaseCommand):
+    help = "Compute every student's current grade in one pass over the course gradebook."
+
+    def add_arguments(self, parser):
+        courses.add_argument(parser)
+        parser.add_argument(
+            '--format', choices=['table', 'csv'], default='table',
+            help="Output format (default: table)"
+        )
+        parser.add_argument(
+            '--verify', action='store_true',
+            help="Also run compute_grade for each student and fail on any mismatch"
+        )
+
+    def handle(self, *args, **options):
+        course = courses.from_options(options)
+        with courses.activate(course):
+            self.report(course, options)
+
+    def report(self, course, options):
+        book = gradebook.CourseGradebook(course)
+        grades = book.grades()
+
+        if options['format'] == 'csv':
+            writer = csv.writer(self.stdout)
+            writer.writerow(['username', 'percentage', 'earned_points', 'available_points'])
+            for user_id, username in book.students:
+                grade = grades[user_id]
+                writer.writerow([username, grade['percentage'], grade['earned_points'], grade['available_points']])
+        else:
+            for user_id, username in book.students:
+                grade = grades[user_id]
+                self.stdout.write(
+                    f"{username:<20} {grade['percentage']:>6}%  "
+                    f"{grade['earned_points']}/{grade['available_points']}"
+                )
+
+        if options['verify']:
+            mismatches = 0
+            for user in models.User.objects.filter(id__in=grades.keys()):
+                expected = compute_grade(user, course)
+                if expected != grades[user.id]:
+                    mismatches += 1
+                    self.stderr.write(f"{user.username}: expected {expected}, got {grades[user.id]}")
+            if mismatches:
+                raise CommandError(f"{mismatches} grade(s) differ from compute_grade")
+            self.stderr.write(self.style.SUCCESS(f"All {len(grades)} grades match compute_grade"))
@@ -0,0 +1,43 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from grades import replicas
+
+class Command(BaseCommand):
+    help = (
+        "Copy each SQLite database in GRADES_REPLICAS over its replicas, for "
+        "trying read replicas out locally. With --every, keep copying, like "
+        "replication that lags that far behind."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float,
+                            help="Copy again every this many seconds, until interrupted")
+
+    def handle(self, *args, **options):
+        if not replicas.replicas():
+            raise CommandError("There are no replicas; set GRADES_REPLICAS")
+        for alias in [*replicas.replicas(), *(copy for copies in replicas.replicas().values() for copy in copies)]:
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(f"Database {alias} isn't SQLite; replicate it with its own tools")
+
+        while True:
+            self.copy()
+            if not options['every']:
+                return
+            time.sleep(options['every'])
+
+    def copy(self):
+        for alias, copies in replicas.replicas().items():
+            source = connections[alias]
+            source.ensure_connection()
+            for copy in copies:
+                # SQLite's online backup, so writes to the primary can go on
+                destination = sqlite3.connect(connections[copy].settings_dict['NAME'])
+                try:
+                    source.connection.backup(destination)
+                finally:
+                    destination.close()
+                self.stdout.write(f"Copied {alias} to {copy}")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from grades import courses, export
+
+class Command(BaseCommand):
+    help = (
+        "Write every student's scores, statuses and final grade as CSV or JSON "
+        "Lines, streaming rows so memory use doesn't grow with the course."
+    )
+
+    def add_arguments(self, parser):
+        courses.add_argument(parser)
+        parser.add_argument('--format', choices=list(export.FORMATS), default='csv',
+                            help="Output format (default: csv)")
+        parser.add_argument('--output', help="File to write (default: standard output)")
+
+    def handle(self, *args, **options):
+        lines = export.export_lines(courses.from_options(options), options['format'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,75 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from grades import courses, grade_import, models
+
+class Command(BaseCommand):
+    help = (
+        "Import grades for one assignment from a CSV or JSON file with a score "
+        "column and a submission_id or username column."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('assignment_id', type=int)
+        courses.add_argument(parser)
+        parser.add_argument('file', help="CSV, JSON or JSON Lines file, or - for standard input")
+        parser.add_argument('--format', choices=['csv', 'json'],
+                            help="File format (default: from the file extension, else csv)")
+        parser.add_argument('--user',
+                            help="Grade as this user, with their permissions (default: as an admin)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Check every row but save nothing")
+
+    def handle(self, *args, **options):
+        course = courses.from_options(options)
+        with courses.activate(course):
+            self.import_file(course, options)
+
+    def import_file(self, course, options):
+        try:
+            assignment = models.Assignment.objects.get(course=course, id=options['assignment_id'])
+        except models.Assignment.DoesNotExist:
+            raise CommandError(f"Assignment {options['assignment_id']} does not exist in {course}")
+
+        if options['user']:
+            try:
+                user = models.User.objects.get(username=options['user'])
+            except models.User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+        else:
+            user = models.User(is_superuser=True)
+
+        path = options['file']
+        is_json = options['format'] == 'json' or (
+            options['format'] is None and path.lower().endswith(('.json', '.jsonl'))
+        )
+        parse = grade_import.json_rows if is_json else grade_import.csv_rows
+
+        try:
+            stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        except OSError as e:
+            raise CommandError(f"Could not open {path}: {e.strerror}")
+        try:
+            with courses.atomic():
+                result = grade_import.import_grades(
+                    assignment, user, parse(grade_import.decode_lines(stream)), dry_run=options['dry_run']
+                )
+        except ValueError as e:
+            raise CommandError(f"Could not read grades: {e}")
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+        for submission_id, messages in result.errors.items():
+            for message in messages:
+                self.stderr.write(f"Submission {submission_id}: {message}")
+        for message in result.general_errors:
+            self.stderr.write(message)
+
+        verb = "Would update" if options['dry_run'] else "Updated"
+        summary = f"{verb} {result.updated} grade(s) for {assignment.title}"
+        rejected = sum(map(len, result.errors.values())) + len(result.general_errors)
+        if rejected:
+            self.stdout.write(self.style.WARNING(f"{summary}, {rejected} row(s) rejected"))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from grades import courses, models, similarity, storage
+
+class Command(BaseCommand):
+    help = (
+        "Fingerprint every submitted file that isn't yet, for the similarity "
+        "reports. With --rebuild, fingerprint them all again and drop the "
+        "fingerprints of files no submission uses."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Redo every fingerprint, e.g. after changing the settings in grades/similarity.py")
+
+    def handle(self, *args, **options):
+        # Files are shared between courses, whichever database they're in
+        names = set()
+        for database in courses.databases():
+            names.update(models.Submission.objects.using(database).exclude(file='')
+                         .values_list('file', flat=True).distinct().iterator())
+
+        if options['rebuild']:
+            _, dropped = models.Fingerprint.objects.exclude(name__in=names).delete()
+            self.stdout.write(f"Dropped {dropped.get('grades.Fingerprint', 0)} fingerprint(s) of unused files")
+        else:
+            names -= set(models.Fingerprint.objects.values_list('name', flat=True).iterator())
+
+        files = storage.submission_storage()
+        missing = []
+        for done, name in enumerate(sorted(names), 1):
+            if not similarity.index(name, files, force=options['rebuild']):
+                missing.append(name)
+            if options['verbosity'] > 1 and done % 1000 == 0:
+                self.stdout.write(f"  {done}/{len(names)}")
+        for name in missing:
+            self.stderr.write(f"Could not read {name}")
+        self.stdout.write(self.style.SUCCESS(f"Fingerprinted {len(names) - len(missing)} file(s)"))
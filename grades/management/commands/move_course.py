@@ -0,0 +1,186 @@
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from grades import counters, courses, fragments, models, student_grades
+
+def _chunks(iterable, size=courses.BATCH_SIZE):
+    iterable = iter(iterable)
+    while batch := list(islice(iterable, size)):
+        yield batch
+
+class Command(BaseCommand):
+    help = (
+        "Move a course's assignments, submissions, counters and grades to "
+        "another database, e.g. one added with GRADES_SHARDS. Uploads and "
+        "grading in the course are turned away while it moves; pages can "
+        "still be read."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('course', help="Slug of the course")
+        parser.add_argument('database', help="Alias of the database to move it to")
+        parser.add_argument('--grace', type=float, default=5,
+                            help="Seconds to let requests already writing to the course finish (default: 5)")
+        parser.add_argument('--keep-source', action='store_true',
+                            help="Leave the old rows where they are instead of deleting them")
+        parser.add_argument('--renumber', action='store_true',
+                            help="Give rows whose ids are taken in the target database new ids, and list them; "
+                                 "without it such a move fails")
+
+    def handle(self, *args, **options):
+        try:
+            course = models.Course.objects.get(slug=options['course'])
+        except models.Course.DoesNotExist:
+            raise CommandError(f"Course {options['course']} does not exist")
+        source, target = course.database, options['database']
+        if target not in connections.databases:
+            raise CommandError(f"No database {target}; add it to GRADES_SHARDS")
+        if target == source:
+            raise CommandError(f"{course} is already in {target}")
+        if course.moving:
+            raise CommandError(f"{course} is already being moved")
+        executor = MigrationExecutor(connections[target])
+        if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+            raise CommandError(f"Database {target} isn't up to date; run migrate --database {target}")
+
+        models.Course.objects.filter(pk=course.pk).update(moving=True)
+        try:
+            # Requests that read the course before the flag was set
+            time.sleep(options['grace'])
+            assignments, submissions = self.copy(course, source, target, options['renumber'])
+            moved = models.Course.objects.get(pk=course.pk)
+            moved.database = target
+            self.rebuild(moved)
+            self.verify(course, source, target)
+        except BaseException:
+            # Leave the course where it was, as it was
+            self.delete(course, target)
+            models.Course.objects.filter(pk=course.pk).update(moving=False)
+            raise
+
+        models.Course.objects.filter(pk=course.pk).update(database=target, moving=False)
+        fragments.bump(f'assignments:{course.id}', f'grading:{course.id}')
+        self.stdout.write(f"Copied {assignments} assignment(s) and {submissions} submission(s) to {target}")
+
+        if options['keep_source']:
+            self.stdout.write(f"Left the old rows in {source}")
+        else:
+            self.delete(course, source)
+            self.stdout.write(f"Deleted the old rows from {source}")
+        self.stdout.write(self.style.SUCCESS(f"Moved {course} from {source} to {target}"))
+
+    def taken(self, model, rows, target, renumber):
+        """The ids of these rows that other rows already have in `target`. Only allowed with --renumber."""
+        taken = set(model.objects.using(target).filter(id__in=[row.id for row in rows]).values_list('id', flat=True))
+        if taken and not renumber:
+            ids = ', '.join(map(str, sorted(taken)[:10])) + (', ...' if len(taken) > 10 else '')
+            raise CommandError(
+                f"{model._meta.verbose_name_plural.capitalize()} {ids} have ids that are taken in {target}; "
+                f"pass --renumber to copy them with new ids"
+            )
+        return taken
+
+    def renumbered(self, model, old_id, new_id):
+        # Links and imports that name the old id need the new one
+        self.stdout.write(f"{model._meta.verbose_name} {old_id} is now {new_id}")
+
+    def copy(self, course, source, target, renumber=False):
+        """
+        Copies the course's rows with their ids. Rows whose ids are taken in
+        the target get new ones with `renumber`, and fail the move without
+        it. Returns the counts.
+        """
+        Assignment, Submission = models.Assignment, models.Submission
+        # Rows left behind by --keep-source or a failed move would be copied twice
+        self.delete(course, target)
+        courses.sync_members(course, database=target)
+        submissions = Submission.objects.using(source).filter(assignment__course=course)
+        if target != DEFAULT_DB_ALIAS:
+            # Former members still own submissions or graded them
+            user_ids = set(submissions.values_list('author_id', flat=True))
+            user_ids.update(submissions.exclude(grader=None).values_list('grader_id', flat=True))
+            for batch in _chunks(sorted(user_ids)):
+                courses.copy_users(models.User.objects.filter(id__in=batch), target)
+
+        with transaction.atomic(using=target):
+            remap = {}
+            rows = list(Assignment.objects.using(source).filter(course=course).order_by('id'))
+            taken = self.taken(Assignment, rows, target, renumber)
+            kept = [courses.clone(row) for row in rows if row.id not in taken]
+            Assignment.objects.using(target).bulk_create(kept)
+            remap.update((row.id, row.id) for row in kept)
+            moved = [row for row in rows if row.id in taken]
+            copies = [courses.clone(row) for row in moved]
+            for copy in copies:
+                copy.id = None
+            # bulk_create sets the new ids on SQLite and PostgreSQL
+            Assignment.objects.using(target).bulk_create(copies)
+            for row, copy in zip(moved, copies):
+                remap[row.id] = copy.id
+                self.renumbered(Assignment, row.id, copy.id)
+
+            count = 0
+            for batch in _chunks(submissions.order_by('id').iterator(chunk_size=courses.BATCH_SIZE)):
+                taken = self.taken(Submission, batch, target, renumber)
+                copies = []
+                for row in batch:
+                    copy = courses.clone(row)
+                    copy.assignment_id = remap[row.assignment_id]
+                    if copy.id in taken:
+                        copy.id = None
+                    copies.append(copy)
+                Submission.objects.using(target).bulk_create(copies)
+                for row, copy in zip(batch, copies):
+                    if row.id in taken:
+                        self.renumbered(Submission, row.id, copy.id)
+                count += len(copies)
+
+            # Rows copied with their ids don't advance PostgreSQL's sequences
+            connection = connections[target]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Assignment, Submission]):
+                    cursor.execute(sql)
+        return len(rows), count
+
+    def rebuild(self, course):
+        """Recomputes the counters and stored grades in the course's new database."""
+        with courses.activate(course), transaction.atomic(), courses.atomic():
+            models.StudentGrade.objects.filter(course=course).delete()
+            counters.rebuild(course)
+            student_grades.refresh_grades(course)
+
+    def verify(self, course, source, target):
+        for model, rows in (
+            (models.Assignment, lambda database: models.Assignment.objects.using(database).filter(course=course)),
+            (models.Submission, lambda database: models.Submission.objects.using(database)
+                .filter(assignment__course=course)),
+        ):
+            before, after = rows(source).count(), rows(target).count()
+            if before != after:
+                raise CommandError(
+                    f"{model._meta.verbose_name_plural}: {before} in {source} but {after} in {target}; "
+                    f"the course is still in {source}"
+                )
+
+    def delete(self, course, database):
+        """
+        Deletes the course's rows from a database it isn't in. Plain SQL, so
+        the delete signals don't give up the stored files the copies use.
+        """
+        tables = {model: model._meta.db_table for model in (
+            models.Assignment, models.Submission, models.AssignmentCounter,
+            models.GraderLoad, models.StudentGrade, models.Course
+        )}
+        assignments = f"SELECT id FROM {tables[models.Assignment]} WHERE course_id = %s"
+        with transaction.atomic(using=database), connections[database].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {tables[models.StudentGrade]} WHERE course_id = %s", [course.id])
+            for model in (models.AssignmentCounter, models.GraderLoad, models.Submission):
+                cursor.execute(f"DELETE FROM {tables[model]} WHERE assignment_id IN ({assignments})", [course.id])
+            cursor.execute(f"DELETE FROM {tables[models.Assignment]} WHERE course_id = %s", [course.id])
+            if database != DEFAULT_DB_ALIAS:
+                # The copy of the course row; its groups and users can be shared
+                cursor.execute(f"DELETE FROM {tables[models.Course]} WHERE id = %s", [course.id])
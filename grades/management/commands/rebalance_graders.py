@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from grades import courses, models, rebalance
+
+class Command(BaseCommand):
+    help = "Redistribute ungraded submissions across the course's teaching assistants."
+
+    def add_arguments(self, parser):
+        parser.add_argument('assignment_ids', nargs='*', type=int,
+                            help="Assignments to rebalance (default: all)")
+        courses.add_argument(parser)
+        parser.add_argument('--by', choices=sorted(rebalance.WEIGHTS), default='count',
+                            help="How to measure work: submission count, file size or PDF pages (default: count)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report the moves without saving them")
+
+    def handle(self, *args, **options):
+        course = courses.from_options(options)
+        with courses.activate(course):
+            self.rebalance(course, options)
+
+    def rebalance(self, course, options):
+        assignments = models.Assignment.objects.filter(course=course).order_by('id')
+        if options['assignment_ids']:
+            assignments = assignments.filter(id__in=options['assignment_ids'])
+            if len(assignments) != len(set(options['assignment_ids'])):
+                raise CommandError("Some of those assignments don't exist")
+
+        weight = rebalance.WEIGHTS[options['by']]
+        total = 0
+        for assignment in assignments:
+            moves = rebalance.rebalance(assignment, weight, dry_run=options['dry_run'])
+            total += len(moves)
+            self.stdout.write(f"{assignment}: {len(moves)} submission(s) moved")
+            if options['verbosity'] > 1:
+                for submission, grader_id in moves:
+                    self.stdout.write(f"  submission {submission.id} -> grader {grader_id}")
+
+        verb = "Would move" if options['dry_run'] else "Moved"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {total} submission(s)"))
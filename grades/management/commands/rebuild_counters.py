@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from grades import counters, courses
+
+class Command(BaseCommand):
+    help = "Recompute the submission, grading and group size counters, or check them for drift."
+
+    def add_arguments(self, parser):
+        courses.add_argument(parser)
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only compare the stored counters with the live data; fail if they differ"
+        )
+
+    def handle(self, *args, **options):
+        course = courses.from_options(options)
+        # The group sizes are in the default database as well as the course's
+        with courses.activate(course), transaction.atomic(), courses.atomic():
+            before = counters.snapshot(course)
+            counters.rebuild(course)
+            after = counters.snapshot(course)
+            if options['check']:
+                # Leave the stored counters untouched
+                transaction.set_rollback(True, using=courses.database())
+                transaction.set_rollback(True)
+
+        drift = sum(len(before[key] ^ after[key]) for key in before)
+        if options['check']:
+            if drift:
+                raise CommandError(f"{drift} counter row(s) drifted; run rebuild_counters to fix")
+            self.stdout.write(self.style.SUCCESS("All counters match the live data"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt counters, {drift} row(s) changed"))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from grades import courses, gradebook, models, student_grades
+
+class Command(BaseCommand):
+    help = "Rebuild the stored StudentGrade table from scratch, or check it for drift."
+
+    def add_arguments(self, parser):
+        courses.add_argument(parser)
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only compare the stored grades with the live data; fail if they differ"
+        )
+
+    def handle(self, *args, **options):
+        course = courses.from_options(options)
+        with courses.activate(course):
+            if options['check']:
+                self.check_drift(course)
+                return
+
+            with courses.atomic():
+                models.StudentGrade.objects.filter(course=course).delete()
+                rows = student_grades.refresh_grades(course)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(rows)} student grade(s) in {course}"))
+
+    def check_drift(self, course):
+        live = gradebook.CourseGradebook(course).grades()
+        stored = {grade.student_id: grade for grade in models.StudentGrade.objects.filter(course=course)}
+        drift = 0
+
+        for user_id, expected in live.items():
+            grade = stored.pop(user_id, None)
+            if grade is None:
+                drift += 1
+                self.stderr.write(f"User {user_id}: no stored grade")
+                continue
+            actual = grade.as_dict()
+            if any(actual[key] != expected[key] for key in expected):
+                drift += 1
+                self.stderr.write(f"User {user_id}: stored {actual}, live {expected}")
+
+        for user_id in stored:
+            drift += 1
+            self.stderr.write(f"User {user_id}: stored grade but not a student")
+
+        if drift:
+            raise CommandError(f"{drift} stored grade(s) drifted; run rebuild_grades to fix")
+        self.stdout.write(self.style.SUCCESS(f"All {len(live)} stored grades match the live data"))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from grades import deadlines
+
+class Command(BaseCommand):
+    help = (
+        "Close assignments as their deadlines pass, in every course: mark them "
+        "past due, recompute the course's stored grades and invalidate the "
+        "cached pages that show statuses. Runs until interrupted; keep one "
+        "running alongside the web server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Close what is already due and exit, e.g. from cron")
+        parser.add_argument('--poll', type=float, default=10,
+                            help="Seconds between looks for new or moved deadlines (default: 10)")
+
+    def handle(self, *args, **options):
+        upcoming = None
+        while True:
+            for course, closed in deadlines.close_due().items():
+                self.stdout.write(f"Closed {', '.join(str(assignment) for assignment in closed)} in {course}")
+            if options['once']:
+                return
+
+            found = deadlines.next_deadline()
+            if found != upcoming:
+                upcoming = found
+                self.stdout.write(f"Next deadline: {upcoming or 'none'}")
+            wait = options['poll']
+            if upcoming is not None:
+                wait = min(wait, max((upcoming - timezone.now()).total_seconds(), 0))
+            # A long-running worker mustn't hold on to connections the server closed
+            close_old_connections()
+            time.sleep(wait)
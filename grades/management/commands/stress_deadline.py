@@ -0,0 +1,220 @@
+import datetime
+import multiprocessing
+import random
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.test import Client, override_settings
+from django.utils import timezone
+from grades import courses, models, synthetic
+
+# Grades posted per save, like a TA working through part of a page
+GRADES_PER_SAVE = 20
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+class Command(BaseCommand):
+    help = (
+        "Simulate a deadline rush on a scratch assignment: students uploading "
+        "and reloading the assignment page while TAs save grades and page "
+        "through submissions, from many threads (and processes) at once. "
+        "Fails if any request finds the database locked. Compare runs with "
+        "and without GRADES_SQLITE_PRODUCTION."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=10,
+                            help="How long the rush lasts (default: 10)")
+        parser.add_argument('--threads', type=int, default=16,
+                            help="Concurrent threads per process (default: 16)")
+        parser.add_argument('--processes', type=int, default=1,
+                            help="Worker processes, like a server's workers (default: 1)")
+        parser.add_argument('--students', type=int, default=100,
+                            help="Scratch students taking part (default: 100)")
+        parser.add_argument('--writes', type=float, default=0.5,
+                            help="Share of requests that upload or save grades (default: 0.5)")
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete the scratch assignment and users afterwards")
+        courses.add_argument(parser)
+
+    def handle(self, *args, **options):
+        course = courses.from_options(options)
+        if not models.User.objects.filter(groups=course.teaching_assistants_id).exists():
+            raise CommandError(f"There are no teaching assistants in {course}")
+        if options['threads'] < 1 or options['processes'] < 1 or options['students'] < 1:
+            raise CommandError("--threads, --processes and --students must be at least 1")
+
+        connection = connections[course.database]
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+        self.stdout.write(
+            f"{connection.settings_dict['ENGINE']} on {course.database} (journal_mode={journal_mode}), "
+            f"{options['processes']} process(es) x {options['threads']} thread(s) for {options['seconds']}s"
+        )
+
+        hosts = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'])
+        with hosts, courses.activate(course):
+            assignment, students, admin = self.setup(course, options['students'])
+            try:
+                results = self.rush(course, assignment, students, admin, options)
+            finally:
+                if not options['keep']:
+                    assignment.delete()
+                    models.User.objects.filter(id__in=[admin.id, *(student.id for student in students)]).delete()
+        self.report(results)
+
+    def setup(self, course, count):
+        assignment = models.Assignment.objects.create(
+            course=course,
+            title="Deadline stress test",
+            description="Scratch assignment created by stress_deadline",
+            deadline=timezone.now() + datetime.timedelta(days=1),
+            weight=0,
+            points=100
+        )
+        usernames = [f"stress-deadline-{number}" for number in range(count)]
+        models.User.objects.bulk_create(
+            [models.User(username=username) for username in usernames], ignore_conflicts=True
+        )
+        students = list(models.User.objects.filter(username__in=usernames).order_by('id'))
+        # Through the signals, which keep the group's size and the course's copies current
+        course.students.user_set.add(*students)
+        admin, _ = models.User.objects.get_or_create(
+            username="stress-deadline-admin", defaults={'is_superuser': True, 'is_staff': True}
+        )
+        if course.database != DEFAULT_DB_ALIAS:
+            courses.copy_users(models.User.objects.filter(id=admin.id), course.database)
+        return assignment, students, admin
+
+    def rush(self, course, assignment, students, admin, options):
+        """Runs the workers; returns (kind, milliseconds, error) for every request."""
+        if options['processes'] == 1:
+            return self.run_threads(course, assignment, students, admin, options, 0)
+        # Forked workers mustn't share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = [
+            context.Process(target=self.run_process, args=(queue, course, assignment, students, admin, options, number))
+            for number in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        results = []
+        for _ in workers:
+            results.extend(queue.get())
+        for worker in workers:
+            worker.join()
+        return results
+
+    def run_process(self, queue, course, assignment, students, admin, options, number):
+        try:
+            results = self.run_threads(course, assignment, students, admin, options, number)
+        except Exception:
+            results = [('worker', 0, traceback.format_exc())]
+        queue.put(results)
+
+    def run_threads(self, course, assignment, students, admin, options, process):
+        threads = options['threads']
+        total = threads * options['processes']
+        results = []
+        start = threading.Barrier(threads)
+        pdf = synthetic.pdf_stub(0)
+
+        def worker(number):
+            index = process * threads + number
+            mine = students[index::total] or students
+            own = []
+            try:
+                # Threads don't inherit the active course
+                with courses.activate(course):
+                    clients = {}
+                    def client(user):
+                        if user.id not in clients:
+                            clients[user.id] = Client()
+                            clients[user.id].force_login(user)
+                        return clients[user.id]
+
+                    base = f"/{course.slug}/{assignment.id}/"
+                    for user in [admin, *mine]:
+                        client(user)
+                    start.wait()
+                    stop = time.monotonic() + options['seconds']
+                    while time.monotonic() < stop:
+                        student = random.choice(mine)
+                        if random.random() < options['writes']:
+                            if random.random() < 0.5:
+                                kind = 'upload'
+                                request = lambda: client(student).post(base, {
+                                    'submission_file': SimpleUploadedFile(
+                                        'stress.pdf', pdf, content_type='application/pdf'
+                                    )
+                                })
+                                expected = (302, base)
+                            else:
+                                kind = 'save grades'
+                                ids = list(models.Submission.objects.filter(assignment=assignment)
+                                           .order_by('?').values_list('id', flat=True)[:GRADES_PER_SAVE])
+                                request = lambda: client(admin).post(base + "submissions/", {
+                                    f'grade-{id}': random.randint(0, 100) for id in ids
+                                })
+                                expected = (302, base + "submissions/")
+                        elif random.random() < 0.5:
+                            kind = 'assignment page'
+                            request = lambda: client(student).get(base)
+                            expected = (200, None)
+                        else:
+                            kind = 'submissions page'
+                            request = lambda: client(admin).get(base + "submissions/")
+                            expected = (200, None)
+
+                        began = time.perf_counter()
+                        try:
+                            response = request()
+                            got = (response.status_code, response.get('Location'))
+                            error = None if got == expected else f"HTTP {got[0]} {got[1] or ''}".strip()
+                        except OperationalError as e:
+                            error = f"locked: {e}" if 'locked' in str(e) else repr(e)
+                        except Exception as e:
+                            error = repr(e)
+                        own.append((kind, (time.perf_counter() - began) * 1000, error))
+            except Exception:
+                own.append(('worker', 0, traceback.format_exc()))
+            finally:
+                connections.close_all()
+                results.extend(own)
+
+        workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return results
+
+    def report(self, results):
+        kinds = sorted({kind for kind, _, _ in results})
+        self.stdout.write(f"{'request':<18}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'errors':>8}")
+        for kind in kinds:
+            times = [ms for k, ms, _ in results if k == kind]
+            errors = sum(1 for k, _, error in results if k == kind and error)
+            self.stdout.write(
+                f"{kind:<18}{len(times):>8}{_percentile(times, 0.5):>10.1f}"
+                f"{_percentile(times, 0.95):>10.1f}{max(times):>10.1f}{errors:>8}"
+            )
+
+        errors = [error for _, _, error in results if error]
+        locked = [error for error in errors if error.startswith('locked')]
+        if errors:
+            raise CommandError(
+                f"{len(errors)} of {len(results)} request(s) failed, {len(locked)} with the database locked; "
+                f"first error: {errors[0]}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"{len(results)} requests, none found the database locked"))
@@ -0,0 +1,103 @@
+import datetime
+import threading
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from grades import courses, grader_assignment, models
+
+# Every submission uploads the same small PDF, so they share one stored file
+STRESS_PDF = b"%PDF-1.4\n%EOF\n"
+
+class Command(BaseCommand):
+    help = (
+        "Create submissions for a scratch assignment from many threads at once "
+        "and check that every TA's load stays within one of the others."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--submissions', type=int, default=200,
+                            help="Number of submissions to create (default: 200)")
+        parser.add_argument('--threads', type=int, default=16,
+                            help="Number of concurrent threads (default: 16)")
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete the scratch assignment afterwards")
+        courses.add_argument(parser)
+
+    def handle(self, *args, **options):
+        course = courses.from_options(options)
+        with courses.activate(course):
+            self.stress(course, options)
+
+    def stress(self, course, options):
+        tas = list(models.User.objects.filter(groups=course.teaching_assistants_id))
+        if not tas:
+            raise CommandError(f"There are no teaching assistants in {course}")
+
+        author, created_author = models.User.objects.get_or_create(username="stress-test-author")
+        courses.copy_users(models.User.objects.filter(id=author.id), course.database)
+        assignment = models.Assignment.objects.create(
+            course=course,
+            title="Grader assignment stress test",
+            description="Scratch assignment created by stress_grader_assignment",
+            deadline=timezone.now() + datetime.timedelta(days=365),
+            weight=0,
+            points=1
+        )
+
+        remaining = iter(range(options['submissions']))
+        lock = threading.Lock()
+        errors = []
+        start = threading.Barrier(options['threads'])
+
+        def worker():
+            start.wait()
+            try:
+                # Threads don't inherit the active course
+                with courses.activate(course):
+                    while True:
+                        with lock:
+                            if next(remaining, None) is None:
+                                return
+                        grader_assignment.create_submission(
+                            assignment, author, SimpleUploadedFile(
+                                "stress-test.pdf", STRESS_PDF, content_type="application/pdf"
+                            )
+                        )
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        try:
+            loads = {
+                ta.username: assignment.submission_set.filter(grader=ta).count()
+                for ta in tas
+            }
+            stored = dict(
+                models.GraderLoad.objects.filter(assignment=assignment)
+                .values_list('grader__username', 'assigned')
+            )
+            self.stdout.write(f"Loads: {loads}")
+
+            if errors:
+                raise CommandError(f"{len(errors)} thread(s) failed, first error: {errors[0]!r}")
+            if max(loads.values()) - min(loads.values()) > 1:
+                raise CommandError("TA loads differ by more than one")
+            if any(stored.get(username, 0) != count for username, count in loads.items()):
+                raise CommandError(f"Stored loads {stored} don't match the submissions")
+            self.stdout.write(self.style.SUCCESS(
+                f"{sum(loads.values())} submissions spread across {len(tas)} TAs within ±1"
+            ))
+        finally:
+            if not options['keep']:
+                assignment.delete()
+                if created_author:
+                    author.delete()
@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+from django.db.models import Q
+from grades import courses, fragments, models, roles, views
+
+class Command(BaseCommand):
+    help = (
+        "Render and cache a course's assignment list, every assignment header "
+        "and every member's grade table, e.g. before a deadline rush. Also "
+        "shows the fragment cache's hit and miss counts."
+    )
+
+    def add_arguments(self, parser):
+        courses.add_argument(parser)
+        parser.add_argument('--stats', action='store_true',
+                            help="Only show the hit and miss counts")
+        parser.add_argument('--reset-stats', action='store_true',
+                            help="Reset the hit and miss counts to zero")
+
+    def handle(self, *args, **options):
+        if options['stats'] or options['reset_stats']:
+            self.show_stats()
+            if options['reset_stats']:
+                fragments.reset_stats()
+                self.stdout.write("Statistics reset")
+            return
+
+        if not fragments.timeout():
+            raise CommandError("Fragment caching is off; set GRADES_FRAGMENT_CACHE_TIMEOUT")
+
+        course = courses.from_options(options)
+        with courses.activate(course):
+            self.warm(course)
+        self.show_stats()
+
+    def warm(self, course):
+        start = time.perf_counter()
+        views.index_page(course)
+        assignments = list(models.Assignment.objects.filter(course=course))
+        for assignment in assignments:
+            # Renders just the cached parts of the page
+            render_to_string("assignment.html", {'course': course, 'assignment': assignment})
+
+        users = models.User.objects.filter(
+            Q(groups__in=[course.students_id, course.teaching_assistants_id]) | Q(is_superuser=True),
+            is_active=True
+        ).distinct().prefetch_related('groups').order_by('id')
+        count = 0
+        for user in users.iterator(chunk_size=2000):
+            user._group_ids = frozenset(group.id for group in user.groups.all())
+            is_student_user = roles.is_student(user, course)
+            is_ta_user = roles.is_ta(user, course)
+            views.grade_table(user, course, is_student_user, is_ta_user, user.is_superuser)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Cached the assignment list, {len(assignments)} assignment page(s) and "
+            f"{count} grade table(s) in {time.perf_counter() - start:.1f}s"
+        ))
+
+    def show_stats(self):
+        for name, (hits, misses) in fragments.stats().items():
+            total = hits + misses
+            rate = f"{hits / total:.0%}" if total else "-"
+            self.stdout.write(f"{name:<24} {hits:>8} hits {misses:>8} misses  {rate:>5}")
@@ -0,0 +1,373 @@
+"""
+Request metrics in the Prometheus text format, served at /metrics/.
+
+MetricsMiddleware times every request and labels it with the URL pattern
+it matched. While a request runs, a contextvar holds its tally, which the
+database hook (installed on every connection), the template backend below,
+serving.py and uploads.py add to: SQL queries and time, template render
+time, and bytes downloaded and uploaded. When the response is ready the
+tally is folded into this process's histograms and counters. Time spent
+streaming a response body after that isn't included.
+
+Each worker process keeps its metrics in memory. A background thread,
+started with the process's first request, writes them to the process's
+own file in GRADES_METRICS_DIR every FLUSH_INTERVAL seconds when they
+have changed, and once more at exit, so requests never touch the disk.
+Files are named by PID and start time, so a new worker that gets an old
+PID doesn't overwrite the counters of the one that exited. /metrics/ adds
+up every process's file. It also folds the files of workers that have
+exited into one running total, exited.json, so counters don't go backwards
+when a worker restarts and the directory doesn't grow with every restart.
+A worker counts as exited when its PID is gone, or has a newer file, so
+every worker writing to the directory must run on the same machine.
+"""
+import atexit
+import contextvars
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows, where exited workers' files are simply kept
+    fcntl = None
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template
+
+FLUSH_INTERVAL = 1.0
+
+# The running total of every exited worker's metrics
+EXITED_FILENAME = 'exited.json'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+HELP = {
+    'grades_request_duration_seconds': ('histogram', "Time to produce a response, by URL pattern"),
+    'grades_request_sql_queries': ('histogram', "SQL queries per request, by URL pattern"),
+    'grades_request_sql_seconds': ('histogram', "Time spent in SQL per request, by URL pattern"),
+    'grades_responses_total': ('counter', "Responses by URL pattern and status code"),
+    'grades_sql_queries_total': ('counter', "SQL queries run, by URL pattern"),
+    'grades_sql_seconds_total': ('counter', "Time spent in SQL, by URL pattern"),
+    'grades_template_seconds_total': ('counter', "Time spent rendering templates, by URL pattern"),
+    'grades_download_bytes_total': ('counter', "Bytes of submission files served, by URL pattern"),
+    'grades_upload_bytes_total': ('counter', "Bytes of submission files received, by URL pattern"),
+}
+
+# The tally of the request being handled, if any
+_current = contextvars.ContextVar('grades_metrics', default=None)
+
+class Tally:
+    """What one request has done so far."""
+    __slots__ = ('queries', 'sql_seconds', 'template_seconds', 'download_bytes', 'upload_bytes')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.download_bytes = 0
+        self.upload_bytes = 0
+
+class Registry:
+    """One process's histograms and counters, keyed by (name, labels)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        # Set by start() in the process that records
+        self.pid = None
+        self.filename = None
+        self.changed = False
+
+    def start(self):
+        """
+        Starts this process's flushing thread. A forked worker starts its
+        own, with a file of its own and without the parent's numbers,
+        which are in the parent's file. Call with the lock held.
+        """
+        if self.pid is not None:
+            self.counters.clear()
+            self.histograms.clear()
+        else:
+            atexit.register(self.flush)
+        self.pid = os.getpid()
+        self.filename = f'{self.pid}-{time.time_ns()}.json'
+        threading.Thread(target=self.flush_every, name='grades-metrics', daemon=True).start()
+
+    def flush_every(self):
+        pid = self.pid
+        while self.pid == pid:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            # Bucket counts (the last for +Inf), then the sum
+            histogram = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+        histogram[bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+    def record(self, view, method, status, seconds, tally):
+        labels = (('view', view), ('method', method))
+        with self.lock:
+            if self.pid != os.getpid():
+                self.start()
+            self.changed = True
+            self.observe('grades_request_duration_seconds', labels, seconds, LATENCY_BUCKETS)
+            self.observe('grades_request_sql_queries', labels, tally.queries, QUERY_BUCKETS)
+            self.observe('grades_request_sql_seconds', labels, tally.sql_seconds, LATENCY_BUCKETS)
+            self.inc('grades_responses_total', labels + (('status', str(status)),))
+            view_label = (('view', view),)
+            if tally.queries:
+                self.inc('grades_sql_queries_total', view_label, tally.queries)
+                self.inc('grades_sql_seconds_total', view_label, tally.sql_seconds)
+            if tally.template_seconds:
+                self.inc('grades_template_seconds_total', view_label, tally.template_seconds)
+            if tally.download_bytes:
+                self.inc('grades_download_bytes_total', view_label, tally.download_bytes)
+            if tally.upload_bytes:
+                self.inc('grades_upload_bytes_total', view_label, tally.upload_bytes)
+
+    def snapshot(self):
+        with self.lock:
+            self.changed = False
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, list(values)] for (name, labels), values in self.histograms.items()],
+            }
+
+    def flush(self):
+        """Writes this process's metrics to its file, if they changed since the last time."""
+        directory = directory_path()
+        if not directory or not self.changed or self.pid != os.getpid():
+            return
+        os.makedirs(directory, exist_ok=True)
+        # Write and rename, so a scrape never reads half a file
+        with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f.name, os.path.join(directory, self.filename))
+
+registry = Registry()
+
+def directory_path():
+    return getattr(settings, 'GRADES_METRICS_DIR', None)
+
+def enabled():
+    return bool(directory_path())
+
+def count_download(size):
+    tally = _current.get()
+    if tally is not None:
+        tally.download_bytes += size
+
+def count_upload(size):
+    tally = _current.get()
+    if tally is not None:
+        tally.upload_bytes += size
+
+def sql_hook(execute, sql, params, many, context):
+    """Database execute wrapper: times queries made while handling a request."""
+    tally = _current.get()
+    if tally is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        tally.queries += 1
+        tally.sql_seconds += time.perf_counter() - start
+
+def install_sql_hook(sender, connection, **kwargs):
+    """connection_created handler; a connection object is reused across reconnects."""
+    if sql_hook not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_hook)
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        tally = _current.get()
+        if tally is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            tally.template_seconds += time.perf_counter() - start
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing each top-level render for the metrics."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+def _view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return '/' + match.route if match.route else '/'
+
+class MetricsMiddleware:
+    """Records every request's latency, queries, template time and bytes transferred."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not enabled():
+            return self.get_response(request)
+        tally = Tally()
+        token = _current.set(tally)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, time.perf_counter() - start, tally)
+        return response
+
+    async def __acall__(self, request):
+        if not enabled():
+            return await self.get_response(request)
+        tally = Tally()
+        token = _current.set(tally)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, time.perf_counter() - start, tally)
+        return response
+
+    def finish(self, request, response, seconds, tally):
+        registry.record(_view_label(request), request.method, response.status_code, seconds, tally)
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Removed or being replaced; the next scrape will see it
+        return None
+
+def _add(counters, histograms, data):
+    for name, labels, value in data['counters']:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, values in data['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        if key in histograms:
+            histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+        else:
+            histograms[key] = values
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _exited(filenames):
+    """The files, named <pid>-<start>.json, of workers that are no longer running."""
+    started = {}
+    for filename in filenames:
+        pid, _, start = filename.removesuffix('.json').partition('-')
+        if filename.endswith('.json') and pid.isdigit() and start.isdigit():
+            started[filename] = (int(pid), int(start))
+    newest = {}
+    for pid, start in started.values():
+        newest[pid] = max(newest.get(pid, start), start)
+    return [
+        filename for filename, (pid, start) in started.items()
+        if start < newest[pid] or not _alive(pid)
+    ]
+
+def _fold(directory, exited):
+    """Adds the files of exited workers into EXITED_FILENAME, then removes them."""
+    counters, histograms = {}, {}
+    for filename in [EXITED_FILENAME, *exited]:
+        data = _read(os.path.join(directory, filename))
+        if data is not None:
+            _add(counters, histograms, data)
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as f:
+        json.dump({
+            'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+            'histograms': [[name, labels, values] for (name, labels), values in histograms.items()],
+        }, f)
+    os.replace(f.name, os.path.join(directory, EXITED_FILENAME))
+    for filename in exited:
+        os.remove(os.path.join(directory, filename))
+
+def _merge():
+    """Every process's metrics added together: (counters, histograms)."""
+    # This process's latest numbers, as the scrape is handled here
+    registry.flush()
+    counters = {}
+    histograms = {}
+    directory = directory_path()
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        if fcntl is not None:
+            # One scrape at a time, so none sees a file both folded and not
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            exited = _exited(os.listdir(directory))
+            if exited:
+                _fold(directory, exited)
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            data = _read(os.path.join(directory, filename))
+            if data is not None:
+                _add(counters, histograms, data)
+    return counters, histograms
+
+def _labels(labels):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels
+    )
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    counters, histograms = _merge()
+    lines = []
+    for name, (kind, help_text) in HELP.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind == 'counter':
+            for (key_name, labels), value in sorted(counters.items()):
+                if key_name == name:
+                    lines.append(f'{name}{{{_labels(labels)}}} {value}')
+            continue
+        buckets = QUERY_BUCKETS if name == 'grades_request_sql_queries' else LATENCY_BUCKETS
+        for (key_name, labels), values in sorted(histograms.items()):
+            if key_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip([*buckets, '+Inf'], values):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{_labels(labels + (("le", bound),))}}} {cumulative}')
+            lines.append(f'{name}_sum{{{_labels(labels)}}} {values[-1]}')
+            lines.append(f'{name}_count{{{_labels(labels)}}} {cumulative}')
+    return '\n'.join(lines) + '\n'
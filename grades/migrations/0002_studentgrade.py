@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('grades', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentGrade',
+            fields=[
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='student_grade', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('percentage', models.DecimalField(decimal_places=1, max_digits=6)),
+                ('available_points', models.IntegerField()),
+                ('earned_points', models.DecimalField(decimal_places=1, max_digits=12)),
+                ('computed_at', models.DateTimeField()),
+                ('valid_until', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_counters(apps, schema_editor):
+    database = schema_editor.connection.alias
+    Submission = apps.get_model('grades', 'Submission')
+    AssignmentCounter = apps.get_model('grades', 'AssignmentCounter')
+    GraderLoad = apps.get_model('grades', 'GraderLoad')
+    GroupSize = apps.get_model('grades', 'GroupSize')
+    Group = apps.get_model('auth', 'Group')
+
+    graded = Count('id', filter=Q(score__isnull=False))
+    AssignmentCounter.objects.using(database).bulk_create(
+        AssignmentCounter(assignment_id=row['assignment'], submissions=row['total'], graded=row['done'])
+        for row in Submission.objects.using(database).values('assignment').annotate(total=Count('id'), done=graded).order_by()
+    )
+    GraderLoad.objects.using(database).bulk_create(
+        GraderLoad(assignment_id=row['assignment'], grader_id=row['grader'], assigned=row['total'], graded=row['done'])
+        for row in Submission.objects.using(database).filter(grader__isnull=False)
+            .values('assignment', 'grader').annotate(total=Count('id'), done=graded).order_by()
+    )
+    GroupSize.objects.using(database).bulk_create(
+        GroupSize(group=group, size=group.members)
+        for group in Group.objects.using(database).annotate(members=Count('user'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('grades', '0002_studentgrade'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssignmentCounter',
+            fields=[
+                ('assignment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counter', serialize=False, to='grades.assignment')),
+                ('submissions', models.IntegerField(default=0)),
+                ('graded', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GroupSize',
+            fields=[
+                ('group', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='size_counter', serialize=False, to='auth.group')),
+                ('size', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GraderLoad',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('assigned', models.IntegerField(default=0)),
+                ('graded', models.IntegerField(default=0)),
+                ('assignment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='grades.assignment')),
+                ('grader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grader_loads', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('assignment', 'grader'), name='unique_grader_load')],
+            },
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:08
+
+from django.db import migrations, models
+
+
+def fill_served_names(apps, schema_editor):
+    database = schema_editor.connection.alias
+    Submission = apps.get_model('grades', 'Submission')
+    batch = []
+    for submission in Submission.objects.using(database).only('id', 'file').iterator(chunk_size=1000):
+        submission.served_name = submission.file.name.split('/')[-1]
+        batch.append(submission)
+        if len(batch) == 1000:
+            Submission.objects.using(database).bulk_update(batch, ['served_name'])
+            batch = []
+    Submission.objects.using(database).bulk_update(batch, ['served_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grades', '0003_submission_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='served_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_served_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:11
+
+import grades.storage
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_references(apps, schema_editor):
+    database = schema_editor.connection.alias
+    Submission = apps.get_model('grades', 'Submission')
+    StoredFile = apps.get_model('grades', 'StoredFile')
+    StoredFile.objects.using(database).bulk_create(
+        (
+            StoredFile(name=row['file'], refcount=row['total'])
+            for row in Submission.objects.using(database).exclude(file='').values('file').annotate(total=Count('id')).order_by()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grades', '0005_submission_sha256'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('refcount', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='file',
+            field=models.FileField(storage=grades.storage.submission_storage, upload_to='submissions/'),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:40
+
+import django.db.models.deletion
+import grades.courses
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_first_course(apps, schema_editor):
+    """Puts the existing assignments into a course, with the old groups as its members."""
+    database = schema_editor.connection.alias
+    Assignment = apps.get_model('grades', 'Assignment')
+    Course = apps.get_model('grades', 'Course')
+    Group = apps.get_model('auth', 'Group')
+    if not Assignment.objects.using(database).exists():
+        return
+    students, _ = Group.objects.using(database).get_or_create(name='Students')
+    tas, _ = Group.objects.using(database).get_or_create(name='Teaching Assistants')
+    course = Course.objects.using(database).create(
+        slug='cs3550', title='CS 3550', students=students, teaching_assistants=tas
+    )
+    Assignment.objects.using(database).update(course=course)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('grades', '0006_content_addressed_storage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Course',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(unique=True, validators=[grades.courses.validate_slug])),
+                ('title', models.CharField(max_length=200)),
+                ('database', models.CharField(default='default', max_length=100)),
+                ('moving', models.BooleanField(default=False)),
+                ('students', models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, related_name='course_as_students', to='auth.group')),
+                ('teaching_assistants', models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, related_name='course_as_teaching_assistants', to='auth.group')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='course',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='grades.course'),
+        ),
+        migrations.RunPython(create_first_course, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='assignment',
+            name='course',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='grades.course'),
+        ),
+        # Stored grades are per course now; they are recomputed as they are read
+        migrations.DeleteModel(
+            name='StudentGrade',
+        ),
+        migrations.CreateModel(
+            name='StudentGrade',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('percentage', models.DecimalField(decimal_places=1, max_digits=6)),
+                ('available_points', models.IntegerField()),
+                ('earned_points', models.DecimalField(decimal_places=1, max_digits=12)),
+                ('computed_at', models.DateTimeField()),
+                ('valid_until', models.DateTimeField(blank=True, null=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='grades.course')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='student_grades', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('course', 'student'), name='unique_student_grade')],
+            },
+        ),
+    ]
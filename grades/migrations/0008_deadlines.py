@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:10
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def close_past_deadlines(apps, schema_editor):
+    """Closes the assignments already past their deadline; the stored grades are recomputed as they are read."""
+    database = schema_editor.connection.alias
+    Assignment = apps.get_model('grades', 'Assignment')
+    StudentGrade = apps.get_model('grades', 'StudentGrade')
+    Assignment.objects.using(database).filter(deadline__lt=timezone.now()).update(past_due=True)
+    # They were only valid until the next deadline
+    StudentGrade.objects.using(database).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grades', '0007_course'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='studentgrade',
+            name='valid_until',
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='past_due',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(close_past_deadlines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:43
+
+from django.db import migrations, models
+
+
+def clear_grades(apps, schema_editor):
+    """The stored grades don't say how long they hold; they are recomputed as they are read."""
+    StudentGrade = apps.get_model('grades', 'StudentGrade')
+    StudentGrade.objects.using(schema_editor.connection.alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grades', '0009_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentgrade',
+            name='valid_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(clear_grades, migrations.RunPython.noop),
+    ]
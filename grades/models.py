@@ -1,17 +1,66 @@
+import os
+
 from django.db import models
 from django.contrib.auth.models import User, Group
 from django.core.exceptions import PermissionDenied
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+from .storage import submission_storage
+from . import courses, roles
+
+class Course(models.Model):
+    """
+    A course: its assignments, and the groups of its students and teaching
+    assistants. Course rows are kept in the default database, the course's
+    assignments and submissions in `database` (see grades/courses.py).
+    """
+    slug = models.SlugField(unique=True, validators=[courses.validate_slug])
+    title = models.CharField(max_length=200)
+    students = models.OneToOneField(
+        Group,
+        on_delete=models.PROTECT,
+        related_name='course_as_students'
+    )
+    teaching_assistants = models.OneToOneField(
+        Group,
+        on_delete=models.PROTECT,
+        related_name='course_as_teaching_assistants'
+    )
+    # An alias in DATABASES; change it with the move_course command
+    database = models.CharField(max_length=100, default='default')
+    # Set while move_course copies the course, which holds off uploads and grading
+    moving = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.title
 
 class Assignment(models.Model):
+    course = models.ForeignKey(
+        Course,
+        on_delete=models.CASCADE
+    )
     title = models.CharField(max_length=200)
     description = models.TextField()
     deadline = models.DateTimeField()
     weight = models.IntegerField()
     points = models.IntegerField()
+    # Set when run_deadlines closes the assignment (see grades/deadlines.py);
+    # pages and grades go by gradebook.is_due
+    past_due = models.BooleanField(default=False)
     
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the grading fields as loaded so saves can tell what changed
+        instance._loaded = {
+            name: instance.__dict__.get(name)
+            for name in ('weight', 'points', 'deadline')
+        }
+        return instance
+
 class Submission(models.Model):
     assignment = models.ForeignKey(
         Assignment,
@@ -29,7 +78,22 @@ class Submission(models.Model):
         blank=True,
         related_name='graded_set'
     )
-    file = models.FileField(upload_to='submissions/')
+    file = models.FileField(upload_to='submissions/', storage=submission_storage)
+    # Name the file is downloaded under, as it appears in /uploads/submissions/
+    # URLs. Stored files can be shared, so each submission gets its own.
+    served_name = models.CharField(
+        max_length=255,
+        db_index=True,
+        editable=False,
+        default=''
+    )
+    # SHA-256 of a file that passed PdfUploadHandler's checks, blank otherwise
+    sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+        editable=False,
+        default=''
+    )
     score = models.DecimalField(
         max_digits=5,
         decimal_places=2,
@@ -39,24 +103,55 @@ class Submission(models.Model):
 
     def __str__(self):
         return f"{self.author}'s submission for {self.assignment}"
+
+    def store_file(self):
+        """Writes a newly assigned file to storage and records its name and digest."""
+        if self.file and not self.file._committed:
+            # Serve it under the uploaded name plus a random suffix
+            stem, extension = os.path.splitext(self.file.name.split('/')[-1])
+            self.served_name = f"{stem}_{get_random_string(7)}{extension}"
+            self.sha256 = getattr(self.file.file, 'sha256', '')
+            self.file.save(self.file.name, self.file.file, save=False)
+        elif not self.served_name:
+            self.served_name = self.file.name.split('/')[-1] if self.file else ''
+
+    @property
+    def download_url(self):
+        # The active course when it is the submission's, so a page listing
+        # its submissions doesn't load their assignments; the admin, the
+        # shell and commands have none active
+        course = courses.current()
+        if course is None or (
+            Submission.assignment.is_cached(self) and self.assignment.course_id != course.id
+        ):
+            course = courses.course_of(self.assignment)
+        return reverse('show_upload', args=[course.slug, self.served_name])
+
+    def save(self, *args, **kwargs):
+        # Store the file first so the row records the name storage picked
+        self.store_file()
+        if kwargs.get('update_fields') is not None and 'file' in kwargs['update_fields']:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'served_name', 'sha256'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the fields as loaded so saves can tell what changed
+        instance._loaded = {
+            name: instance.__dict__.get(name)
+            for name in ('assignment_id', 'author_id', 'grader_id', 'score', 'file')
+        }
+        return instance
     
     def change_grade(self, user, grade):
         """
         Updates the submission's grade if the user has permission.
         Raises PermissionDenied if user is not authorized to grade this submission.
         """
-        # Admin can change any grade
-        if user.is_superuser:
-            self.score = grade
-            return
-        
-        # TA can only change grades for submissions assigned to them
-        if user == self.grader:
-            self.score = grade
-            return
-        
-        # Otherwise, user is not authorized
-        raise PermissionDenied("You are not authorized to grade this submission")
+        if not roles.can_grade(user, self):
+            raise PermissionDenied("You are not authorized to grade this submission")
+        self.score = grade
         
     def view_submission(self, user):
         """
@@ -64,17 +159,131 @@ class Submission(models.Model):
         Raises PermissionDenied if not authorized.
         Returns the file if authorized.
         """
-        # Admin can view any submission
-        if user.is_superuser:
+        if roles.can_view(user, self):
             return self.file
         
-        # Author can view their own submission
-        if user == self.author:
-            return self.file
-        
-        # Grader can view submissions assigned to them
-        if user == self.grader:
-            return self.file
-        
-        # Otherwise, user is not authorized
-        raise PermissionDenied("You are not authorized to view this submission")
\ No newline at end of file
+        raise PermissionDenied("You are not authorized to view this submission")
+
+class StudentGrade(models.Model):
+    """
+    Materialized copy of compute_grade for one student in one course.
+    Kept up to date by the handlers in grades/signals.py, and recomputed
+    for the whole course when one of its deadlines passes (grades/deadlines.py).
+    A row is only current until `valid_until`, the course's next deadline
+    when it was computed; readers compute it again after that.
+    """
+    course = models.ForeignKey(
+        Course,
+        on_delete=models.CASCADE
+    )
+    student = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='student_grades'
+    )
+    percentage = models.DecimalField(max_digits=6, decimal_places=1)
+    available_points = models.IntegerField()
+    earned_points = models.DecimalField(max_digits=12, decimal_places=1)
+    computed_at = models.DateTimeField()
+    valid_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'student'], name='unique_student_grade')
+        ]
+
+    def __str__(self):
+        return f"{self.student}'s grade in {self.course}: {self.percentage}%"
+
+    def as_dict(self):
+        """Returns the grade in the same shape as compute_grade."""
+        return {
+            # compute_grade reports a plain 100 when nothing is due yet
+            'percentage': self.percentage if self.available_points > 0 else 100,
+            'available_points': self.available_points,
+            'earned_points': self.earned_points
+        }
+
+class AssignmentCounter(models.Model):
+    """Running submission totals for one assignment, maintained by grades/counters.py."""
+    assignment = models.OneToOneField(
+        Assignment,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='counter'
+    )
+    submissions = models.IntegerField(default=0)
+    graded = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.assignment}: {self.graded}/{self.submissions} graded"
+
+class GraderLoad(models.Model):
+    """Submissions assigned to and graded by one grader for one assignment."""
+    assignment = models.ForeignKey(
+        Assignment,
+        on_delete=models.CASCADE
+    )
+    grader = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='grader_loads'
+    )
+    assigned = models.IntegerField(default=0)
+    graded = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['assignment', 'grader'], name='unique_grader_load')
+        ]
+
+    def __str__(self):
+        return f"{self.grader} on {self.assignment}: {self.graded}/{self.assigned} graded"
+
+class GroupSize(models.Model):
+    """Number of members in a group, maintained on group membership changes."""
+    group = models.OneToOneField(
+        Group,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='size_counter'
+    )
+    size = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.group}: {self.size}"
+
+class StoredFile(models.Model):
+    """How many submissions use one file in content-addressed storage."""
+    name = models.CharField(max_length=255, primary_key=True)
+    refcount = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+class Fingerprint(models.Model):
+    """MinHash signature of one stored file, for finding similar submissions (see grades/similarity.py)."""
+    name = models.CharField(max_length=255, primary_key=True)
+    # Packed signature; empty for files with nothing to compare
+    signature = models.BinaryField(default=b'')
+    indexed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+class FingerprintBand(models.Model):
+    """One band of a fingerprint, hashed to a key; files sharing a key are compared."""
+    fingerprint = models.ForeignKey(
+        Fingerprint,
+        on_delete=models.CASCADE,
+        related_name='bands'
+    )
+    key = models.BigIntegerField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'key'], name='unique_fingerprint_band')
+        ]
+
+    def __str__(self):
+        return f"{self.fingerprint}: {self.key}"
@@ -0,0 +1,228 @@
+"""
+Profiles of single requests, for finding out where a slow page spends its
+time.
+
+A superuser profiles a request by adding ?profile=1 to the URL or sending
+an `X-Profile: 1` header; with GRADES_PROFILE_SAMPLE_RATE set to N, one in
+N of everyone's requests is profiled as well. A profiled request runs under
+cProfile with every SQL statement recorded, and is saved to
+GRADES_PROFILE_DIR as a .prof file (readable by pstats or snakeviz) next to
+a .json file with the request, the SQL and a summary of the slowest calls.
+Only the newest GRADES_PROFILE_KEEP profiles are kept. The response
+carries the profile's id in an X-Profile-Id header; /profiles/ lists them.
+
+The SQL is recorded with the types of its parameters rather than their
+values, which can be grades, usernames or session keys. Setting
+GRADES_PROFILE_SQL_PARAMS records the values too.
+
+A request that isn't profiled costs a look at its query string and
+headers. Under ASGI, cProfile only sees the event loop's thread: with the
+async views, time spent in database threads shows up as waiting (the SQL
+is still recorded), and other requests on the loop at the same time are
+mixed in.
+"""
+import contextvars
+import cProfile
+import datetime
+import io
+import json
+import os
+import pstats
+import random
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+# Profile ids: when they were taken, and by which process
+ID_PATTERN = re.compile(r'^\d+-\d+$')
+
+# Calls listed in each profile's summary
+SUMMARY_LINES = 40
+
+# Values of ?profile= and X-Profile that ask for a profile; ?profile=0 doesn't
+YES = {'1', 'true', 'yes'}
+
+# The SQL of the request being profiled, if any
+_statements = contextvars.ContextVar('grades_profile_sql', default=None)
+
+def directory_path():
+    return getattr(settings, 'GRADES_PROFILE_DIR', None)
+
+def _params(params, many):
+    """A statement's parameters as recorded: their types, or their values if the setting asks."""
+    if getattr(settings, 'GRADES_PROFILE_SQL_PARAMS', False):
+        return repr(params)[:500]
+    if params is None:
+        return ''
+    if many:
+        return f'{len(params)} rows' if hasattr(params, '__len__') else 'many rows'
+    values = params.values() if isinstance(params, dict) else params
+    return ', '.join(type(value).__name__ for value in values)
+
+def sql_hook(execute, sql, params, many, context):
+    """Database execute wrapper: records the SQL of profiled requests."""
+    statements = _statements.get()
+    if statements is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        statements.append({
+            'sql': sql,
+            'params': _params(params, many),
+            'many': many,
+            'ms': round((time.perf_counter() - start) * 1000, 3),
+        })
+
+def install_sql_hook(sender, connection, **kwargs):
+    """connection_created handler; a connection object is reused across reconnects."""
+    if sql_hook not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_hook)
+
+def _asked(request):
+    asked = request.GET.get('profile') or request.headers.get('X-Profile') or ''
+    return asked.strip().lower() in YES
+
+def _sampled():
+    rate = getattr(settings, 'GRADES_PROFILE_SAMPLE_RATE', 0)
+    return rate > 0 and random.randrange(rate) == 0
+
+def wanted(request):
+    """Whether to profile this request. Only looks up the user if it asks."""
+    if not directory_path():
+        return False
+    return (_asked(request) and request.user.is_superuser) or _sampled()
+
+async def awanted(request):
+    """Async version of wanted."""
+    if not directory_path():
+        return False
+    return (_asked(request) and (await request.auser()).is_superuser) or _sampled()
+
+def _summary(profiler):
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    return out.getvalue()
+
+def save(request, response, profiler, statements, seconds):
+    """Writes a profile and its details, then drops the oldest beyond the limit."""
+    directory = directory_path()
+    os.makedirs(directory, exist_ok=True)
+    profile_id = f'{time.time_ns()}-{os.getpid()}'
+    profiler.dump_stats(os.path.join(directory, f'{profile_id}.prof'))
+    details = {
+        'id': profile_id,
+        'time': time.time(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'view': getattr(request.resolver_match, 'route', None),
+        'user': request.user.get_username() if request.user.is_authenticated else None,
+        'status': response.status_code,
+        'ms': round(seconds * 1000, 3),
+        'sql_ms': round(sum(statement['ms'] for statement in statements), 3),
+        'sql': statements,
+        'summary': _summary(profiler),
+    }
+    with open(os.path.join(directory, f'{profile_id}.json.tmp'), 'w') as f:
+        json.dump(details, f)
+    os.replace(f.name, os.path.join(directory, f'{profile_id}.json'))
+    prune()
+    return profile_id
+
+def prune():
+    """Keeps the newest GRADES_PROFILE_KEEP profiles."""
+    keep = getattr(settings, 'GRADES_PROFILE_KEEP', 50)
+    for profile_id in profile_ids()[keep:]:
+        for extension in ('.json', '.prof'):
+            try:
+                os.remove(path(profile_id, extension))
+            except FileNotFoundError:
+                # Another process pruned it first
+                pass
+
+def profile_ids():
+    """Every saved profile's id, newest first."""
+    directory = directory_path()
+    if not directory or not os.path.isdir(directory):
+        return []
+    ids = [name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json')]
+    return sorted(ids, key=lambda profile_id: tuple(map(int, profile_id.split('-'))), reverse=True)
+
+def path(profile_id, extension):
+    """The file of a saved profile. Raises ValueError for an id that isn't one."""
+    if not ID_PATTERN.match(profile_id):
+        raise ValueError(f"Not a profile id: {profile_id}")
+    return os.path.join(directory_path(), profile_id + extension)
+
+def load(profile_id):
+    """A profile's details, or None if it doesn't exist (or was pruned)."""
+    try:
+        with open(path(profile_id, '.json')) as f:
+            details = json.load(f)
+    except (ValueError, OSError):
+        return None
+    details['taken'] = datetime.datetime.fromtimestamp(details['time'], tz=datetime.timezone.utc)
+    return details
+
+class ProfilerMiddleware:
+    """Profiles the requests `wanted` picks; see the module docstring."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not wanted(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        statements = []
+        token = _statements.set(statements)
+        start = time.perf_counter()
+        try:
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already running in this thread
+                return self.get_response(request)
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        finally:
+            _statements.reset(token)
+        response['X-Profile-Id'] = save(request, response, profiler, statements, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not await awanted(request):
+            return await self.get_response(request)
+
+        profiler = cProfile.Profile()
+        statements = []
+        token = _statements.set(statements)
+        start = time.perf_counter()
+        try:
+            try:
+                profiler.enable()
+            except ValueError:
+                return await self.get_response(request)
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+        finally:
+            _statements.reset(token)
+        response['X-Profile-Id'] = await sync_to_async(save)(
+            request, response, profiler, statements, time.perf_counter() - start
+        )
+        return response
@@ -0,0 +1,152 @@
+import heapq
+import re
+from bisect import bisect_left, insort
+
+from . import models, counters, courses, fragments
+
+PAGE_PATTERN = re.compile(rb'/Type\s*/Page(?!s)')
+# Bytes kept between chunks, so a match split across two is still found
+PAGE_OVERLAP = 64
+
+def count_weight(submission):
+    """Every submission is one unit of work."""
+    return 1
+
+def size_weight(submission):
+    """Work is proportional to file size in bytes."""
+    try:
+        return max(submission.file.size, 1)
+    except (OSError, ValueError):
+        return 1
+
+def page_weight(submission):
+    """Work is proportional to the number of PDF pages, counted a chunk at a time."""
+    pages = 0
+    try:
+        with submission.file.open('rb') as f:
+            tail = b''
+            for chunk in f.chunks():
+                data = tail + chunk
+                # Matches starting near the end are counted with the next chunk
+                cut = max(len(data) - PAGE_OVERLAP, 0)
+                pages += sum(1 for match in PAGE_PATTERN.finditer(data) if match.start() < cut)
+                tail = data[cut:]
+            pages += len(PAGE_PATTERN.findall(tail))
+    except (OSError, ValueError):
+        return 1
+    return max(pages, 1)
+
+WEIGHTS = {
+    'count': count_weight,
+    'size': size_weight,
+    'pages': page_weight,
+}
+
+def plan_rebalance(assignment, weight=count_weight):
+    """
+    Works out which ungraded submissions of this assignment should move to
+    which TA so every TA in the course's teaching assistants group ends up
+    with a similar amount of work. Graded submissions never move.
+
+    Submissions held by someone who is no longer a TA are handed out first,
+    heaviest first, each to the currently lightest TA. Then, while it helps,
+    the heaviest TA gives one submission to the lightest TA, picking the one
+    that brings the two closest to even. Only changed submissions are
+    returned, as a list of (submission, new_grader_id) pairs.
+    """
+    course = courses.course_of(assignment)
+    ta_ids = sorted(
+        models.User.objects.filter(groups=course.teaching_assistants_id).values_list('id', flat=True)
+    )
+    if not ta_ids:
+        return []
+
+    loads = {ta_id: 0 for ta_id in ta_ids}
+    movable = {ta_id: [] for ta_id in ta_ids}  # sorted (weight, id) per TA
+    submissions = {}
+    orphans = []
+
+    for submission in assignment.submission_set.only('id', 'assignment', 'grader', 'score', 'file'):
+        w = weight(submission)
+        submissions[submission.id] = submission
+        if submission.grader_id in loads:
+            loads[submission.grader_id] += w
+            if submission.score is None:
+                insort(movable[submission.grader_id], (w, submission.id))
+        elif submission.score is None:
+            orphans.append((w, submission.id))
+
+    # Heaps of (load, ta_id); entries go stale when a load changes and are
+    # skipped when popped
+    lightest = [(load, ta_id) for ta_id, load in loads.items()]
+    heaviest = [(-load, ta_id) for ta_id, load in loads.items()]
+    heapq.heapify(lightest)
+    heapq.heapify(heaviest)
+
+    def pop_current(heap, sign):
+        while True:
+            load, ta_id = heap[0]
+            if sign * load == loads[ta_id]:
+                return ta_id
+            heapq.heappop(heap)
+
+    def move(ta_id, w):
+        loads[ta_id] += w
+        heapq.heappush(lightest, (loads[ta_id], ta_id))
+        heapq.heappush(heaviest, (-loads[ta_id], ta_id))
+
+    new_grader = {}
+
+    # Hand out submissions whose grader left, heaviest first
+    for w, submission_id in sorted(orphans, reverse=True):
+        ta_id = pop_current(lightest, 1)
+        new_grader[submission_id] = ta_id
+        insort(movable[ta_id], (w, submission_id))
+        move(ta_id, w)
+
+    # Then even out the loads one submission at a time
+    for _ in range(len(submissions)):
+        heavy = pop_current(heaviest, -1)
+        light = pop_current(lightest, 1)
+        gap = loads[heavy] - loads[light]
+        items = movable[heavy]
+        if gap <= 0 or not items:
+            break
+
+        # Moving weight w helps only if w < gap; w closest to gap/2 helps most
+        i = bisect_left(items, (gap / 2, -1))
+        candidates = [j for j in (i - 1, i) if 0 <= j < len(items) and items[j][0] < gap]
+        if not candidates:
+            break
+        j = min(candidates, key=lambda j: abs(gap / 2 - items[j][0]))
+        w, submission_id = items.pop(j)
+
+        new_grader[submission_id] = light
+        insort(movable[light], (w, submission_id))
+        move(heavy, -w)
+        move(light, w)
+
+    return [
+        (submissions[submission_id], ta_id)
+        for submission_id, ta_id in new_grader.items()
+        if submissions[submission_id].grader_id != ta_id
+    ]
+
+def rebalance(assignment, weight=count_weight, dry_run=False):
+    """
+    Rebalances one assignment's ungraded submissions across the TAs, with
+    its course active, writing every change in one bulk update. Returns the
+    (submission, new_grader_id) moves.
+    """
+    moves = plan_rebalance(assignment, weight)
+    if moves and not dry_run:
+        changed = []
+        for submission, grader_id in moves:
+            submission.grader_id = grader_id
+            changed.append(submission)
+        with courses.atomic():
+            # bulk_update skips the save signals, so recount the loads too
+            models.Submission.objects.bulk_update(changed, ['grader'], batch_size=1000)
+            counters.recount_grader_loads(assignment)
+        fragments.bump(f'grading:{assignment.course_id}')
+    return moves
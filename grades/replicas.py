@@ -0,0 +1,120 @@
+"""
+Read replicas: page loads read from copies of the databases, everything
+else from the primaries.
+
+GRADES_REPLICAS in settings.py gives replicas for any database, the
+default one or a shard; GRADES_READ_REPLICAS maps each primary's alias to
+its replicas' aliases. ReplicaMiddleware lets a request read from them if
+it is a GET or HEAD and its session hasn't sent a POST (an upload, grades,
+a login) in the last GRADES_REPLICA_STICKY_SECONDS, so whoever just wrote
+something sees it even while the replicas lag behind. A request picks one
+replica per primary and keeps to it, so a page doesn't mix two replicas'
+lag. Everything else reads the primary: other requests, management
+commands, reads inside a transaction, the session table, which holds
+the window itself, and whatever renders a cached fragment (see
+primary_reads()). CourseRouter asks for_read() and primary() here for
+every query, after choosing the primary as usual.
+
+Keeping the replicas up to date is left to the deployment (streaming
+replication, litestream); copy_replicas copies SQLite primaries over their
+replicas for trying this out locally.
+"""
+import contextlib
+import contextvars
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+# Apps whose tables are only read from the primary
+PRIMARY_ONLY_APPS = {'sessions'}
+
+# Session key: until when (a Unix time) the session reads the primary
+STICKY_KEY = '_grades_primary_until'
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+# The replica picked for each primary, while the current request may read them
+_chosen = contextvars.ContextVar('grades_replicas', default=None)
+
+def replicas():
+    return getattr(settings, 'GRADES_READ_REPLICAS', {})
+
+def primary(database):
+    """The primary that `database` is a replica of, or `database` itself."""
+    for alias, copies in replicas().items():
+        if database in copies:
+            return alias
+    return database
+
+def for_read(model, database):
+    """Where to read `model` from, given the database it belongs in."""
+    chosen = _chosen.get()
+    main = primary(database)
+    if (chosen is None or main is None or model._meta.app_label in PRIMARY_ONLY_APPS
+            or connections[main].in_atomic_block):
+        return main
+    if database != main:
+        # Related objects come from the replica their object was read from
+        return database
+    if main not in chosen:
+        copies = replicas().get(main)
+        chosen[main] = random.choice(copies) if copies else main
+    return chosen[main]
+
+@contextlib.contextmanager
+def primary_reads():
+    """
+    Reads the primaries inside the block. Fragments are rendered this way:
+    a write bumps their versions as soon as it commits, and a lagging
+    replica's old data would otherwise be cached under the new version and
+    served until the next bump.
+    """
+    token = _chosen.set(None)
+    try:
+        yield
+    finally:
+        _chosen.reset(token)
+
+def _allowed(method, until):
+    return {} if method in SAFE_METHODS and time.time() >= (until or 0) else None
+
+def _sticky():
+    return time.time() + getattr(settings, 'GRADES_REPLICA_STICKY_SECONDS', 10)
+
+class ReplicaMiddleware:
+    """Lets GETs read from the replicas, except just after their session wrote."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replicas():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _chosen.set(_allowed(request.method, request.session.get(STICKY_KEY)))
+        try:
+            response = self.get_response(request)
+        finally:
+            _chosen.reset(token)
+        if request.method not in SAFE_METHODS and request.user.is_authenticated:
+            request.session[STICKY_KEY] = _sticky()
+        return response
+
+    async def __acall__(self, request):
+        token = _chosen.set(_allowed(request.method, await request.session.aget(STICKY_KEY)))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _chosen.reset(token)
+        if request.method not in SAFE_METHODS and (await request.auser()).is_authenticated:
+            await request.session.aset(STICKY_KEY, _sticky())
+        return response
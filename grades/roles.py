@@ -0,0 +1,91 @@
+"""
+Which groups a user belongs to, loaded once per request.
+
+A user's role in a course depends on whether they are in the course's
+students or teaching assistants group. The first role check on a user
+reads the ids of all of their groups in one query and keeps them on the
+user object, which for request.user lasts for the request. When
+GRADES_ROLE_CACHE_TIMEOUT is set, the ids are also kept in the default
+cache for that many seconds, shared across requests. The handlers in
+grades/signals.py clear a user's entry whenever their groups change.
+With several server processes, that needs a shared cache backend such as
+Redis or Memcached.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import BooleanField, ExpressionWrapper, Q, Value
+
+# Bumped when a group is deleted, which invalidates every entry
+VERSION_KEY = 'grades:roles:version'
+
+def _cache_timeout():
+    return getattr(settings, 'GRADES_ROLE_CACHE_TIMEOUT', None)
+
+def _cache_key(user_id):
+    return f'grades:role-groups:{cache.get_or_set(VERSION_KEY, 1, None)}:{user_id}'
+
+def group_ids(user):
+    """The ids of the user's groups, as a frozenset."""
+    ids = getattr(user, '_group_ids', None)
+    if ids is not None:
+        return ids
+
+    if user.pk is None:
+        ids = frozenset()
+    elif _cache_timeout():
+        key = _cache_key(user.pk)
+        ids = cache.get(key)
+        if ids is None:
+            ids = frozenset(user.groups.values_list('id', flat=True))
+            cache.set(key, ids, _cache_timeout())
+    else:
+        ids = frozenset(user.groups.values_list('id', flat=True))
+
+    user._group_ids = ids
+    return ids
+
+async def agroup_ids(user):
+    """Async version of group_ids."""
+    ids = getattr(user, '_group_ids', None)
+    if ids is not None:
+        return ids
+    return await sync_to_async(group_ids)(user)
+
+def is_student(user, course):
+    return course.students_id in group_ids(user)
+
+def is_ta(user, course):
+    return course.teaching_assistants_id in group_ids(user)
+
+def forget(user_ids):
+    """Drop the cached groups of these users, after their groups changed."""
+    if _cache_timeout():
+        cache.delete_many([_cache_key(user_id) for user_id in user_ids])
+
+def forget_all():
+    """Drop every user's cached groups, after a group was deleted."""
+    if _cache_timeout():
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            # Not set yet, so nothing is cached under a version either
+            pass
+
+def can_grade(user, submission):
+    """Admins can grade any submission, TAs the ones assigned to them."""
+    return user.is_superuser or (user.pk is not None and user.pk == submission.grader_id)
+
+def can_view(user, submission):
+    """Admins can view any submission, and so can its author and grader."""
+    return user.is_superuser or (
+        user.pk is not None and user.pk in (submission.author_id, submission.grader_id)
+    )
+
+def gradable_by(user):
+    """can_grade as a query expression, for checking many submissions at once."""
+    if user.is_superuser:
+        return Value(True)
+    if user.pk is None:
+        return Value(False)
+    return ExpressionWrapper(Q(grader_id=user.pk), output_field=BooleanField())
@@ -0,0 +1,171 @@
+import asyncio
+import re
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
+from django.utils.http import http_date, parse_http_date_safe
+from . import metrics
+
+CHUNK_SIZE = 64 * 1024
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def _parse_range(header, size):
+    """
+    Returns (start, end) for a single byte range, inclusive, None if the
+    header should be ignored (missing, malformed or multi-range) or False if
+    it can't be satisfied.
+    """
+    match = RANGE_PATTERN.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+def _range_applies(request, etag, modified):
+    """If-Range: only honor the Range header if the file hasn't changed."""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(modified) <= since
+
+def _stream(file, start, length):
+    """Yields `length` bytes of the file starting at `start`, a chunk at a time."""
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+def _offload(file, response):
+    """
+    Hand the transfer to the front-end web server when SENDFILE_MODE is set,
+    so no worker is tied up sending bytes. Returns None if not configured.
+    """
+    mode = getattr(settings, 'SENDFILE_MODE', None)
+    if mode == 'x-sendfile':
+        response['X-Sendfile'] = file.path
+    elif mode == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = settings.SENDFILE_URL + file.name
+    else:
+        return None
+    # The web server fills in the body, length and ranges
+    return response
+
+def _plan(request, file, filename, content_type, etag):
+    """
+    Works out the response for a stored file. Returns a finished response
+    (304, 416 or offloaded to the web server), or (headers, byte_range, size)
+    where byte_range is None for the whole file.
+    """
+    storage = file.storage
+    size = file.size
+    modified = storage.get_modified_time(file.name).timestamp()
+    if etag is None:
+        etag = f'"{size:x}-{int(modified):x}"'
+
+    headers = {
+        'Content-Type': content_type,
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': http_date(modified),
+    }
+
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponse(status=304, headers={'ETag': etag})
+
+    offloaded = _offload(file, HttpResponse(headers=headers))
+    if offloaded is not None:
+        metrics.count_download(size)
+        return offloaded
+
+    byte_range = None
+    if request.method in ('GET', 'HEAD') and _range_applies(request, etag, modified):
+        byte_range = _parse_range(request.headers.get('Range'), size)
+
+    if byte_range is False:
+        headers['Content-Range'] = f'bytes */{size}'
+        return HttpResponse(status=416, headers=headers)
+
+    return headers, byte_range, size
+
+def serve_file(request, file, filename, content_type='application/octet-stream', etag=None):
+    """
+    Returns a response that streams a stored file in chunks, honoring
+    single-range Range and If-Range headers, or that hands the transfer to
+    the web server when SENDFILE_MODE is configured.
+    """
+    plan = _plan(request, file, filename, content_type, etag)
+    if isinstance(plan, HttpResponse):
+        return plan
+    headers, byte_range, size = plan
+
+    if byte_range is None:
+        metrics.count_download(size)
+        # Whole file; FileResponse streams it in chunks and closes it
+        return FileResponse(file.open('rb'), as_attachment=True, filename=filename, headers=headers)
+
+    start, end = byte_range
+    headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+    metrics.count_download(end - start + 1)
+    return StreamingHttpResponse(
+        _stream(file.open('rb'), start, end - start + 1), status=206, headers=headers
+    )
+
+async def _astream(file, start, length):
+    """Like _stream, but reads in a worker thread so the event loop never blocks."""
+    try:
+        await asyncio.to_thread(file.seek, start)
+        while length > 0:
+            chunk = await asyncio.to_thread(file.read, min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+async def aserve_file(request, file, filename, content_type='application/octet-stream', etag=None):
+    """
+    Async version of serve_file for async views under ASGI. The file is read
+    one chunk at a time off the event loop, so a slow client only holds a
+    paused coroutine. (Under ASGI, Django collects a synchronous streaming
+    response into memory before sending it.)
+    """
+    plan = await asyncio.to_thread(_plan, request, file, filename, content_type, etag)
+    if isinstance(plan, HttpResponse):
+        return plan
+    headers, byte_range, size = plan
+
+    if byte_range is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+    metrics.count_download(end - start + 1)
+
+    opened = await asyncio.to_thread(file.open, 'rb')
+    return StreamingHttpResponse(_astream(opened, start, end - start + 1), status=status, headers=headers)
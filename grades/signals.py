@@ -0,0 +1,173 @@
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from . import models, student_grades, counters, courses, fragments, gradebook, roles, similarity, storage
+
+# Note: QuerySet.update() and bulk_update() skip these handlers, so callers
+# have to refresh the affected grades, counters and fragments themselves.
+
+def _submission_state(submission):
+    return {
+        'assignment_id': submission.assignment_id,
+        'author_id': submission.author_id,
+        'grader_id': submission.grader_id,
+        'score': submission.score,
+        'file': submission.file.name
+    }
+
+def _fingerprint_after_commit(submission):
+    # Reading and hashing the file would hold the upload's write lock, so it
+    # waits for the commit, and then happens in the background rather than
+    # before the response; index_submissions catches any file missed here
+    name, files = submission.file.name, submission.file.storage
+    transaction.on_commit(lambda: similarity.index_later(name, files), using=submission._state.db, robust=True)
+
+@receiver(post_save, sender=models.Submission)
+def submission_saved(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded', None)
+    counters.record_save(instance, loaded, created)
+
+    # Reference counts for content-addressed storage, and fingerprints of
+    # new files for the similarity reports
+    if created:
+        storage.add_reference(instance.file.name)
+        _fingerprint_after_commit(instance)
+    elif loaded is not None and loaded.get('file') is not None and loaded['file'] != instance.file.name:
+        storage.release_reference(loaded.get('file'))
+        storage.add_reference(instance.file.name)
+        _fingerprint_after_commit(instance)
+
+    loaded = loaded or {}
+    course = courses.course_of(instance.assignment)
+    authors = {instance.author_id, loaded.get('author_id')} - {None}
+    if created or loaded.get('score') != instance.score or loaded.get('author_id') != instance.author_id:
+        student_grades.refresh_student_grades(course, authors)
+    assignment_ids = {instance.assignment_id, loaded.get('assignment_id')} - {None}
+    fragments.bump(
+        f'grading:{course.id}',
+        *(f'student:{course.id}:{author_id}' for author_id in authors),
+        *(f'scores:{course.id}:{assignment_id}' for assignment_id in assignment_ids)
+    )
+
+    # The saved state is the new baseline for the next save
+    instance._loaded = _submission_state(instance)
+
+def _deleting(origin, *deleted):
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model in deleted
+
+@receiver(post_delete, sender=models.Submission)
+def submission_deleted(sender, instance, origin=None, **kwargs):
+    storage.release_reference(instance.file.name)
+
+    # Deleting an assignment or course takes its counters and submissions
+    # with it, and assignment_deleted refreshes the grades afterwards
+    if _deleting(origin, models.Assignment, models.Course):
+        return
+    course = courses.course_of(instance.assignment)
+    fragments.bump(
+        f'grading:{course.id}', f'student:{course.id}:{instance.author_id}',
+        f'scores:{course.id}:{instance.assignment_id}'
+    )
+    counters.record_change(_submission_state(instance), None)
+    student_grades.refresh_student_grades(course, [instance.author_id])
+
+@receiver(pre_save, sender=models.Assignment)
+def assignment_saving(sender, instance, **kwargs):
+    # A deadline set or moved by hand takes effect now; run_deadlines closes
+    # the others as they pass
+    if getattr(instance, '_loaded', {}).get('deadline') != instance.deadline:
+        instance.past_due = gradebook.is_due(instance.deadline)
+
+@receiver(post_save, sender=models.Assignment)
+def assignment_saved(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded', {})
+    changed = any(
+        loaded.get(name) != getattr(instance, name)
+        for name in ('weight', 'points', 'deadline')
+    )
+    course = courses.course_of(instance)
+    if created or changed:
+        student_grades.refresh_grades(course)
+    fragments.bump(f'assignments:{course.id}', f'assignment:{course.id}:{instance.pk}')
+    instance._loaded = {
+        'weight': instance.weight,
+        'points': instance.points,
+        'deadline': instance.deadline
+    }
+
+@receiver(post_delete, sender=models.Assignment)
+def assignment_deleted(sender, instance, origin=None, **kwargs):
+    fragments.bump(
+        f'assignments:{instance.course_id}', f'assignment:{instance.course_id}:{instance.pk}',
+        f'grading:{instance.course_id}'
+    )
+    if not _deleting(origin, models.Course):
+        student_grades.refresh_grades(courses.course_of(instance))
+
+@receiver(post_save, sender=models.Course)
+def course_saved(sender, instance, **kwargs):
+    # The course's database needs its own copy of the course and its members
+    courses.sync_members(instance)
+
+@receiver(pre_delete, sender=models.Course)
+def course_deleting(sender, instance, **kwargs):
+    # Deleting only cascades within the default database; clear out the
+    # course's tables and its copy of the course in its own database
+    if instance.database == DEFAULT_DB_ALIAS or instance._state.db != DEFAULT_DB_ALIAS:
+        return
+    with courses.activate(instance):
+        models.Assignment.objects.filter(course=instance).delete()
+        models.StudentGrade.objects.filter(course=instance).delete()
+    models.Course.objects.using(instance.database).filter(pk=instance.pk).delete()
+
+@receiver(m2m_changed, sender=models.User.groups.through)
+def group_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # group.user_set.add(...) and friends
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            counters.recount_groups([instance.pk])
+        if action in ('post_add', 'post_remove'):
+            roles.forget(pk_set)
+            courses.sync_groups([instance.pk], pk_set)
+        elif action == 'post_clear':
+            roles.forget_all()
+            courses.sync_groups([instance.pk])
+        return
+
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        # The user's groups are loaded again on the next role check
+        instance.__dict__.pop('_group_ids', None)
+        roles.forget([instance.pk])
+    if action == 'pre_clear':
+        # user.groups.clear() doesn't say which groups it removed
+        instance._cleared_group_ids = list(instance.groups.values_list('id', flat=True))
+    elif action == 'post_clear':
+        counters.recount_groups(getattr(instance, '_cleared_group_ids', []))
+        courses.sync_groups(getattr(instance, '_cleared_group_ids', []), [instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        counters.recount_groups(pk_set)
+        courses.sync_groups(pk_set, [instance.pk])
+
+@receiver(post_save, sender=models.Group)
+@receiver(post_delete, sender=models.Group)
+def group_changed(sender, instance, **kwargs):
+    roles.forget_all()
+
+@receiver(post_save, sender=models.User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Logging in only changes last_login, which the copies don't need
+    if created or update_fields == frozenset(['last_login']):
+        return
+    courses.sync_user(instance)
+
+@receiver(pre_delete, sender=models.User)
+def user_deleting(sender, instance, **kwargs):
+    # Deleting a user removes their memberships without any m2m_changed
+    instance._deleted_group_ids = list(instance.groups.values_list('id', flat=True))
+
+@receiver(post_delete, sender=models.User)
+def user_deleted(sender, instance, **kwargs):
+    counters.recount_groups(getattr(instance, '_deleted_group_ids', []))
+    roles.forget([instance.pk])
@@ -0,0 +1,333 @@
+"""
+Near-duplicate detection for submitted files, without comparing every
+file with every other.
+
+Each stored file gets a fingerprint once, in a background thread after the
+first submission using it is committed (or from the index_submissions
+command). The text is taken
+from the PDF's content streams, cut into shingles of SHINGLE_WORDS
+consecutive words, and each shingle is hashed. A PDF without any
+extractable text, such as a scan, falls back to shingles of its bytes. The hashes
+are reduced to a MinHash signature of SIGNATURE_SIZE values by
+one-permutation hashing: each hash lands in one of the signature's bins
+by its low bits, and each bin keeps its smallest hash. That costs one
+hash per shingle, rather than one per shingle for every bin. The share
+of bins in which two signatures agree estimates the Jaccard similarity
+of the two files' shingle sets.
+
+The signature is cut into BANDS bands of ROWS values, and each band is
+hashed to one indexed key (locality-sensitive hashing). Two files with a
+similarity of s share at least one key with probability
+1 - (1 - s**ROWS)**BANDS: better than even odds at 0.42 and near
+certainty above 0.6. Finding a file's candidates is therefore an index
+lookup on its keys, whatever the number of files. Only the candidates'
+signatures are compared, and pairs at or above THRESHOLD are reported.
+
+Stored files are shared between courses (see grades/storage.py), so the
+fingerprints live in the default database next to StoredFile, and a
+submission is compared with every course and past semester at once.
+Identical uploads share a file and so one fingerprint.
+"""
+import hashlib
+import logging
+import queue
+import re
+import struct
+import threading
+import zlib
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from . import courses, models
+
+SIGNATURE_SIZE = 128
+BANDS = 32
+ROWS = SIGNATURE_SIZE // BANDS
+SHINGLE_WORDS = 3
+# Shingles of the raw file when there is no text
+SHINGLE_BYTES = 16
+# Estimated similarity from which two files are reported
+THRESHOLD = 0.5
+# Submissions of a file listed from other assignments; the rest are counted
+MAX_LISTED = 20
+# Only the start of larger files is fingerprinted, and of files without
+# text only the start is shingled
+MAX_BYTES = 16 * 1024 * 1024
+MAX_SHINGLED_BYTES = 256 * 1024
+# Text taken from one file, and what its compressed streams may inflate to
+# in all: a few KiB of Flate can hold gigabytes
+MAX_TEXT = 1024 * 1024
+MAX_INFLATED = MAX_BYTES
+
+_BIN_BITS = SIGNATURE_SIZE.bit_length() - 1
+_VALUE_BITS = 64 - _BIN_BITS
+_EMPTY = 1 << _VALUE_BITS
+_PACKING = struct.Struct(f'<{SIGNATURE_SIZE}Q')
+
+_STREAM = re.compile(rb'stream\r?\n(.*?)\r?\nendstream', re.DOTALL)
+_TEXT_BLOCK = re.compile(rb'BT(.*?)ET', re.DOTALL)
+# Literal (...) and hex <...> strings, as shown by Tj, TJ, ' and "
+_STRING = re.compile(rb'\(((?:\\.|[^\\)])*)\)|<([0-9A-Fa-f\s]+)>', re.DOTALL)
+_ESCAPE = re.compile(rb'\\([nrtbf()\\]|[0-7]{1,3}|\r?\n)')
+_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+_WORD = re.compile(rb'\w+')
+
+def _unescape(match):
+    escaped = match.group(1)
+    if escaped[:1].isdigit():
+        return bytes([int(escaped, 8) & 0xFF])
+    if escaped[:1] in b'\r\n':
+        return b''
+    return _ESCAPES.get(escaped, escaped)
+
+def pdf_text(data):
+    """
+    The strings the PDF's content streams show, as bytes. Good enough to
+    compare documents, not to read them: fonts with their own encodings
+    come out as hex, which is still the same for the same text. Stops at
+    MAX_TEXT bytes of text, or once the streams inflated to MAX_INFLATED.
+    """
+    pieces = []
+    size = 0
+    inflated = 0
+    for stream in _STREAM.finditer(data):
+        if inflated >= MAX_INFLATED:
+            break
+        content = stream.group(1)
+        try:
+            content = zlib.decompressobj().decompress(content, MAX_INFLATED - inflated)
+            inflated += len(content)
+        except zlib.error:
+            # Not compressed, or not with Flate
+            pass
+        for block in _TEXT_BLOCK.finditer(content):
+            for literal, hexadecimal in _STRING.findall(block.group(1)):
+                pieces.append(_ESCAPE.sub(_unescape, literal) if literal else hexadecimal)
+                size += len(pieces[-1]) + 1
+                if size > MAX_TEXT:
+                    return b' '.join(pieces)[:MAX_TEXT]
+    return b' '.join(pieces)
+
+def _hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'little')
+
+def shingles(data):
+    """The set of shingle hashes of a PDF's text, or of its bytes if it has none."""
+    words = _WORD.findall(pdf_text(data).lower())
+    if words:
+        # Shorter texts are one shingle
+        return {
+            _hash(b' '.join(words[i:i + SHINGLE_WORDS]))
+            for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))
+        }
+    data = data[:MAX_SHINGLED_BYTES]
+    return {_hash(data[i:i + SHINGLE_BYTES]) for i in range(max(len(data) - SHINGLE_BYTES + 1, 0))}
+
+def signature(hashes):
+    """The MinHash signature of a set of 64-bit hashes, as a list of SIGNATURE_SIZE ints, or None if it is empty."""
+    if not hashes:
+        return None
+    bins = [_EMPTY] * SIGNATURE_SIZE
+    for value in hashes:
+        index = value & (SIGNATURE_SIZE - 1)
+        value >>= _BIN_BITS
+        if value < bins[index]:
+            bins[index] = value
+    # Empty bins borrow the value of the next full one, with the distance
+    # in the high bits, so two files agree on an empty bin only if they
+    # agree on the bin it borrowed from
+    filled = {index for index, value in enumerate(bins) if value != _EMPTY}
+    for index in range(SIGNATURE_SIZE):
+        if index not in filled:
+            distance = next(
+                offset for offset in range(1, SIGNATURE_SIZE) if (index + offset) % SIGNATURE_SIZE in filled
+            )
+            bins[index] = bins[(index + distance) % SIGNATURE_SIZE] | (distance << _VALUE_BITS)
+    return bins
+
+def similarity(first, second):
+    """Estimated Jaccard similarity of the files with these signatures."""
+    return sum(a == b for a, b in zip(first, second)) / SIGNATURE_SIZE
+
+def band_keys(bins):
+    """The LSH keys of a signature, one per band, as signed 64-bit ints."""
+    packed = _PACKING.pack(*bins)
+    return [
+        int.from_bytes(
+            hashlib.blake2b(bytes([band]) + packed[band * ROWS * 8:(band + 1) * ROWS * 8], digest_size=8).digest(),
+            'little', signed=True
+        )
+        for band in range(BANDS)
+    ]
+
+def fingerprint(file):
+    """The signature of an open file, read up to MAX_BYTES, or None if there is nothing to compare."""
+    return signature(shingles(file.read(MAX_BYTES)))
+
+def _record(name, bins):
+    """Stores one file's fingerprint and its band keys. Files without a signature get an empty one."""
+    stored = _PACKING.pack(*bins) if bins is not None else b''
+    with transaction.atomic():
+        models.Fingerprint.objects.update_or_create(name=name, defaults={'signature': stored})
+        models.FingerprintBand.objects.filter(fingerprint_id=name).delete()
+        if bins is not None:
+            # Two uploads of the same new file can race to record it
+            models.FingerprintBand.objects.bulk_create(
+                (models.FingerprintBand(fingerprint_id=name, key=key) for key in band_keys(bins)),
+                ignore_conflicts=True
+            )
+
+def index(name, storage, force=False):
+    """
+    Fingerprints the stored file `name` unless that was done already.
+    Returns False if the file couldn't be read.
+    """
+    if not name or (not force and models.Fingerprint.objects.filter(name=name).exists()):
+        return True
+    try:
+        with storage.open(name, 'rb') as file:
+            bins = fingerprint(file)
+    except OSError:
+        return False
+    _record(name, bins)
+    return True
+
+logger = logging.getLogger(__name__)
+
+# Files waiting for index_later(), and the thread that fingerprints them
+_pending = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+def index_later(name, storage):
+    """
+    index() in this process's background thread, so an upload's response
+    doesn't wait for its file to be read and hashed, which takes up to a
+    few hundred milliseconds for a large PDF. Files still waiting when the
+    process exits are left for index_submissions. With
+    GRADES_INDEX_IN_REQUEST, indexes the file before returning instead.
+    """
+    global _worker
+    if getattr(settings, 'GRADES_INDEX_IN_REQUEST', False):
+        index(name, storage)
+        return
+    _pending.put((name, storage))
+    with _worker_lock:
+        # Threads don't survive a fork, so a forked worker process starts its own
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_index_pending, name='grades-index', daemon=True)
+            _worker.start()
+
+def _index_pending():
+    while True:
+        name, storage = _pending.get()
+        try:
+            if not index(name, storage):
+                logger.warning("Couldn't read %s to fingerprint it", name)
+        except Exception:
+            logger.exception("Fingerprinting %s failed", name)
+        finally:
+            if _pending.empty():
+                # Don't hold a connection while there is nothing to do
+                connections.close_all()
+            _pending.task_done()
+
+def wait_for_index():
+    """Waits until the files passed to index_later() have been fingerprinted."""
+    _pending.join()
+
+def _signatures(names):
+    return {
+        name: list(_PACKING.unpack(stored))
+        for name, stored in models.Fingerprint.objects.filter(name__in=names).exclude(signature=b'')
+        .values_list('name', 'signature')
+    }
+
+def similar_files(names):
+    """
+    Pairs of stored files at least THRESHOLD similar where one of them is
+    in `names`, found through the band index, as {(name, other): similarity}.
+    Every pair is listed once, with names in sorted order.
+    """
+    names = set(names)
+    buckets = defaultdict(set)
+    for name, key in (models.FingerprintBand.objects
+                      .filter(key__in=models.FingerprintBand.objects.filter(fingerprint_id__in=names).values('key'))
+                      .values_list('fingerprint_id', 'key')):
+        buckets[key].add(name)
+
+    candidates = set()
+    for bucket in buckets.values():
+        for pair in combinations(sorted(bucket), 2):
+            if pair[0] in names or pair[1] in names:
+                candidates.add(pair)
+    signatures = _signatures({name for pair in candidates for name in pair})
+    pairs = {}
+    for first, second in candidates:
+        score = similarity(signatures[first], signatures[second])
+        if score >= THRESHOLD:
+            pairs[first, second] = score
+    return pairs
+
+def _elsewhere(names, assignment):
+    """
+    Submissions of these stored files for other assignments, in every
+    course: up to MAX_LISTED per file, by file name, and how many each
+    file has in all.
+    """
+    database = courses.course_of(assignment).database
+    found = defaultdict(list)
+    totals = Counter()
+    for alias in courses.databases():
+        submissions = models.Submission.objects.using(alias).filter(file__in=names)
+        if alias == database:
+            submissions = submissions.exclude(assignment=assignment)
+        submissions = submissions.annotate(
+            number=Window(RowNumber(), partition_by=F('file'), order_by=F('id').asc()),
+            total=Window(Count('id'), partition_by=F('file')),
+        ).filter(number__lte=MAX_LISTED).select_related('author', 'assignment__course')
+        for submission in submissions:
+            found[submission.file.name].append(submission)
+            totals[submission.file.name] += submission.total if submission.number == 1 else 0
+    return found, totals
+
+def similar_submissions(assignment):
+    """
+    The assignment's submitted files that are identical or at least
+    THRESHOLD similar to a file another student submitted, for this or any
+    other assignment of any course, most similar first. Students who
+    uploaded the same file share one row, so the report grows with the
+    number of files, not the number of pairs of students. Each row is
+    {'submissions': the assignment's submissions of the file,
+     'others': other students' submissions of the file it resembles,
+     elsewhere if it is the same file, up to MAX_LISTED from elsewhere,
+     'more': how many more submissions of it there are elsewhere,
+     'similarity': the estimate, 1.0 for the same file}.
+    """
+    own = defaultdict(list)
+    for submission in assignment.submission_set.exclude(file='').select_related('author').order_by('id'):
+        own[submission.file.name].append(submission)
+    scores = similar_files(own)
+    # Submissions of one file are identical
+    scores.update({(name, name): 1.0 for name in own})
+    elsewhere, totals = _elsewhere({name for pair in scores for name in pair}, assignment)
+
+    rows = []
+    for (first, second), score in scores.items():
+        # Start from the assignment's side of the pair
+        if first not in own:
+            first, second = second, first
+        submissions = own[first]
+        authors = {submission.author_id for submission in submissions}
+        candidates = elsewhere[second] + (own[second] if second != first else [])
+        others = [other for other in candidates if other.author_id not in authors]
+        more = totals[second] - len(elsewhere[second])
+        # A file of the assignment's own is suspicious once two students submitted it
+        if others or more or (first == second and len(authors) > 1):
+            rows.append({'submissions': submissions, 'others': others, 'more': more, 'similarity': score})
+    rows.sort(key=lambda row: (-row['similarity'], row['submissions'][0].author.username))
+    return rows
@@ -0,0 +1,149 @@
+"""
+SQLite set up for deadlines: WAL journaling, tuned pragmas and one writer
+at a time.
+
+settings.py switches every SQLite database to this backend when
+GRADES_SQLITE_PRODUCTION is set. Each new connection then runs with
+journal_mode=WAL, so pages keep reading the last commit while uploads and
+grades are written instead of waiting for them, plus the busy timeout,
+memory map size and synchronous level from settings.
+
+SQLite lets one connection write to a file at a time. A transaction that
+reads first and then writes fails straight away with "database is locked"
+if another connection wrote in between, since waiting could deadlock; under
+a deadline rush, uploads and grade saves did. Here transactions begin
+IMMEDIATE, taking SQLite's write lock before their first read, and the
+threads of a process queue for it on a lock of their own rather than
+polling in SQLite's busy handler. Writes outside a transaction (sessions,
+single updates) take the same lock. What still finds the file locked,
+because another process is writing, is retried WRITE_RETRIES times with
+backoff. Reads outside transactions never wait for any of this.
+
+Every transaction.atomic() block takes the lock, even one that only reads,
+so keep blocks that don't write out of them.
+"""
+import random
+import re
+import threading
+import time
+
+from django.db import OperationalError
+from django.db.backends.sqlite3 import base
+
+# Applied to every new connection; OPTIONS['pragmas'] adds to or overrides them
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    # Durable across crashes of the application; a power cut can lose the
+    # last commits, but never corrupts the database
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+# Seconds to wait for the write lock (this process's, then SQLite's) when
+# OPTIONS doesn't give a timeout
+DEFAULT_TIMEOUT = 5
+
+# Attempts at a write that finds the file locked, and the first pause between
+# them in seconds, doubled each time
+WRITE_RETRIES = 4
+RETRY_DELAY = 0.05
+
+_WRITE = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+# One lock per database file, shared by every connection in the process
+_locks = {}
+_locks_lock = threading.Lock()
+
+def _write_lock(name):
+    with _locks_lock:
+        return _locks.setdefault(str(name), threading.Lock())
+
+def _locked(error):
+    message = str(error)
+    return 'database is locked' in message or 'database table is locked' in message
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The write lock this connection holds, if any
+        self._held = None
+        # First, so statements wait for the lock outside the other wrappers' timing
+        self.execute_wrappers.append(self._serialize_write)
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.pragmas = {**PRAGMAS, **kwargs.pop('pragmas', {})}
+        kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+        self.lock_timeout = kwargs['timeout']
+        if self.transaction_mode is None:
+            self.transaction_mode = 'IMMEDIATE'
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    def _acquire(self):
+        lock = _write_lock(self.settings_dict['NAME'])
+        if not lock.acquire(timeout=self.lock_timeout):
+            raise OperationalError(
+                f"database is locked: another thread held the write lock for {self.lock_timeout}s"
+            )
+        self._held = lock
+
+    def _release(self):
+        lock, self._held = self._held, None
+        if lock is not None:
+            lock.release()
+
+    def _retry(self, write):
+        for attempt in range(WRITE_RETRIES):
+            try:
+                return write()
+            except OperationalError as e:
+                if not _locked(e) or attempt == WRITE_RETRIES - 1:
+                    raise
+            time.sleep(RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1))
+
+    def _serialize_write(self, execute, sql, params, many, context):
+        """Execute wrapper: a write outside a transaction takes the lock, and is retried."""
+        if self._held is not None or not self.autocommit or not _WRITE.match(sql):
+            return execute(sql, params, many, context)
+        self._acquire()
+        try:
+            return self._retry(lambda: execute(sql, params, many, context))
+        finally:
+            self._release()
+
+    def _start_transaction_under_autocommit(self):
+        # Held until the transaction commits or rolls back
+        self._acquire()
+        try:
+            self._retry(super()._start_transaction_under_autocommit)
+        except BaseException:
+            self._release()
+            raise
+
+    def _end_transaction(self):
+        if self.connection is None or not self.connection.in_transaction:
+            self._release()
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            self._end_transaction()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self._end_transaction()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self._release()
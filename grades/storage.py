@@ -0,0 +1,139 @@
+import hashlib
+import os
+import tempfile
+import time
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, storages
+from django.db.models import F
+
+# Directories under MEDIA_ROOT that garbage collection looks through
+GC_DIRECTORIES = ['submissions', '.staging']
+
+def _byte_chunks(content):
+    for chunk in content.chunks():
+        yield chunk.encode() if isinstance(chunk, str) else chunk
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each file under its SHA-256 digest, fanned out two levels deep
+    (submissions/ab/cd/abcd....pdf), so identical uploads share one copy
+    and no directory grows too large. The name passed in only contributes
+    its directory and extension.
+
+    Files are shared, so delete() is left to garbage collection: see
+    add_reference(), release_reference() and the collect_uploads command.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The real name comes from the content, in _save
+        return name
+
+    def digest_name(self, name, digest):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], digest[2:4], digest + extension).replace('\\', '/')
+
+    def _save(self, name, content):
+        # Uploads that went through PdfUploadHandler are already hashed
+        digest = getattr(content, 'sha256', None)
+        if digest is None:
+            hasher = hashlib.sha256()
+            for chunk in _byte_chunks(content):
+                hasher.update(chunk)
+            digest = hasher.hexdigest()
+            content.seek(0)
+
+        name = self.digest_name(name, digest)
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            # Same content is already stored. Touch it so garbage collection
+            # treats it as fresh until the new reference is recorded.
+            os.utime(full_path)
+            return name
+
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        if hasattr(content, 'temporary_file_path'):
+            # A staged upload on the same filesystem: just rename it
+            file_move_safe(content.temporary_file_path(), full_path, allow_overwrite=True)
+        else:
+            # Write next to the target and rename, so a concurrent save of the
+            # same content can never leave a half-written file behind
+            with tempfile.NamedTemporaryFile(dir=directory, delete=False) as f:
+                for chunk in _byte_chunks(content):
+                    f.write(chunk)
+            os.replace(f.name, full_path)
+
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+def submission_storage():
+    """Storage for Submission.file, configured as "submissions" in STORAGES."""
+    return storages['submissions']
+
+def add_reference(name):
+    """Count one more submission using the stored file `name`."""
+    from .models import StoredFile
+    if name and not StoredFile.objects.filter(name=name).update(refcount=F('refcount') + 1):
+        StoredFile.objects.get_or_create(name=name)
+        StoredFile.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+def release_reference(name):
+    """Count one fewer submission using the stored file `name`."""
+    from .models import StoredFile
+    if name:
+        StoredFile.objects.filter(name=name).update(refcount=F('refcount') - 1)
+
+def collect_garbage(storage, min_age=3600, dry_run=False):
+    """
+    Deletes stored files that no submission references any more, plus
+    orphaned files on disk that were never recorded, as long as they are
+    older than `min_age` seconds. Returns the names deleted.
+    """
+    from .courses import databases
+    from .models import Fingerprint, StoredFile, Submission
+
+    cutoff = time.time() - min_age
+    deleted = []
+
+    def old_enough(name):
+        try:
+            return os.path.getmtime(storage.path(name)) < cutoff
+        except FileNotFoundError:
+            return True
+
+    # Recorded files nobody uses any more
+    for stored in StoredFile.objects.filter(refcount__lte=0).iterator():
+        if not old_enough(stored.name):
+            continue
+        if not dry_run:
+            # Only delete the row if no new reference raced in, and the file
+            # only if no new upload of the same content touched it meanwhile
+            if not StoredFile.objects.filter(name=stored.name, refcount__lte=0).delete()[0]:
+                continue
+            if old_enough(stored.name):
+                storage.delete(stored.name)
+        deleted.append(stored.name)
+
+    # Files on disk that nothing points to: from before reference counting,
+    # overwritten resubmissions and abandoned staged uploads
+    referenced = set(StoredFile.objects.values_list('name', flat=True))
+    for database in databases():
+        referenced.update(Submission.objects.using(database).values_list('file', flat=True).iterator())
+    root = storage.path('')
+    for top in GC_DIRECTORIES:
+        for directory, _, files in os.walk(storage.path(top)):
+            for filename in files:
+                name = os.path.relpath(os.path.join(directory, filename), root).replace('\\', '/')
+                if name in referenced or not old_enough(name):
+                    continue
+                if not dry_run:
+                    storage.delete(name)
+                deleted.append(name)
+
+    if not dry_run:
+        # A file kept because a new upload touched it keeps its fingerprint
+        Fingerprint.objects.filter(name__in=[name for name in deleted if not storage.exists(name)]).delete()
+    return deleted
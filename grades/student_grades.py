@@ -0,0 +1,52 @@
+from . import models
+from .gradebook import CourseGradebook, is_due
+
+GRADE_FIELDS = ['percentage', 'available_points', 'earned_points', 'computed_at', 'valid_until']
+
+def refresh_grades(course, students=None):
+    """
+    Recompute and store the grades of the given students (a User queryset,
+    defaulting to the course's students group) with one pass of the course
+    gradebook, with the course active. Each row holds until the course's
+    next deadline, when what counts as due changes.
+    """
+    gradebook = CourseGradebook(course, students=students)
+    rows = [
+        models.StudentGrade(
+            course_id=course.id,
+            student_id=user_id,
+            computed_at=gradebook.now,
+            valid_until=gradebook.next_deadline,
+            **grade
+        )
+        for user_id, grade in gradebook.grades().items()
+    ]
+    models.StudentGrade.objects.bulk_create(
+        rows,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['course', 'student'],
+        update_fields=GRADE_FIELDS
+    )
+    return rows
+
+def refresh_student_grades(course, user_ids):
+    """Recompute the stored grades of the course's students with these ids."""
+    user_ids = set(user_ids)
+    if user_ids:
+        refresh_grades(course, models.User.objects.filter(id__in=user_ids, groups=course.students_id))
+
+def get_grade(user, course):
+    """
+    Returns the user's grade in the course in the same shape as
+    compute_grade, reading the stored row and computing it only if it is
+    missing or a deadline has passed since. Rows are only stored for the
+    course's students; anyone else's grade is computed each time.
+    """
+    grade = models.StudentGrade.objects.filter(course=course, student=user).first()
+    if grade is None or (grade.valid_until is not None and is_due(grade.valid_until)):
+        students = models.User.objects.filter(id=user.id, groups=course.students_id)
+        if not students.exists():
+            return CourseGradebook(course, models.User.objects.filter(id=user.id)).grades()[user.id]
+        grade = refresh_grades(course, students)[0]
+    return grade.as_dict()
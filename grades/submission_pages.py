@@ -0,0 +1,108 @@
+"""
+One page of the submissions grading page at a time.
+
+Pages are keyset-paginated: instead of an OFFSET, which makes the
+database walk past every earlier row, each page starts after (or before)
+the submission whose id is in the `after` (or `before`) parameter,
+comparing by the sort key and then the id. Rendering a page costs the same
+however many students there are, and pages don't shift when a grade saved
+in between moves a row under the grade sort.
+
+The orders match the client-side sorter in static/main.js: the student
+column sorts by username, and the grade column sorts numerically with
+ungraded submissions (blank cells) before every score.
+"""
+from decimal import Decimal
+
+from django.db.models import DecimalField, F, Q, Value
+from django.db.models.functions import Coalesce
+from . import models
+
+PAGE_SIZE = 50
+
+SORTS = {
+    'student': F('author__username'),
+    # Scores are never negative, so ungraded sorts first like a blank cell
+    'grade': Coalesce('score', Value(Decimal(-1)), output_field=DecimalField(max_digits=5, decimal_places=2)),
+}
+
+class SubmissionPage:
+    """A page of submissions, with the cursors for the pages either side."""
+
+    def __init__(self, submissions, has_previous, has_next):
+        self.submissions = submissions
+        self.has_previous = has_previous
+        self.has_next = has_next
+
+    @property
+    def previous_cursor(self):
+        return self.submissions[0].id if self.has_previous and self.submissions else None
+
+    @property
+    def next_cursor(self):
+        return self.submissions[-1].id if self.has_next and self.submissions else None
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def visible_submissions(assignment, user, ungraded=False, grader=None):
+    """
+    The submissions of the assignment the user can grade: all of them for an
+    admin, optionally only one grader's ("none" for unassigned), or the
+    TA's own. `ungraded` keeps only those without a score.
+    """
+    submissions = assignment.submission_set.select_related('author', 'grader')
+    if not user.is_superuser:
+        submissions = submissions.filter(grader=user)
+    elif grader == 'none':
+        submissions = submissions.filter(grader__isnull=True)
+    elif _int(grader) is not None:
+        submissions = submissions.filter(grader_id=_int(grader))
+    if ungraded:
+        submissions = submissions.filter(score__isnull=True)
+    return submissions
+
+def page(submissions, sort='student', descending=False, after=None, before=None, size=PAGE_SIZE):
+    """
+    The page of `submissions` that starts after the submission id `after`,
+    or ends before the id `before`, or else the first page. Takes two
+    queries when given a cursor and one without.
+    """
+    if sort not in SORTS:
+        sort = 'student'
+    submissions = submissions.annotate(sort_key=SORTS[sort])
+    cursor_id = _int(before) if before is not None else _int(after)
+    # Walking backwards from `before` means reading in the opposite order
+    backwards = before is not None and cursor_id is not None
+    forward = descending == backwards
+
+    if cursor_id is not None:
+        cursor = submissions.filter(id=cursor_id).values_list('sort_key', flat=True).first()
+        if cursor is not None:
+            if forward:
+                beyond = Q(sort_key__gt=cursor) | Q(sort_key=cursor, id__gt=cursor_id)
+            else:
+                beyond = Q(sort_key__lt=cursor) | Q(sort_key=cursor, id__lt=cursor_id)
+            submissions = submissions.filter(beyond)
+        else:
+            # The cursor's submission is gone or filtered out: start over
+            cursor_id = None
+            backwards = False
+            forward = not descending
+
+    order = ('sort_key', 'id') if forward else ('-sort_key', '-id')
+    # One extra row tells whether there is another page
+    rows = list(submissions.order_by(*order)[:size + 1])
+    more = len(rows) > size
+    rows = rows[:size]
+    if backwards:
+        rows.reverse()
+        return SubmissionPage(rows, has_previous=more, has_next=True)
+    return SubmissionPage(rows, has_previous=cursor_id is not None, has_next=more)
+
+def graders(course):
+    """The course's TAs, who can be assigned submissions, for the admin's grader filter."""
+    return models.User.objects.filter(groups=course.teaching_assistants_id).order_by('username')
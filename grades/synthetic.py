@@ -0,0 +1,177 @@
+"""
+Synthetic course data at production scale, for makedata.py --students and
+the benchmark_views command.
+
+Everything is written with bulk_create in batches, so 20,000 students and
+a million submissions take a minute rather than hours. All users share one
+pre-hashed password, and the submissions share a small set of stub PDFs,
+stored once each through the content-addressed storage. bulk_create skips
+the save signals, so the counters, stored grades and fragment versions are
+rebuilt once at the end instead. The course can be in any database; its
+users are created in the default one and copied over.
+"""
+import datetime
+import random
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from . import counters, courses, fragments, models, similarity, student_grades
+from .storage import submission_storage
+
+BATCH_SIZE = 2000
+
+# Distinct stub files; submissions cycle through them
+PDF_STUBS = 16
+
+def _chunks(iterable, size=BATCH_SIZE):
+    iterable = iter(iterable)
+    while batch := list(islice(iterable, size)):
+        yield batch
+
+def pdf_stub(number):
+    """A small valid PDF whose one page names the stub, so each has its own digest."""
+    text = f"Synthetic submission {number}"
+    stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    body = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(body))
+        body += b"%d 0 obj\n%s\nendobj\n" % (i, obj)
+    xref = len(body)
+    body += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    body += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    body += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return body
+
+def _store_stubs():
+    """Saves the stub PDFs, returning (stored name, sha256) for each."""
+    storage = submission_storage()
+    stubs = []
+    for number in range(PDF_STUBS):
+        content = ContentFile(pdf_stub(number))
+        name = storage.save(f"submissions/stub{number}.pdf", content)
+        similarity.index(name, storage)
+        # The content-addressed name is the digest
+        stubs.append((name, name.rsplit('/', 1)[-1].split('.')[0]))
+    return stubs
+
+def _users(prefix, count, password, first_name):
+    return models.User.objects.bulk_create(
+        (
+            models.User(
+                username=f"{prefix}{i:05d}", password=password,
+                first_name=first_name, last_name=f"{prefix.capitalize()} {i}",
+                email=f"{prefix}{i:05d}@example.edu"
+            )
+            for i in range(count)
+        ),
+        batch_size=BATCH_SIZE
+    )
+
+def generate(students=200, assignments=10, tas=5, submit_rate=0.9, graded_rate=0.8,
+             password="password", seed=0, now=None, log=None, course=None):
+    """
+    Creates `students` students, `tas` TAs and `assignments` assignments in
+    `course`, by default a new course, cs3550. A third of the assignments
+    are still to come. Each student submits each assignment with
+    probability `submit_rate`, and past-due submissions are graded with
+    probability `graded_rate`. Usernames are student00000... and ta00000...,
+    all with the given password. Returns the number of submissions created.
+    Raises ValueError if any of the usernames are taken.
+    """
+    if now is None:
+        now = timezone.now()
+    if log is None:
+        log = lambda message: None
+    rng = random.Random(seed)
+
+    if models.User.objects.filter(username__regex=r'^(student|ta)[0-9]{5}$').exists():
+        raise ValueError("Synthetic users already exist; start from an empty database")
+
+    if course is None:
+        course = courses.create('cs3550', 'CS 3550')
+    with courses.activate(course), transaction.atomic(), courses.atomic():
+        student_group, ta_group = course.students, course.teaching_assistants
+
+        hashed = make_password(password)
+        log(f"Creating {students} students and {tas} TAs")
+        student_users = _users('student', students, hashed, "Student")
+        ta_users = _users('ta', tas, hashed, "TA")
+        Membership = models.User.groups.through
+        Membership.objects.bulk_create(
+            [Membership(user_id=user.id, group_id=student_group.id) for user in student_users] +
+            [Membership(user_id=user.id, group_id=ta_group.id) for user in ta_users],
+            batch_size=BATCH_SIZE
+        )
+        courses.sync_members(course)
+
+        log(f"Creating {assignments} assignments")
+        past = assignments - assignments // 3
+        assignment_rows = models.Assignment.objects.bulk_create(
+            models.Assignment(
+                course=course,
+                title=f"Homework {i + 1}",
+                description=f"<p>Synthetic assignment {i + 1}.</p>",
+                # Weekly deadlines, the first `past` of them already passed
+                deadline=now + datetime.timedelta(days=7 * (i - past + 1), hours=-1),
+                past_due=i < past,
+                weight=rng.choice([5, 10, 15, 20]),
+                points=rng.choice([10, 20, 50, 100])
+            )
+            for i in range(assignments)
+        )
+
+        stubs = _store_stubs()
+
+        def submissions():
+            grader = 0
+            for a, assignment in enumerate(assignment_rows):
+                past_due = assignment.past_due
+                for s, student in enumerate(student_users):
+                    if rng.random() >= submit_rate:
+                        continue
+                    name, digest = stubs[(a + s) % len(stubs)]
+                    score = None
+                    if past_due and rng.random() < graded_rate:
+                        score = round(rng.uniform(0.4, 1) * assignment.points, 2)
+                    yield models.Submission(
+                        assignment=assignment,
+                        author=student,
+                        grader=ta_users[grader % len(ta_users)] if ta_users else None,
+                        file=name,
+                        served_name=f"{student.username}_hw{a + 1}.pdf",
+                        sha256=digest,
+                        score=score
+                    )
+                    grader += 1
+
+        log("Creating submissions")
+        created = 0
+        used = {}
+        for batch in _chunks(submissions()):
+            models.Submission.objects.bulk_create(batch)
+            created += len(batch)
+            for submission in batch:
+                used[submission.file.name] = used.get(submission.file.name, 0) + 1
+        for name, count in used.items():
+            stored, _ = models.StoredFile.objects.get_or_create(name=name)
+            models.StoredFile.objects.filter(pk=stored.pk).update(refcount=F('refcount') + count)
+
+        # The save signals didn't run, so bring everything derived up to date
+        log(f"Created {created} submissions; rebuilding counters and grades")
+        counters.rebuild(course)
+        student_grades.refresh_grades(course)
+        fragments.bump(f'assignments:{course.id}', f'grading:{course.id}')
+    return created
@@ -0,0 +1,33 @@
+from django import template
+from .. import fragments
+
+register = template.Library()
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, name, scope):
+        self.nodelist = nodelist
+        self.name = name
+        self.scope = scope
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        scope = ':'.join(str(part.resolve(context)) for part in self.scope)
+        return fragments.cached(name, [], [scope], lambda: self.nodelist.render(context))
+
+@register.tag
+def fragment(parser, token):
+    """
+    Caches the enclosed template until the given scope's version changes
+    (see grades/fragments.py). The arguments after the fragment name are
+    joined with ":" into the scope:
+
+        {% fragment "assignment_header" "assignment" assignment.course_id assignment.id %}
+            ...
+        {% endfragment %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a fragment name and a scope")
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    return FragmentNode(nodelist, parser.compile_filter(bits[1]), [parser.compile_filter(bit) for bit in bits[2:]])
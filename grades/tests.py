@@ -1,3 +1,1453 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, Group
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import include, path
+from django.utils import timezone
+from grades.sqlite import base as sqlite
+from grades import (
+    api, async_views, counters, courses, export, fragments, gradebook, grade_import, grade_stats, grader_assignment,
+    metrics, models, profiling, rebalance, replicas, roles, serving, similarity, storage, student_grades, submission_pages,
+    uploads, views
+)
+
+class ScratchMixin:
+    """
+    Stores uploads under a scratch MEDIA_ROOT for the duration of each
+    test, keeps metrics and profiles off, and fingerprints uploads in the
+    test's own thread, which holds the test database's transaction.
+    """
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(
+            MEDIA_ROOT=media, GRADES_METRICS_DIR='', GRADES_PROFILE_DIR='', GRADES_INDEX_IN_REQUEST=True
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+def make_course(slug='cs3550', students=3, tas=2):
+    """A course with `students` students and `tas` TAs, as (course, students, tas)."""
+    course = courses.create(slug, slug.upper())
+    student_users = [models.User.objects.create_user(f'{slug}-student{i}') for i in range(students)]
+    ta_users = [models.User.objects.create_user(f'{slug}-ta{i}') for i in range(tas)]
+    course.students.user_set.add(*student_users)
+    course.teaching_assistants.user_set.add(*ta_users)
+    return course, student_users, ta_users
+
+def make_assignment(course, days=7, **fields):
+    with courses.activate(course):
+        return models.Assignment.objects.create(**{
+            'course': course,
+            'title': "Homework",
+            'description': "Do the homework",
+            'deadline': timezone.now() + datetime.timedelta(days=days),
+            'weight': 1,
+            'points': 10,
+            **fields,
+        })
+
+def pdf(text):
+    """A PDF whose one compressed content stream shows `text`, a line at a time."""
+    words = text.split()
+    lines = [' '.join(words[i:i + 12]) for i in range(0, len(words), 12)]
+    content = b"BT /F1 12 Tf " + b" ".join(b"(" + line.encode() + b") Tj T*" for line in lines) + b" ET"
+    stream = zlib.compress(content)
+    return (
+        b"%%PDF-1.4\n1 0 obj\n<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream\nendobj\n%%%%EOF\n"
+        % (len(stream), stream)
+    )
+
+def submit(assignment, author, data, name='hw.pdf'):
+    return grader_assignment.create_submission(assignment, author, ContentFile(data, name=name))
+
+def score(submission, value):
+    submission.score = Decimal(str(value))
+    submission.save()
+    return submission
+
+class GradebookTests(ScratchMixin, TestCase):
+    """CourseGradebook against compute_grade, one student at a time."""
+
+    def test_matches_compute_grade(self):
+        course, students, tas = make_course(students=5)
+        graded = make_assignment(course, days=-3, weight=2, points=7)
+        ungraded = make_assignment(course, days=-2, weight=3, points=10)
+        missing = make_assignment(course, days=-1, weight=1, points=3)
+        upcoming = make_assignment(course, days=4, weight=5, points=10)
+        with courses.activate(course):
+            # students[0] submits nothing, so everything past due is missing
+            for i, student in enumerate(students[1:], 1):
+                score(submit(graded, student, b'%PDF-1.4 graded'), i + 0.5)
+            submit(ungraded, students[2], b'%PDF-1.4 ungraded')
+            score(submit(ungraded, students[3], b'%PDF-1.4 ungraded'), 9)
+            score(submit(missing, students[4], b'%PDF-1.4 missing'), 2)
+            score(submit(upcoming, students[1], b'%PDF-1.4 early'), 10)
+
+            grades = gradebook.CourseGradebook(course).grades()
+            self.assertEqual(grades, {student.id: views.compute_grade(student, course) for student in students})
+        self.assertEqual(grades[students[0].id]['percentage'], 0)
+        self.assertEqual(grades[students[0].id]['available_points'], 6)
+
+    def test_nothing_due(self):
+        course, students, tas = make_course(students=2)
+        upcoming = make_assignment(course, days=2)
+        with courses.activate(course):
+            score(submit(upcoming, students[0], b'%PDF-1.4 early'), 5)
+            grades = gradebook.CourseGradebook(course).grades()
+            self.assertEqual(grades, {student.id: views.compute_grade(student, course) for student in students})
+        self.assertEqual(grades[students[0].id]['percentage'], 100)
+
+class StudentGradeTests(ScratchMixin, TestCase):
+    """Stored grades follow every change that affects them."""
+
+    def setUp(self):
+        super().setUp()
+        self.course, self.students, self.tas = make_course(students=2, tas=1)
+        self.assignment = make_assignment(self.course, days=-1, points=10)
+        self.enterContext(courses.activate(self.course))
+
+    def assertStored(self, student):
+        stored = models.StudentGrade.objects.get(course=self.course, student=student)
+        self.assertEqual(stored.as_dict(), views.compute_grade(student, self.course))
+        return stored
+
+    def test_score_change(self):
+        submission = submit(self.assignment, self.students[0], b'%PDF-1.4 work')
+        self.assertEqual(self.assertStored(self.students[0]).earned_points, 0)
+        score(submission, 8)
+        self.assertEqual(self.assertStored(self.students[0]).earned_points, Decimal('0.8'))
+
+    def test_author_change(self):
+        submission = score(submit(self.assignment, self.students[0], b'%PDF-1.4 work'), 10)
+        submission.author = self.students[1]
+        submission.save()
+        self.assertEqual(self.assertStored(self.students[0]).earned_points, 0)
+        self.assertEqual(self.assertStored(self.students[1]).earned_points, 1)
+
+    def test_submission_delete(self):
+        submission = score(submit(self.assignment, self.students[0], b'%PDF-1.4 work'), 10)
+        self.assertEqual(self.assertStored(self.students[0]).percentage, 100)
+        submission.delete()
+        self.assertEqual(self.assertStored(self.students[0]).percentage, 0)
+
+    def test_weight_and_points_edit(self):
+        score(submit(self.assignment, self.students[0], b'%PDF-1.4 work'), 5)
+        make_assignment(self.course, days=-2, points=4)
+        self.assertEqual(self.assertStored(self.students[0]).percentage, 25)
+        self.assignment.weight = 3
+        self.assignment.save()
+        self.assertEqual(self.assertStored(self.students[0]).percentage, Decimal('37.5'))
+        self.assignment.points = 5
+        self.assignment.save()
+        self.assertEqual(self.assertStored(self.students[0]).percentage, 75)
+        self.assertStored(self.students[1])
+
+    def test_only_students_are_stored(self):
+        ta = self.tas[0]
+        self.assertEqual(student_grades.get_grade(ta, self.course), views.compute_grade(ta, self.course))
+        self.assertFalse(models.StudentGrade.objects.filter(student=ta).exists())
+
+class GraderAssignmentTests(ScratchMixin, TransactionTestCase):
+    SUBMISSIONS = 60
+    THREADS = 8
+
+    def test_concurrent_submissions_are_balanced(self):
+        course, students, tas = make_course(tas=3)
+        assignment = make_assignment(course)
+        remaining = iter(range(self.SUBMISSIONS))
+        lock = threading.Lock()
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def worker():
+            start.wait()
+            try:
+                # Threads don't inherit the active course
+                with courses.activate(course):
+                    while True:
+                        with lock:
+                            number = next(remaining, None)
+                        if number is None:
+                            return
+                        submit(assignment, students[number % len(students)], b'%PDF-1.4 ' + str(number).encode())
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with courses.activate(course):
+            self.assertFalse(assignment.submission_set.filter(grader=None).exists())
+            loads = {ta.id: assignment.submission_set.filter(grader=ta).count() for ta in tas}
+            stored = dict(models.GraderLoad.objects.filter(assignment=assignment).values_list('grader', 'assigned'))
+        self.assertEqual(sum(loads.values()), self.SUBMISSIONS)
+        self.assertLessEqual(max(loads.values()) - min(loads.values()), 1)
+        self.assertEqual(stored, loads)
+
+class RebalanceTests(ScratchMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.course, self.students, self.tas = make_course(students=9, tas=3)
+        self.assignment = make_assignment(self.course)
+        self.enterContext(courses.activate(self.course))
+        self.submissions = [
+            submit(self.assignment, student, b'%PDF-1.4 ' + b'x' * (100 * i))
+            for i, student in enumerate(self.students, 1)
+        ]
+        # Everything starts with the first TA
+        self.assignment.submission_set.update(grader=self.tas[0])
+        counters.recount_grader_loads(self.assignment)
+
+    def loads(self):
+        return {
+            ta.id: self.assignment.submission_set.filter(grader=ta).count() for ta in self.tas
+        }
+
+    def assertLoadsStored(self):
+        stored = dict(models.GraderLoad.objects.filter(assignment=self.assignment).values_list('grader', 'assigned'))
+        self.assertEqual({ta_id: stored.get(ta_id, 0) for ta_id in self.loads()}, self.loads())
+
+    def test_evens_out_by_count(self):
+        moves = rebalance.rebalance(self.assignment)
+        self.assertEqual(len(moves), 6)
+        self.assertEqual(sorted(self.loads().values()), [3, 3, 3])
+        self.assertLoadsStored()
+
+    def test_graded_submissions_stay(self):
+        graded = self.submissions[:4]
+        for submission in graded:
+            submission.refresh_from_db()
+            score(submission, 5)
+        rebalance.rebalance(self.assignment)
+        for submission in graded:
+            submission.refresh_from_db()
+            self.assertEqual(submission.grader, self.tas[0])
+        # The first TA keeps the four graded ones
+        self.assertEqual(sorted(self.loads().values()), [2, 3, 4])
+
+    def test_former_tas_hand_over(self):
+        self.course.teaching_assistants.user_set.remove(self.tas[0])
+        rebalance.rebalance(self.assignment)
+        self.assertEqual(self.assignment.submission_set.filter(grader=self.tas[0]).count(), 0)
+        self.assertEqual(sorted(self.loads()[ta.id] for ta in self.tas[1:]), [4, 5])
+
+    def test_by_size(self):
+        rebalance.rebalance(self.assignment, rebalance.size_weight)
+        sizes = {ta.id: 0 for ta in self.tas}
+        for submission in self.assignment.submission_set.all():
+            sizes[submission.grader_id] += submission.file.size
+        # No single move would bring the heaviest and lightest TA closer
+        smallest = min(submission.file.size for submission in self.submissions)
+        self.assertLess(max(sizes.values()) - min(sizes.values()), 2 * smallest + 1000)
+
+    def test_dry_run(self):
+        moves = rebalance.rebalance(self.assignment, dry_run=True)
+        self.assertTrue(moves)
+        self.assertEqual(self.loads()[self.tas[0].id], 9)
+
+    def test_admin_action(self):
+        admin = models.User.objects.create_superuser('admin')
+        self.client.force_login(admin)
+        response = self.client.post('/admin/grades/assignment/', {
+            'action': 'rebalance_graders', '_selected_action': [self.assignment.id]
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sorted(self.loads().values()), [3, 3, 3])
+
+class AsyncUrls:
+    """The course pages as graderific/urls.py routes them with GRADES_ASYNC_VIEWS set."""
+    urlpatterns = [
+        path('<slug:course>/', include([
+            path('', async_views.index, name='index'),
+            path('profile/', async_views.profile, name='profile'),
+            path('<int:assignment_id>/', async_views.assignment, name='assignment'),
+            path('api/<int:assignment_id>/submission/', api.upload, name='api_upload'),
+        ])),
+    ]
+
+@override_settings(ROOT_URLCONF=AsyncUrls, GRADES_FRAGMENT_CACHE_TIMEOUT=60)
+class AsyncViewTests(ScratchMixin, TestCase):
+    """The async pages end to end through ASGI, with fragments cached."""
+
+    def setUp(self):
+        super().setUp()
+        self.course, self.students, self.tas = make_course()
+        self.assignment = make_assignment(self.course, title="Async homework")
+        self.client = AsyncClient()
+        self.rendered = 0
+
+        def render_off_the_loop(*args, **kwargs):
+            # Templates render in a worker thread, not on the event loop
+            with self.assertRaises(RuntimeError):
+                asyncio.get_running_loop()
+            self.rendered += 1
+            return render(*args, **kwargs)
+
+        self.enterContext(mock.patch.object(async_views, 'render', render_off_the_loop))
+
+    async def test_student_pages(self):
+        await self.client.aforce_login(self.students[0])
+        for url in ('', 'profile/', f'{self.assignment.id}/'):
+            # Twice: rendering the fragments, then reading them back
+            for _ in range(2):
+                response = await self.client.get(f'/{self.course.slug}/{url}')
+                self.assertEqual(response.status_code, 200, url)
+                self.assertContains(response, "Async homework")
+        self.assertEqual(self.rendered, 4)
+
+    async def test_ta_pages(self):
+        await self.client.aforce_login(self.tas[0])
+        response = await self.client.get(f'/{self.course.slug}/{self.assignment.id}/')
+        self.assertContains(response, "0 submissions assigned to you")
+        response = await self.client.get(f'/{self.course.slug}/profile/')
+        self.assertEqual(response.status_code, 200)
+
+class GradeImportTests(ScratchMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.course, self.students, self.tas = make_course(students=4)
+        self.assignment = make_assignment(self.course, days=-1)
+        self.other = make_assignment(self.course, title="Other")
+        with courses.activate(self.course):
+            self.submissions = [submit(self.assignment, student, b'%PDF-1.4 work') for student in self.students]
+            self.stray = submit(self.other, self.students[0], b'%PDF-1.4 other')
+        self.admin = models.User.objects.create_superuser('admin')
+
+    def post(self, user, body, content_type='text/csv'):
+        self.client.force_login(user)
+        return self.client.post(
+            f'/{self.course.slug}/{self.assignment.id}/submissions/import/', body, content_type=content_type
+        )
+
+    def csv(self, rows):
+        return 'submission_id,score\n' + ''.join(f'{submission.id},{value}\n' for submission, value in rows)
+
+    def scores(self):
+        with courses.activate(self.course):
+            return list(self.assignment.submission_set.order_by('id').values_list('score', flat=True))
+
+    def test_admin_imports_and_everything_follows(self):
+        response = self.post(self.admin, self.csv([(self.submissions[0], 10), (self.submissions[1], 5)]))
+        self.assertEqual(response.json(), {'updated': 2, 'errors': {}, 'general_errors': []})
+        self.assertEqual(self.scores(), [10, 5, None, None])
+        with courses.activate(self.course):
+            self.assertEqual(models.AssignmentCounter.objects.get(assignment=self.assignment).graded, 2)
+            kept = counters.snapshot(self.course)
+            counters.rebuild(self.course)
+            self.assertEqual(kept, counters.snapshot(self.course))
+            for student in self.students:
+                stored = models.StudentGrade.objects.get(course=self.course, student=student)
+                self.assertEqual(stored.as_dict(), views.compute_grade(student, self.course))
+
+    def test_unchanged_rows_are_skipped(self):
+        self.post(self.admin, self.csv([(self.submissions[0], 10)]))
+        response = self.post(self.admin, self.csv([(self.submissions[0], 10), (self.submissions[1], 4)]))
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertEqual(self.scores(), [10, 4, None, None])
+
+    def test_unreadable_file_changes_nothing(self):
+        body = f'{{"submission_id": {self.submissions[0].id}, "score": 10}}\n{{"submission_id": \n'
+        # One row per batch, so the first row is saved before the error
+        with mock.patch.object(grade_import, 'BATCH_SIZE', 1):
+            response = self.post(self.admin, body, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.scores(), [None] * 4)
+
+    def test_rows_from_another_assignment(self):
+        response = self.post(self.admin, self.csv([(self.stray, 10), (self.submissions[0], 3)]))
+        self.assertEqual(response.json()['general_errors'], [
+            f"Submission {self.stray.id} does not belong to this assignment"
+        ])
+        self.assertEqual(self.scores(), [3, None, None, None])
+        self.stray.refresh_from_db()
+        self.assertIsNone(self.stray.score)
+
+    def test_tas_grade_only_their_submissions(self):
+        ta = self.tas[0]
+        mine = [submission for submission in self.submissions if submission.grader_id == ta.id]
+        theirs = [submission for submission in self.submissions if submission.grader_id != ta.id]
+        response = self.post(ta, self.csv([(submission, 1) for submission in self.submissions]))
+        self.assertEqual(response.json()['updated'], len(mine))
+        self.assertEqual(response.json()['general_errors'], [
+            f"You are not authorized to grade submission {submission.id}" for submission in theirs
+        ])
+        self.assertEqual(self.scores(), [1 if submission in mine else None for submission in self.submissions])
+
+    def test_students_cannot_import(self):
+        response = self.post(self.students[0], self.csv([(self.submissions[0], 10)]))
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.scores(), [None] * 4)
+
+class ExportTests(ScratchMixin, TestCase):
+    """The streamed export against CourseGradebook, cell by cell."""
+
+    def setUp(self):
+        super().setUp()
+        self.course, self.students, self.tas = make_course(students=4)
+        self.assignments = [
+            make_assignment(self.course, days=-2, title="First", weight=2, points=7),
+            make_assignment(self.course, days=-1, title="Second", weight=1, points=3),
+            make_assignment(self.course, days=3, title="Third", weight=4, points=10),
+        ]
+        with courses.activate(self.course):
+            score(submit(self.assignments[0], self.students[0], b'%PDF-1.4 a'), '6.5')
+            submit(self.assignments[0], self.students[1], b'%PDF-1.4 b')
+            score(submit(self.assignments[1], self.students[1], b'%PDF-1.4 c'), '1.25')
+            submit(self.assignments[2], self.students[2], b'%PDF-1.4 d')
+            score(submit(self.assignments[2], self.students[3], b'%PDF-1.4 e'), 9)
+            # A second, later submission doesn't count
+            submit(self.assignments[0], self.students[0], b'%PDF-1.4 f')
+        self.client.force_login(models.User.objects.create_superuser('admin'))
+
+    def expected(self):
+        """Per username: [(score, status), ...] in deadline order, and the grade."""
+        with courses.activate(self.course):
+            book = gradebook.CourseGradebook(self.course)
+        grades = book.grades()
+        column = {assignment_id: j for j, (assignment_id, *_) in enumerate(book.assignments)}
+        expected = {}
+        for i, (user_id, username) in enumerate(book.students):
+            cells = []
+            for assignment in self.assignments:
+                j = column[assignment.id]
+                value, submitted, past_due = book.scores[j][i], book.submitted[j][i], book.past_due[j]
+                if value is not None:
+                    status = "Graded"
+                elif submitted:
+                    status = "Ungraded" if past_due else "Submitted"
+                else:
+                    status = "Missing" if past_due else "Not Due"
+                cells.append((value, status))
+            expected[username] = (cells, grades[user_id])
+        return expected
+
+    def export(self, format):
+        response = self.client.get(f'/{self.course.slug}/export/', {'format': format})
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        lines = list(csv.reader(io.StringIO(self.export('csv'))))
+        titles = [assignment.title for assignment in self.assignments]
+        self.assertEqual(lines[0], [
+            'username', 'name', *(column for title in titles for column in (title, f"{title} status")),
+            'percentage', 'earned_points', 'available_points'
+        ])
+        expected = self.expected()
+        self.assertEqual(len(lines) - 1, len(expected))
+        for line in lines[1:]:
+            cells, grade = expected[line[0]]
+            self.assertEqual(line[2:-3], [
+                str(column) for value, status in cells for column in ('' if value is None else value, status)
+            ])
+            self.assertEqual(line[-3:], [
+                str(grade['percentage']), str(grade['earned_points']), str(grade['available_points'])
+            ])
+
+    def test_jsonl(self):
+        rows = [json.loads(line) for line in self.export('jsonl').splitlines()]
+        expected = self.expected()
+        self.assertEqual(len(rows), len(expected))
+        for row in rows:
+            cells, grade = expected[row['username']]
+            self.assertEqual(
+                [(assignment['title'], assignment['score'], assignment['status']) for assignment in row['assignments']],
+                [
+                    (assignment.title, None if value is None else str(value), status)
+                    for assignment, (value, status) in zip(self.assignments, cells)
+                ]
+            )
+            grade = json.loads(json.dumps(grade, cls=DjangoJSONEncoder))
+            self.assertEqual(
+                (row['percentage'], row['earned_points'], row['available_points']),
+                (grade['percentage'], grade['earned_points'], grade['available_points'])
+            )
+        statuses = {assignment['status'] for row in rows for assignment in row['assignments']}
+        self.assertEqual(statuses, {"Graded", "Ungraded", "Missing", "Submitted", "Not Due"})
+
+@override_settings(GRADES_ROLE_CACHE_TIMEOUT=60)
+class RoleTests(ScratchMixin, TestCase):
+    """Role checks with the group ids cached across requests."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.course, self.students, self.tas = make_course(students=2, tas=2)
+
+    def fresh(self, user):
+        # As the next request would load it
+        return models.User.objects.get(pk=user.pk)
+
+    def test_cached_across_requests(self):
+        user = self.fresh(self.students[0])
+        with self.assertNumQueries(1):
+            self.assertTrue(roles.is_student(user, self.course))
+        user = self.fresh(self.students[0])
+        with self.assertNumQueries(0):
+            self.assertTrue(roles.is_student(user, self.course))
+            self.assertFalse(roles.is_ta(user, self.course))
+
+    def test_membership_changes_from_either_side(self):
+        student = self.students[0]
+        roles.group_ids(self.fresh(student))
+        # user.groups.add(...)
+        student.groups.add(self.course.teaching_assistants)
+        self.assertTrue(roles.is_ta(self.fresh(student), self.course))
+        # group.user_set.remove(...)
+        self.course.teaching_assistants.user_set.remove(student)
+        self.assertFalse(roles.is_ta(self.fresh(student), self.course))
+        # group.user_set.clear()
+        self.course.students.user_set.clear()
+        self.assertFalse(roles.is_student(self.fresh(student), self.course))
+        # user.groups.clear() also forgets the user object's own copy
+        ta = self.fresh(self.tas[0])
+        self.assertTrue(roles.is_ta(ta, self.course))
+        ta.groups.clear()
+        self.assertFalse(roles.is_ta(ta, self.course))
+        self.assertFalse(roles.is_ta(self.fresh(ta), self.course))
+
+    def test_group_rename_and_delete(self):
+        roles.group_ids(self.fresh(self.students[0]))
+        group = models.Group.objects.create(name="Extra")
+        group.user_set.add(self.students[0])
+        roles.group_ids(self.fresh(self.students[0]))
+        group.name = "Renamed"
+        group.save()
+        # Every entry is dropped, so the next check reads the groups again
+        user = self.fresh(self.students[0])
+        with self.assertNumQueries(1):
+            self.assertIn(group.id, roles.group_ids(user))
+        group_id = group.id
+        group.delete()
+        self.assertNotIn(group_id, roles.group_ids(self.fresh(self.students[0])))
+
+    def test_users_without_an_id(self):
+        for user in (AnonymousUser(), models.User(username="unsaved")):
+            with self.assertNumQueries(0):
+                self.assertEqual(roles.group_ids(user), frozenset())
+                self.assertFalse(roles.is_student(user, self.course))
+
+    def test_gradable_by_matches_can_grade(self):
+        assignment = make_assignment(self.course)
+        with courses.activate(self.course):
+            for student in self.students:
+                submit(assignment, student, b'%PDF-1.4 work')
+            users = [
+                *self.tas, self.students[0], models.User.objects.create_superuser('admin'),
+                AnonymousUser(), models.User(username="unsaved"),
+            ]
+            for user in users:
+                annotated = assignment.submission_set.annotate(can=roles.gradable_by(user)).order_by('id')
+                self.assertEqual(
+                    [submission.can for submission in annotated],
+                    [roles.can_grade(user, submission) for submission in annotated],
+                    user
+                )
+            self.assertEqual(
+                sorted(sum(roles.can_grade(ta, s) for s in assignment.submission_set.all()) for ta in self.tas), [1, 1]
+            )
+
+@override_settings(GRADES_FRAGMENT_CACHE_TIMEOUT=60)
+class FragmentTests(ScratchMixin, TestCase):
+    """Cached fragments on the locmem cache, and what invalidates them."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.course, self.students, self.tas = make_course(students=2, tas=2)
+        self.assignment = make_assignment(self.course, days=-1)
+        self.enterContext(courses.activate(self.course))
+        self.renders = 0
+
+    def fragment(self, *scopes):
+        """The fragment's content: the number of the render that produced it."""
+        def render():
+            self.renders += 1
+            return f"render {self.renders}"
+        return fragments.cached('index', [self.course.id], list(scopes), render)
+
+    def assertBumps(self, scope, change):
+        before = self.fragment(scope)
+        self.assertEqual(self.fragment(scope), before)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertNotEqual(self.fragment(scope), before)
+
+    def test_assignment_save(self):
+        self.assertBumps(f'assignments:{self.course.id}', self.assignment.save)
+        self.assertBumps(f'assignment:{self.course.id}:{self.assignment.id}', self.assignment.save)
+
+    def test_submission_save(self):
+        submission = submit(self.assignment, self.students[0], b'%PDF-1.4 work')
+        for scope in (
+            f'student:{self.course.id}:{self.students[0].id}', f'grading:{self.course.id}',
+            f'scores:{self.course.id}:{self.assignment.id}',
+        ):
+            self.assertBumps(scope, submission.save)
+
+    def test_bulk_grade_save(self):
+        submission = submit(self.assignment, self.students[0], b'%PDF-1.4 work')
+        submission.score = Decimal(3)
+
+        def save():
+            grade_import.save_grades(self.course, [submission])
+        self.assertBumps(f'scores:{self.course.id}:{self.assignment.id}', save)
+        self.assertBumps(f'student:{self.course.id}:{self.students[0].id}', save)
+        # Other students' fragments stay
+        other = f'student:{self.course.id}:{self.students[1].id}'
+        before = self.fragment(other)
+        with self.captureOnCommitCallbacks(execute=True):
+            save()
+        self.assertEqual(self.fragment(other), before)
+
+    def test_rebalance(self):
+        for student in self.students:
+            submit(self.assignment, student, b'%PDF-1.4 work')
+        self.assignment.submission_set.update(grader=self.tas[0])
+        self.assertBumps(f'grading:{self.course.id}', lambda: rebalance.rebalance(self.assignment))
+
+    def test_expires_at_the_next_deadline(self):
+        upcoming = make_assignment(self.course, days=1)
+
+        def profile(content):
+            return fragments.cached(
+                'profile_student', [self.course.id], [], lambda: content, expires=fragments.next_deadline(self.course)
+            )
+        before = profile("before")
+        self.assertEqual(profile("again"), before)
+        # run_deadlines isn't running, so nothing bumps the versions
+        with mock.patch('django.utils.timezone.now', return_value=upcoming.deadline + datetime.timedelta(seconds=1)):
+            self.assertEqual(profile("after"), "after")
+
+    def test_profile_is_per_user(self):
+        score(submit(self.assignment, self.students[0], b'%PDF-1.4 work'), 8)
+        pages = {}
+        for user in (*self.students, *self.tas):
+            self.client.force_login(user)
+            # Twice, so the second is served from the cache
+            self.client.get(f'/{self.course.slug}/profile/')
+            pages[user] = self.client.get(f'/{self.course.slug}/profile/').content.decode()
+        self.assertIn("80.0%", pages[self.students[0]])
+        self.assertNotIn("80.0%", pages[self.students[1]])
+        self.assertIn("Missing", pages[self.students[1]])
+        self.assertNotIn("Missing", pages[self.students[0]])
+        self.assertNotIn("80.0%", pages[self.tas[1]])
+        self.assertTrue(fragments.stats()['profile_student'][0] >= 2)
+
+class MetricsTests(SimpleTestCase):
+    LABELS = [['view', '/'], ['method', 'GET'], ['status', '200']]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.enterContext(override_settings(GRADES_METRICS_DIR=self.directory))
+        # A PID that is certainly gone
+        process = subprocess.Popen(['true'])
+        process.wait()
+        self.dead = process.pid
+
+    def write(self, filename, responses):
+        with open(os.path.join(self.directory, filename), 'w') as f:
+            json.dump({'counters': [['grades_responses_total', self.LABELS, responses]], 'histograms': []}, f)
+
+    def total(self):
+        counters, histograms = metrics._merge()
+        return counters[('grades_responses_total', tuple(map(tuple, self.LABELS)))]
+
+    def test_exited_workers_are_folded(self):
+        live = os.getpid()
+        self.write(f'{self.dead}-1.json', 2)
+        # An earlier worker that had this process's PID
+        self.write(f'{live}-1.json', 3)
+        self.write(f'{live}-2.json', 5)
+        self.assertEqual(self.total(), 10)
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.directory) if name.endswith('.json')),
+            [f'{live}-2.json', metrics.EXITED_FILENAME]
+        )
+        # Folding again changes nothing, and later exits add to the total
+        self.assertEqual(self.total(), 10)
+        self.write(f'{self.dead}-2.json', 1)
+        self.assertEqual(self.total(), 11)
+        self.assertEqual(len([name for name in os.listdir(self.directory) if name.endswith('.json')]), 2)
+
+class ProfilingTests(ScratchMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.enterContext(override_settings(GRADES_PROFILE_DIR=directory))
+        self.course, self.students, self.tas = make_course()
+        self.client.force_login(models.User.objects.create_superuser('profiler-admin'))
+
+    def profile(self):
+        response = self.client.get(f'/{self.course.slug}/profile/', {'profile': '1'})
+        details = profiling.load(response['X-Profile-Id'])
+        return [statement['params'] for statement in details['sql']]
+
+    def test_params_are_left_out(self):
+        params = self.profile()
+        self.assertIn('int', params)
+        self.assertFalse(any('profiler-admin' in p or self.course.slug in p for p in params))
+
+    def test_params_when_asked(self):
+        with override_settings(GRADES_PROFILE_SQL_PARAMS=True):
+            params = self.profile()
+        self.assertTrue(any(self.course.slug in p for p in params))
+
+class MoveCourseTests(ScratchMixin, TransactionTestCase):
+    """move_course between the test database and a scratch one added as a shard."""
+    ALIAS = 'move_course_test'
+
+    @classmethod
+    def setUpClass(cls):
+        # Added after the test runner made its test databases and before the
+        # test case checks its own, which get flushed after each test
+        directory = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, directory, ignore_errors=True)
+        connections.settings[cls.ALIAS] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory, 'db.sqlite3')}
+        })[DEFAULT_DB_ALIAS]
+        cls.addClassCleanup(cls.disconnect)
+        call_command('migrate', database=cls.ALIAS, verbosity=0)
+        cls.databases = {DEFAULT_DB_ALIAS, cls.ALIAS}
+        super().setUpClass()
+
+    @classmethod
+    def disconnect(cls):
+        connections[cls.ALIAS].close()
+        del connections[cls.ALIAS]
+        del connections.settings[cls.ALIAS]
+
+    def setUp(self):
+        super().setUp()
+        self.course, self.students, self.tas = make_course()
+        self.assignment = make_assignment(self.course, days=-1)
+        with courses.activate(self.course):
+            self.submissions = [score(submit(self.assignment, student, pdf(student.username)), 8)
+                                for student in self.students]
+
+    def move(self, *args, **options):
+        stdout = io.StringIO()
+        call_command('move_course', self.course.slug, self.ALIAS, *args, grace=0, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def rows(self, database):
+        return (
+            models.Assignment.objects.using(database).filter(course=self.course).count(),
+            models.Submission.objects.using(database).filter(assignment__course=self.course).count(),
+        )
+
+    def test_move(self):
+        self.move()
+        course = models.Course.objects.get(pk=self.course.pk)
+        self.assertEqual(course.database, self.ALIAS)
+        self.assertFalse(course.moving)
+        self.assertEqual(self.rows(DEFAULT_DB_ALIAS), (0, 0))
+        self.assertEqual(self.rows(self.ALIAS), (1, 3))
+        with courses.activate(course):
+            # Same ids, so links to them still work
+            self.assertEqual(
+                set(models.Submission.objects.values_list('id', flat=True)), {s.id for s in self.submissions}
+            )
+            counter = models.AssignmentCounter.objects.get(assignment=self.assignment)
+            self.assertEqual((counter.submissions, counter.graded), (3, 3))
+            # Stored again in the new database
+            self.assertEqual(models.StudentGrade.objects.using(self.ALIAS).filter(course=course).count(), 3)
+            for student in self.students:
+                self.assertEqual(student_grades.get_grade(student, course), views.compute_grade(student, course))
+                self.assertEqual(student_grades.get_grade(student, course)['earned_points'], Decimal('0.8'))
+
+    def make_conflict(self):
+        """A course already in the scratch database, whose assignment has the id of the one to move."""
+        other = courses.create('cs5550', "CS5550", database=self.ALIAS)
+        courses.sync_members(other)
+        make_assignment(other, id=self.assignment.id)
+        return other
+
+    def test_conflicting_ids_fail_the_move(self):
+        self.make_conflict()
+        with self.assertRaisesMessage(CommandError, "--renumber"):
+            self.move()
+        course = models.Course.objects.get(pk=self.course.pk)
+        self.assertEqual(course.database, DEFAULT_DB_ALIAS)
+        self.assertFalse(course.moving)
+        self.assertEqual(self.rows(DEFAULT_DB_ALIAS), (1, 3))
+        self.assertEqual(self.rows(self.ALIAS), (0, 0))
+
+    def test_renumber_lists_the_new_ids(self):
+        self.make_conflict()
+        output = self.move(renumber=True)
+        with courses.activate(models.Course.objects.get(pk=self.course.pk)):
+            moved = models.Assignment.objects.get(course=self.course)
+        self.assertNotEqual(moved.id, self.assignment.id)
+        self.assertIn(f"assignment {self.assignment.id} is now {moved.id}", output)
+        self.assertEqual(self.rows(self.ALIAS), (1, 3))
+
+class CourseTests(TestCase):
+    def test_create_validates_the_slug(self):
+        for slug in ('not a slug', 'admin', 'cs3550'):
+            if slug == 'cs3550':
+                courses.create(slug, "CS3550")
+            with self.subTest(slug=slug), self.assertRaises(ValidationError):
+                courses.create(slug, "Again")
+        # Nothing half made is left behind
+        self.assertFalse(models.Course.objects.filter(title="Again").exists())
+        self.assertFalse(Group.objects.filter(name__startswith="Again").exists())
+
+class ReplicaTests(ScratchMixin, TransactionTestCase):
+    """
+    ReplicaMiddleware and CourseRouter with a replica of the default
+    database, which mirrors the test database like one from GRADES_REPLICAS
+    would. Not a TestCase: reads inside its transaction go to the primary.
+    """
+    ALIAS = f'{DEFAULT_DB_ALIAS}_replica1'
+
+    @classmethod
+    def setUpClass(cls):
+        connections.settings[cls.ALIAS] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {**connections[DEFAULT_DB_ALIAS].settings_dict, 'TEST': {'MIRROR': DEFAULT_DB_ALIAS}}
+        })[DEFAULT_DB_ALIAS]
+        cls.addClassCleanup(cls.disconnect)
+        cls.databases = {DEFAULT_DB_ALIAS, cls.ALIAS}
+        super().setUpClass()
+
+    @classmethod
+    def disconnect(cls):
+        connections[cls.ALIAS].close()
+        del connections[cls.ALIAS]
+        del connections.settings[cls.ALIAS]
+
+    def setUp(self):
+        super().setUp()
+        settings = override_settings(
+            GRADES_READ_REPLICAS={DEFAULT_DB_ALIAS: [self.ALIAS]}, GRADES_REPLICA_STICKY_SECONDS=10
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.course, self.students, self.tas = make_course()
+        self.assignment = make_assignment(self.course)
+        self.session = SessionStore()
+        self.session.create()
+
+    def request(self, method, user=None, view=None):
+        """
+        Sends a request through ReplicaMiddleware in this test's session.
+        Returns where the router sent the reads and writes made while it ran.
+        """
+        seen = {}
+
+        def get_response(request):
+            # As in a course's pages
+            with courses.activate(self.course):
+                seen.update(
+                    assignments=router.db_for_read(models.Assignment),
+                    sessions=router.db_for_read(Session),
+                    writes=router.db_for_write(models.Assignment),
+                )
+                if view:
+                    view(request)
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method.lower())('/')
+        request.session = SessionStore(self.session.session_key)
+        request.user = user or self.students[0]
+        replicas.ReplicaMiddleware(get_response)(request)
+        request.session.save()
+        return seen
+
+    def test_gets_read_the_replica(self):
+        self.assertEqual(self.request('GET'), {
+            'assignments': self.ALIAS, 'sessions': DEFAULT_DB_ALIAS, 'writes': DEFAULT_DB_ALIAS
+        })
+
+    def test_other_requests_read_the_primary(self):
+        for method in ('POST', 'PUT', 'DELETE'):
+            with self.subTest(method=method):
+                self.assertEqual(set(self.request(method).values()), {DEFAULT_DB_ALIAS})
+
+    def test_reads_after_a_post_stick_to_the_primary(self):
+        now = time.time()
+        with mock.patch('time.time', return_value=now):
+            self.request('POST')
+            self.assertEqual(self.request('GET')['assignments'], DEFAULT_DB_ALIAS)
+        with mock.patch('time.time', return_value=now + 9):
+            self.assertEqual(self.request('GET')['assignments'], DEFAULT_DB_ALIAS)
+        with mock.patch('time.time', return_value=now + 10):
+            self.assertEqual(self.request('GET')['assignments'], self.ALIAS)
+
+    def test_anonymous_posts_dont_stick(self):
+        # A failed login, say, wrote nothing the next page has to show
+        self.request('POST', user=AnonymousUser())
+        self.assertEqual(self.request('GET')['assignments'], self.ALIAS)
+
+    def test_sessions_read_the_primary(self):
+        # They hold the sticky window, which a lagging replica would lose
+        def view(request):
+            session = Session.objects.get(session_key=self.session.session_key)
+            self.assertEqual(session._state.db, DEFAULT_DB_ALIAS)
+
+        self.assertEqual(self.request('GET', view=view)['sessions'], DEFAULT_DB_ALIAS)
+
+    def test_writes_go_to_the_primary(self):
+        def view(request):
+            assignment = models.Assignment.objects.get(pk=self.assignment.pk)
+            self.assertEqual(assignment._state.db, self.ALIAS)
+            # Its related rows come from the same replica
+            self.assertEqual(assignment.submission_set.all().db, self.ALIAS)
+            assignment.title = "Renamed"
+            # Saved to the primary of the replica it was read from
+            assignment.save()
+            self.assertEqual(assignment._state.db, DEFAULT_DB_ALIAS)
+
+        self.assertEqual(self.request('GET', view=view)['writes'], DEFAULT_DB_ALIAS)
+        self.assertEqual(models.Assignment.objects.using(DEFAULT_DB_ALIAS).get(pk=self.assignment.pk).title, "Renamed")
+
+    def test_transactions_read_the_primary(self):
+        def view(request):
+            with courses.atomic():
+                self.assertEqual(models.Assignment.objects.get(pk=self.assignment.pk)._state.db, DEFAULT_DB_ALIAS)
+
+        self.request('GET', view=view)
+
+class SqliteBackendTests(SimpleTestCase):
+    """grades.sqlite, the backend GRADES_SQLITE_PRODUCTION switches to, on a scratch file."""
+    ALIAS = 'sqlite_backend_test'
+    THREADS = 8
+    ROUNDS = 25
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        # The rest of a DATABASES entry, filled in with the defaults
+        self.settings_dict = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {'ENGINE': 'grades.sqlite', 'NAME': os.path.join(directory, 'db.sqlite3')}
+        })[DEFAULT_DB_ALIAS]
+        self.connect()
+        self.addCleanup(self.disconnect)
+        with connections[self.ALIAS].cursor() as cursor:
+            cursor.execute('CREATE TABLE tally (n integer)')
+            cursor.execute('INSERT INTO tally VALUES (0)')
+
+    def connect(self):
+        """Opens this thread's connection to the scratch database, which isn't in DATABASES."""
+        connections[self.ALIAS] = sqlite.DatabaseWrapper(self.settings_dict, self.ALIAS)
+
+    def disconnect(self):
+        connections[self.ALIAS].close()
+        del connections[self.ALIAS]
+
+    def test_wal_journal(self):
+        with connections[self.ALIAS].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+    def test_transactions_that_read_then_write_take_turns(self):
+        # Deferred transactions that read first fail with "database is
+        # locked" when another one wrote in between, like a deadline rush's
+        # uploads and grade saves did
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def worker():
+            self.connect()
+            start.wait()
+            try:
+                for _ in range(self.ROUNDS):
+                    with transaction.atomic(using=self.ALIAS), connections[self.ALIAS].cursor() as cursor:
+                        cursor.execute('SELECT n FROM tally')
+                        cursor.execute('UPDATE tally SET n = %s', [cursor.fetchone()[0] + 1])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                self.disconnect()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with connections[self.ALIAS].cursor() as cursor:
+            cursor.execute('SELECT n FROM tally')
+            # No update was lost
+            self.assertEqual(cursor.fetchone()[0], self.THREADS * self.ROUNDS)
+
+class CounterTests(ScratchMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.course, self.students, self.tas = make_course()
+        self.assignment = make_assignment(self.course)
+        self.activated = courses.activate(self.course)
+        self.activated.__enter__()
+        self.addCleanup(self.activated.__exit__, None, None, None)
+
+    def assertMatchesRebuild(self):
+        kept = counters.snapshot(self.course)
+        counters.rebuild(self.course)
+        self.assertEqual(kept, counters.snapshot(self.course))
+
+    def test_submissions_and_grades_are_counted(self):
+        first = submit(self.assignment, self.students[0], b'%PDF-1.4 first')
+        second = submit(self.assignment, self.students[1], b'%PDF-1.4 second')
+        first.score = 7
+        first.save()
+
+        counter = models.AssignmentCounter.objects.get(assignment=self.assignment)
+        self.assertEqual((counter.submissions, counter.graded), (2, 1))
+        loads = {
+            load.grader_id: (load.assigned, load.graded)
+            for load in models.GraderLoad.objects.filter(assignment=self.assignment)
+        }
+        self.assertEqual(loads[first.grader_id][0] + loads[second.grader_id][0], 2)
+        self.assertEqual(sum(graded for _, graded in loads.values()), 1)
+        self.assertMatchesRebuild()
+
+    def test_regrades_reassignments_and_deletes_are_counted(self):
+        first = submit(self.assignment, self.students[0], b'%PDF-1.4 first')
+        second = submit(self.assignment, self.students[1], b'%PDF-1.4 second')
+        first.score = 7
+        first.save()
+        first.score = None
+        first.save()
+        second.score = 3
+        second.grader = next(ta for ta in self.tas if ta.id != second.grader_id)
+        second.save()
+        first.delete()
+
+        counter = models.AssignmentCounter.objects.get(assignment=self.assignment)
+        self.assertEqual((counter.submissions, counter.graded), (1, 1))
+        self.assertMatchesRebuild()
+
+    def test_group_sizes(self):
+        self.course.students.user_set.remove(self.students[0])
+        self.assertEqual(models.GroupSize.objects.get(group=self.course.students).size, len(self.students) - 1)
+        self.assertEqual(models.GroupSize.objects.get(group=self.course.teaching_assistants).size, len(self.tas))
+
+class StorageTests(ScratchMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.course, self.students, _ = make_course()
+        self.assignment = make_assignment(self.course)
+        self.activated = courses.activate(self.course)
+        self.activated.__enter__()
+        self.addCleanup(self.activated.__exit__, None, None, None)
+
+    def refcount(self, name):
+        return models.StoredFile.objects.get(name=name).refcount
+
+    def test_identical_uploads_share_a_file(self):
+        first = submit(self.assignment, self.students[0], b'%PDF-1.4 same')
+        second = submit(self.assignment, self.students[1], b'%PDF-1.4 same', name='other.PDF')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertTrue(first.file.name.startswith('submissions/'))
+        self.assertTrue(first.file.name.endswith('.pdf'))
+        self.assertNotEqual(first.served_name, second.served_name)
+        self.assertEqual(self.refcount(first.file.name), 2)
+
+        first.delete()
+        self.assertEqual(self.refcount(second.file.name), 1)
+
+    def test_resubmission_moves_the_reference(self):
+        submission = submit(self.assignment, self.students[0], b'%PDF-1.4 draft')
+        draft = submission.file.name
+        submission.file = ContentFile(b'%PDF-1.4 final', name='hw.pdf')
+        submission.save()
+        self.assertEqual(self.refcount(draft), 0)
+        self.assertEqual(self.refcount(submission.file.name), 1)
+
+    def test_garbage_collection_keeps_referenced_files(self):
+        kept = submit(self.assignment, self.students[0], b'%PDF-1.4 kept')
+        dropped = submit(self.assignment, self.students[1], b'%PDF-1.4 dropped')
+        name = dropped.file.name
+        dropped.delete()
+
+        files = storage.submission_storage()
+        self.assertEqual(storage.collect_garbage(files, min_age=0), [name])
+        self.assertFalse(files.exists(name))
+        self.assertTrue(files.exists(kept.file.name))
+        self.assertFalse(models.StoredFile.objects.filter(name=name).exists())
+
+class ServingTests(ScratchMixin, TestCase):
+    DATA = b'%PDF-1.4 0123456789'
+
+    def setUp(self):
+        super().setUp()
+        course, students, _ = make_course()
+        assignment = make_assignment(course)
+        with courses.activate(course):
+            self.file = submit(assignment, students[0], self.DATA).file
+        self.factory = RequestFactory()
+
+    def serve(self, **headers):
+        response = serving.serve_file(self.factory.get('/', headers=headers), self.file, 'hw.pdf', 'application/pdf')
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_whole_file(self):
+        response, body = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(body, self.DATA)
+
+    def test_range(self):
+        response, body = self.serve(Range='bytes=9-12')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 9-12/{len(self.DATA)}')
+        self.assertEqual(response['Content-Length'], '4')
+        self.assertEqual(body, self.DATA[9:13])
+
+    def test_open_and_suffix_ranges(self):
+        self.assertEqual(self.serve(Range='bytes=15-')[1], self.DATA[15:])
+        self.assertEqual(self.serve(Range='bytes=-3')[1], self.DATA[-3:])
+        # Past the end is cut to the file
+        self.assertEqual(self.serve(Range='bytes=15-1000')[1], self.DATA[15:])
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.serve(Range=f'bytes={len(self.DATA)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.DATA)}')
+
+    def test_ignored_ranges(self):
+        # Several ranges, or an If-Range for another version of the file
+        for headers in ({'Range': 'bytes=0-1,4-5'}, {'Range': 'bytes=0-1', 'If-Range': '"stale"'}):
+            response, body = self.serve(**headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(body, self.DATA)
+
+    def test_not_modified(self):
+        response, _ = self.serve()
+        self.assertEqual(self.serve(**{'If-None-Match': response['ETag']})[0].status_code, 304)
+        self.assertEqual(self.serve(Range='bytes=0-3', **{'If-Range': response['ETag']})[0].status_code, 206)
+
+class UploadTests(ScratchMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.course, students, _ = make_course()
+        self.assignment = make_assignment(self.course)
+        self.student = students[0]
+        self.client.force_login(self.student)
+
+    def upload(self, data, name='hw.pdf'):
+        return self.client.post(
+            f'/{self.course.slug}/api/{self.assignment.id}/submission/',
+            {uploads.FIELD_NAME: SimpleUploadedFile(name, data, content_type='application/pdf')}
+        )
+
+    def submission(self):
+        with courses.activate(self.course):
+            return self.assignment.submission_set.filter(author=self.student).first()
+
+    def assertRejected(self, response, message):
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][uploads.FIELD_NAME], [message])
+        self.assertIsNone(self.submission())
+
+    def test_pdf_is_stored_with_its_digest(self):
+        response = self.upload(b'%PDF-1.4 homework')
+        self.assertEqual(response.status_code, 200)
+        submission = self.submission()
+        self.assertEqual(len(submission.sha256), 64)
+        self.assertIn(submission.sha256, submission.file.name)
+        with submission.file.open('rb') as file:
+            self.assertEqual(file.read(), b'%PDF-1.4 homework')
+
+    def test_wrong_extension(self):
+        self.assertRejected(self.upload(b'%PDF-1.4 homework', name='hw.docx'), "Only PDF files are accepted.")
+
+    def test_not_a_pdf(self):
+        self.assertRejected(self.upload(b'PK\x03\x04 a zip file'), "The file is not a valid PDF.")
+        self.assertRejected(self.upload(b'%PD'), "The file is not a valid PDF.")
+
+    def test_too_large(self):
+        with mock.patch.object(uploads, 'MAX_UPLOAD_SIZE', 16):
+            self.assertRejected(self.upload(b'%PDF-1.4 ' + b'x' * 64), "File is too large. Maximum size is 64 MiB.")
+
+    def test_exactly_the_limit(self):
+        # The request body, with its multipart headers, is over the limit; the file isn't
+        data = b'%PDF-1.4 ' + b'x' * 55
+        with mock.patch.object(uploads, 'MAX_UPLOAD_SIZE', len(data)):
+            self.assertEqual(self.upload(data).status_code, 200)
+        self.assertEqual(self.submission().file.size, len(data))
+
+class SubmissionPageTests(ScratchMixin, TestCase):
+    SIZE = 3
+
+    def setUp(self):
+        super().setUp()
+        course, students, _ = make_course(students=8)
+        self.assignment = make_assignment(course)
+        self.activated = courses.activate(course)
+        self.activated.__enter__()
+        self.addCleanup(self.activated.__exit__, None, None, None)
+        # Ties on the grade, and ungraded submissions
+        for student, score in zip(students, [5, None, 8, 5, None, 2, 5, 9]):
+            submission = submit(self.assignment, student, f'%PDF-1.4 {student.username}'.encode())
+            submission.score = score
+            submission.save()
+        self.submissions = self.assignment.submission_set.all()
+
+    def expected(self, sort, descending=False):
+        """The ids in the order of the sort, worked out in Python."""
+        if sort == 'student':
+            key = lambda submission: (submission.author.username, submission.id)
+        else:
+            key = lambda submission: (-1 if submission.score is None else submission.score, submission.id)
+        submissions = sorted(self.submissions.select_related('author'), key=key, reverse=descending)
+        return [submission.id for submission in submissions]
+
+    def walk(self, sort, descending=False):
+        """Every page forwards, then backwards from the last one, as lists of ids."""
+        pages = [submission_pages.page(self.submissions, sort, descending, size=self.SIZE)]
+        while pages[-1].has_next:
+            pages.append(submission_pages.page(
+                self.submissions, sort, descending, after=pages[-1].next_cursor, size=self.SIZE
+            ))
+        backwards = [pages[-1]]
+        while backwards[-1].has_previous:
+            backwards.append(submission_pages.page(
+                self.submissions, sort, descending, before=backwards[-1].previous_cursor, size=self.SIZE
+            ))
+        ids = lambda page: [submission.id for submission in page.submissions]
+        return [ids(page) for page in pages], [ids(page) for page in reversed(backwards)]
+
+    def test_pages_cover_every_submission_once(self):
+        for sort in submission_pages.SORTS:
+            for descending in (False, True):
+                with self.subTest(sort=sort, descending=descending):
+                    forwards, backwards = self.walk(sort, descending)
+                    self.assertEqual(sum(forwards, []), self.expected(sort, descending))
+                    self.assertEqual(backwards, forwards)
+                    self.assertTrue(all(len(page) == self.SIZE for page in forwards[:-1]))
+
+    def test_ungraded_sort_first(self):
+        first = submission_pages.page(self.submissions, 'grade', size=self.SIZE)
+        self.assertEqual([submission.score for submission in first.submissions][:2], [None, None])
+        self.assertFalse(first.has_previous)
+
+    def test_missing_cursor_starts_over(self):
+        start = submission_pages.page(self.submissions, size=self.SIZE)
+        again = submission_pages.page(self.submissions, after=0, size=self.SIZE)
+        self.assertEqual(again.submissions, start.submissions)
+        self.assertFalse(again.has_previous)
+
+class GradeStatsTests(ScratchMixin, TestCase):
+    def test_summarize(self):
+        stats = grade_stats.summarize([1.0, 2.0, 3.0, 4.0], 4)
+        self.assertEqual((stats['count'], stats['mean'], stats['median']), (4, 2.5, 2.5))
+        self.assertEqual((stats['min'], stats['max'], stats['std']), (1.0, 4.0, 1.12))
+        self.assertEqual(stats['percentiles'], {'10': 1.3, '25': 1.75, '75': 3.25, '90': 3.7})
+        self.assertEqual(sum(bin['count'] for bin in stats['histogram']), 4)
+        # The last bin takes full marks
+        self.assertEqual(stats['histogram'][-1], {'from': 3.6, 'to': 4.0, 'count': 1})
+
+    def test_summarize_nothing(self):
+        stats = grade_stats.summarize([], 10)
+        self.assertEqual(stats['count'], 0)
+        self.assertIsNone(stats['median'])
+        self.assertEqual(len(stats['histogram']), grade_stats.BINS)
+
+    def test_api(self):
+        course, students, tas = make_course(students=4)
+        assignment = make_assignment(course)
+        with courses.activate(course):
+            for student, score in zip(students, [2, 4, 6, None]):
+                submission = submit(assignment, student, f'%PDF-1.4 {student.username}'.encode())
+                submission.score = score
+                submission.save()
+        url = f'/{course.slug}/api/{assignment.id}/stats/'
+
+        self.client.force_login(tas[0])
+        stats = self.client.get(url).json()
+        self.assertEqual(stats['assignment']['count'], 3)
+        self.assertEqual(stats['assignment']['median'], 4.0)
+        self.assertEqual((stats['assignment']['submitted'], stats['assignment']['ungraded']), (4, 1))
+        # Not past due yet
+        self.assertIsNone(stats['assignment']['missing'])
+        self.assertEqual(stats['final_grades']['count'], len(students))
+
+        self.client.force_login(students[0])
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+class SimilarityTests(ScratchMixin, TestCase):
+    VOCABULARY = [f'w{i}' for i in range(3000)]
+
+    def setUp(self):
+        super().setUp()
+        self.rng = random.Random(0)
+
+    def text(self, words=600):
+        return [self.rng.choice(self.VOCABULARY) for _ in range(words)]
+
+    def edited(self, words, changes):
+        words = list(words)
+        for i in self.rng.sample(range(len(words)), changes):
+            words[i] = self.rng.choice(self.VOCABULARY)
+        return words
+
+    def signature(self, words):
+        return similarity.signature(similarity.shingles(pdf(' '.join(words))))
+
+    def test_pdf_text(self):
+        self.assertEqual(similarity.pdf_text(pdf("Hello world")), b'Hello world')
+        self.assertEqual(
+            similarity.pdf_text(b'stream\nBT (plain \\(escaped\\) \\101) Tj <48 69> Tj ET\nendstream'),
+            b'plain (escaped) A 48 69'
+        )
+
+    def test_compressed_streams_are_capped(self):
+        bomb = zlib.compress(b'BT (x) Tj ET ' * 1000000, 9)
+        data = b'%PDF-1.4\n' + b'stream\n' + bomb + b'\nendstream\n'
+        with mock.patch.object(similarity, 'MAX_INFLATED', 1000), mock.patch.object(similarity, 'MAX_TEXT', 10 ** 9):
+            self.assertLessEqual(len(similarity.pdf_text(data)), 1000)
+        with mock.patch.object(similarity, 'MAX_TEXT', 100):
+            self.assertEqual(len(similarity.pdf_text(data)), 100)
+
+    def test_estimates(self):
+        words = self.text()
+        original = self.signature(words)
+        estimate = lambda other: similarity.similarity(original, self.signature(other))
+        self.assertEqual(estimate(words), 1.0)
+        self.assertGreaterEqual(estimate(self.edited(words, 15)), similarity.THRESHOLD)
+        self.assertLess(estimate(self.text()), similarity.THRESHOLD)
+        self.assertIsNone(similarity.signature(set()))
+
+    def test_text_free_files_compare_bytes(self):
+        self.assertTrue(similarity.shingles(b'%PDF-1.4 scanned image bytes only'))
+
+    def test_similar_submissions(self):
+        course, students, _ = make_course(students=4)
+        assignment = make_assignment(course)
+        earlier = make_assignment(course, days=-7, title="Earlier homework")
+        words = self.text()
+        with courses.activate(course), self.captureOnCommitCallbacks(execute=True):
+            copied = submit(earlier, students[3], pdf(' '.join(words)))
+            original = submit(assignment, students[0], pdf(' '.join(words)))
+            shared = submit(assignment, students[1], pdf(' '.join(words)))
+            edited = submit(assignment, students[2], pdf(' '.join(self.edited(words, 15))))
+        # Fingerprinted once the uploads committed, one per distinct file
+        self.assertEqual(models.Fingerprint.objects.count(), 2)
+        self.assertEqual(models.FingerprintBand.objects.count(), 2 * similarity.BANDS)
+
+        with courses.activate(course):
+            rows = similarity.similar_submissions(assignment)
+        found = {
+            (frozenset(s.id for s in row['submissions']), frozenset(s.id for s in row['others'])): row['similarity']
+            for row in rows
+        }
+        # The same file, submitted twice here and once for another assignment
+        self.assertEqual(found[frozenset([original.id, shared.id]), frozenset([copied.id])], 1.0)
+        # The edited copy, against everyone with the original
+        score = found[frozenset([edited.id]), frozenset([copied.id, original.id, shared.id])]
+        self.assertTrue(similarity.THRESHOLD <= score < 1.0)
+        self.assertEqual(len(rows), 2)
+
+class BackgroundIndexTests(ScratchMixin, TransactionTestCase):
+    """Fingerprinting in the background thread, as outside the tests."""
+
+    def setUp(self):
+        super().setUp()
+        settings = override_settings(GRADES_INDEX_IN_REQUEST=False)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.course, self.students, _ = make_course()
+        self.assignment = make_assignment(self.course)
+
+    def test_uploads_dont_wait_for_their_fingerprint(self):
+        started, release = threading.Event(), threading.Event()
+        index = similarity.index
+
+        def slow_index(*args):
+            started.set()
+            release.wait(10)
+            return index(*args)
+
+        with mock.patch.object(similarity, 'index', side_effect=slow_index), courses.activate(self.course):
+            submission = submit(self.assignment, self.students[0], pdf("background"))
+            self.assertTrue(started.wait(10))
+            # Saved and committed while the file is still being fingerprinted
+            self.assertTrue(models.Submission.objects.filter(pk=submission.pk).exists())
+            self.assertFalse(models.Fingerprint.objects.exists())
+            release.set()
+            similarity.wait_for_index()
+        self.assertTrue(models.Fingerprint.objects.filter(name=submission.file.name).exists())
+
+    def test_a_failure_doesnt_stop_the_thread(self):
+        index = similarity.index
+        failures = iter([OSError("gone"), RuntimeError("broken")])
+
+        def failing_index(*args):
+            failure = next(failures, None)
+            if failure is not None:
+                raise failure
+            return index(*args)
+
+        with mock.patch.object(similarity, 'index', side_effect=failing_index), courses.activate(self.course), \
+                self.assertLogs('grades.similarity', 'ERROR'):
+            for number, student in enumerate(self.students):
+                submit(self.assignment, student, pdf(f"upload {number}"))
+            similarity.wait_for_index()
+        # The file after the failures still got its fingerprint
+        self.assertEqual(models.Fingerprint.objects.count(), 1)
+
+class DeadlineTests(ScratchMixin, TestCase):
+    """A deadline passing without run_deadlines: every reader goes by the clock."""
+
+    def test_readers_agree_without_the_worker(self):
+        course, students, tas = make_course(students=2)
+        assignment = make_assignment(course, days=1)
+        with courses.activate(course):
+            submit(assignment, students[0], b'%PDF-1.4 done')
+            self.assertEqual(student_grades.get_grade(students[1], course)['available_points'], 0)
+            stored = models.StudentGrade.objects.get(course=course, student=students[1])
+            self.assertEqual(stored.valid_until, assignment.deadline)
+
+        later = timezone.now() + datetime.timedelta(days=2)
+        with mock.patch('django.utils.timezone.now', return_value=later), courses.activate(course):
+            # The stored row has expired, and is computed again on read
+            grade = student_grades.get_grade(students[1], course)
+            self.assertEqual((grade['percentage'], grade['available_points']), (0, 1))
+            assignment.refresh_from_db()
+            self.assertEqual(gradebook.submission_status(assignment, None), "Missing")
+            statuses = {
+                row['username']: row['assignments'][0]['status'] for row in export.gradebook_rows(course)
+            }
+            self.assertEqual(statuses, {students[0].username: "Ungraded", students[1].username: "Missing"})
+            self.assertEqual(grade_stats.final_grade_stats(course)['max'], 0)
+            # Reads never close the assignment; that is run_deadlines' job
+            self.assertFalse(assignment.past_due)
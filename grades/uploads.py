@@ -0,0 +1,104 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from . import metrics
+
+MAX_UPLOAD_SIZE = 64 * 1024 * 1024  # 64 MiB
+# Room in a request body for the multipart headers and the form's other
+# fields, on top of the file itself
+MULTIPART_ALLOWANCE = 1024 * 1024
+PDF_MAGIC = b'%PDF-'
+FIELD_NAME = 'submission_file'
+
+class StagedUploadedFile(TemporaryUploadedFile):
+    """
+    A temporary upload kept in a staging directory inside MEDIA_ROOT, so
+    saving it to storage is a rename on the same filesystem, not a copy.
+    """
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        staging = os.path.join(settings.MEDIA_ROOT, '.staging')
+        os.makedirs(staging, exist_ok=True)
+        file = tempfile.NamedTemporaryFile(suffix='.upload.pdf', dir=staging)
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+
+class PdfUploadHandler(FileUploadHandler):
+    """
+    Upload handler for the `submission_file` field. Checks the extension,
+    the %PDF- magic bytes and the size cap while the upload is still
+    arriving, hashes it with SHA-256 in the same pass, and stages it for a
+    move into storage. A rejected upload stops being written out as soon as
+    it fails, and its reason is left in `request.upload_error`.
+    Other file fields are ignored.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.staged = None
+        self.size = 0
+
+    def reject(self, message):
+        metrics.count_upload(self.size)
+        self.request.upload_error = message
+        if self.staged is not None:
+            self.staged.close()
+            self.staged = None
+        raise SkipFile()
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        # Rejections count the bytes of this file, not an earlier one
+        self.size = 0
+        if field_name != FIELD_NAME:
+            raise SkipFile()
+        if not file_name.lower().endswith('.pdf'):
+            self.reject("Only PDF files are accepted.")
+        # The whole request is bigger than the file; receive_data_chunk
+        # holds the file itself to the limit exactly
+        if self.content_length is not None and self.content_length > MAX_UPLOAD_SIZE + MULTIPART_ALLOWANCE:
+            self.reject("File is too large. Maximum size is 64 MiB.")
+
+        self.digest = hashlib.sha256()
+        self.head = b''
+        self.staged = StagedUploadedFile(file_name, self.content_type, 0, self.charset, self.content_type_extra)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > MAX_UPLOAD_SIZE:
+            self.reject("File is too large. Maximum size is 64 MiB.")
+
+        # Check the magic bytes as soon as we have enough of them
+        if len(self.head) < len(PDF_MAGIC):
+            self.head += raw_data[:len(PDF_MAGIC) - len(self.head)]
+            if not PDF_MAGIC.startswith(self.head):
+                self.reject("The file is not a valid PDF.")
+
+        self.digest.update(raw_data)
+        self.staged.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.staged is None:
+            return None
+        metrics.count_upload(file_size)
+        if self.head != PDF_MAGIC:
+            # Too short to even hold the magic bytes
+            self.request.upload_error = "The file is not a valid PDF."
+            self.staged.close()
+            self.staged = None
+            return None
+
+        staged, self.staged = self.staged, None
+        staged.seek(0)
+        staged.size = file_size
+        staged.sha256 = self.digest.hexdigest()
+        return staged
+
+    def upload_interrupted(self):
+        if self.staged is not None:
+            self.staged.close()
+            self.staged = None
@@ -1,33 +1,26 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.db.models import Count, Sum, F, Case, When, DecimalField
-from django.db.models.functions import Coalesce
-from django.http import HttpResponse, Http404, HttpResponseBadRequest
-from django.utils import timezone
-from decimal import Decimal, InvalidOperation
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.http import FileResponse, HttpResponse, Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
 from django.utils.http import url_has_allowed_host_and_scheme
-from . import models
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_GET, require_POST
+from django.core.handlers.asgi import ASGIRequest
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from . import (
+    models, courses, gradebook, student_grades, counters, grader_assignment, grade_import, grade_stats,
+    export, fragments, metrics, profiling, roles, serving, similarity, submission_pages, uploads
+)
+from .courses import course_view
 
-# Helper functions for user roles
-def is_student(user):
-    return user.groups.filter(name="Students").exists()
-
-def is_ta(user):
-    return user.groups.filter(name="Teaching Assistants").exists()
-
-def pick_grader(assignment):
-    """Returns the TA with the fewest assigned submissions for this assignment."""
-    ta_group = models.Group.objects.get(name="Teaching Assistants")
-    
-    # Get all TAs, annotated with their submission count for this assignment
-    tas = ta_group.user_set.annotate(
-        total_assigned=Count('graded_set', filter=models.Q(graded_set__assignment=assignment))
-    ).order_by('total_assigned')
-    
-    # Return the TA with the fewest assignments
-    return tas.first()
+# Helper functions for user roles; the user's groups are loaded once
+# per request (see roles.py)
+is_student = roles.is_student
+is_ta = roles.is_ta
 
 def is_pdf(file):
     """Check if a file is a valid PDF by extension and header."""
@@ -44,138 +37,137 @@ def is_pdf(file):
     except:
         return False
 
-def compute_grade(user):
-    """Compute a student's current grade."""
-    assignments = models.Assignment.objects.all()
-    available_points = 0
-    earned_points = 0
-    
-    for assignment in assignments:
-        submission = assignment.submission_set.filter(author=user).first()
-        
-        # Assignment is past due date
-        if assignment.deadline < timezone.now():
-            available_points += assignment.weight
-            
-            # If student has a graded submission
-            if submission and submission.score is not None:
-                percentage = submission.score / assignment.points
-                earned_points += percentage * assignment.weight
-                
-        # Assignment isn't past due and isn't graded - ignore
-    
-    # Calculate percentage (prevent division by zero)
-    if available_points > 0:
-        grade_percentage = (earned_points / available_points) * 100
-    else:
-        grade_percentage = 100  # No assignments due yet
-        
-    return {
-        'percentage': round(grade_percentage, 1),
-        'available_points': available_points,
-        'earned_points': round(earned_points, 1)
-    }
+def compute_grade(user, course, assignments=None):
+    """Compute a student's current grade in the course."""
+    if assignments is None:
+        assignments = gradebook.student_gradebook(user, course)
+    return gradebook.grade_from_gradebook(assignments)
+
+def index_page(course):
+    """The course's assignment list, the same for every user, cached until an assignment changes."""
+    def render_page():
+        assignments = models.Assignment.objects.filter(course=course).order_by('deadline')
+        return render_to_string("index.html", {
+            'title': f'Assignments - {course.title}',
+            'course': course,
+            'assignments': assignments
+        })
+    return fragments.cached('index', [course.id], [f'assignments:{course.id}'], render_page)
 
 @login_required
-def index(request):
-    assignments = models.Assignment.objects.all().order_by('deadline')
-    return render(request, "index.html", {
-        'title': 'Assignments - CS 3550',
-        'assignments': assignments,
+def course_list(request):
+    """The courses the user is in, or straight to the course if there is only one."""
+    visible = list(courses.visible_courses(request.user))
+    if len(visible) == 1:
+        return redirect(f"/{visible[0].slug}/")
+    return render(request, "courses.html", {
+        'title': 'Courses - Graderific',
+        'courses': visible,
         'user': request.user
     })
 
 @login_required
-def assignment(request, assignment_id):
-    assignment = get_object_or_404(models.Assignment, id=assignment_id)
+@course_view
+def index(request, course):
+    return HttpResponse(index_page(course))
+
+def submission_status_message(assignment, user_submission, past_due):
+    """The status line a student sees on the assignment page."""
+    if user_submission:
+        if user_submission.score is not None and past_due:
+            # Graded submission
+            percentage = (user_submission.score / assignment.points) * 100
+            return f"Your submission, {user_submission.served_name}, received {user_submission.score}/{assignment.points} points ({percentage:.1f}%)"
+        elif past_due:
+            # Submitted but not graded, past due
+            return f"Your submission, {user_submission.served_name}, is being graded"
+        else:
+            # Submitted, not due
+            return f"Your current submission is {user_submission.served_name}"
+    elif past_due:
+        # Not submitted, past due
+        return "You did not submit this assignment and received 0 points"
+    else:
+        # Not submitted, not due
+        return "No current submission"
+
+def save_upload(assignment, user, user_submission, uploaded_file):
+    """Stores a student's upload, returning their submission."""
+    if user_submission:
+        # Update existing submission - keep the same grader
+        user_submission.file = uploaded_file
+        user_submission.save()
+        return user_submission
+    # Create new submission for the current user, assigned
+    # to the least-loaded TA
+    return grader_assignment.create_submission(assignment, user, uploaded_file)
+
+@login_required
+@course_view
+@csrf_exempt
+def assignment(request, course, assignment_id):
+    # Validate uploads while they stream in. The handler has to be in place
+    # before anything reads request.POST, so the CSRF check happens inside.
+    request.upload_handlers = [uploads.PdfUploadHandler(request)]
+    return _assignment(request, course, assignment_id)
+
+@csrf_protect
+def _assignment(request, course, assignment_id):
     user = request.user
+    # The assignment and all of its counters come back in a single query
+    assignment = get_object_or_404(
+        counters.with_counts(models.Assignment.objects.filter(course=course), user, course), id=assignment_id
+    )
     is_authenticated = user.is_authenticated
-    is_student_user = is_student(user) or not is_authenticated
-    is_ta_user = is_ta(user)
+    is_student_user = is_student(user, course) or not is_authenticated
+    is_ta_user = is_ta(user, course)
     is_admin = user.is_superuser
     
     # Count submissions based on user type
-    total_submissions = assignment.submission_set.count()
-    total_students = models.Group.objects.get(name="Students").user_set.count()
+    total_submissions = assignment.total_submissions
+    total_students = assignment.total_students
     
     if is_admin:
         # Admin sees all submissions
         your_submissions = total_submissions
     else:
         # TAs see their assigned submissions
-        your_submissions = assignment.submission_set.filter(grader=user).count()
+        your_submissions = assignment.your_submissions
     
     # Get the user's own submission if they're a student
     user_submission = None
     submission_status = "No current submission"
-    past_due = assignment.deadline < timezone.now()
+    past_due = gradebook.is_due(assignment.deadline)
     file_error = None
     
     if is_authenticated and is_student_user:
-        user_submission = assignment.submission_set.filter(author=user).first()
+        user_submission = gradebook.user_submission(assignment, user)
         
-        if user_submission:
-            if user_submission.score is not None and past_due:
-                # Graded submission
-                percentage = (user_submission.score / assignment.points) * 100
-                submission_status = f"Your submission, {user_submission.file.name.split('/')[-1]}, received {user_submission.score}/{assignment.points} points ({percentage:.1f}%)"
-            elif past_due:
-                # Submitted but not graded, past due
-                submission_status = f"Your submission, {user_submission.file.name.split('/')[-1]}, is being graded"
-            else:
-                # Submitted, not due
-                submission_status = f"Your current submission is {user_submission.file.name.split('/')[-1]}"
-        elif past_due:
-            # Not submitted, past due
-            submission_status = "You did not submit this assignment and received 0 points"
-        else:
-            # Not submitted, not due
-            submission_status = "No current submission"
+        submission_status = submission_status_message(assignment, user_submission, past_due)
     
     # Handle file upload
-    if request.method == "POST" and request.FILES and is_authenticated:
-        # Get the submitted file
+    if request.method == "POST" and is_authenticated:
+        # Get the submitted file. PdfUploadHandler has already checked its
+        # size, extension and header while it streamed in, and leaves the
+        # reason in request.upload_error when it rejects one.
         uploaded_file = request.FILES.get('submission_file')
+        upload_error = getattr(request, 'upload_error', None)
         
         # Check if deadline has passed
         #if past_due:
             #return HttpResponseBadRequest("Deadline has passed. Cannot submit.")
         
-        if uploaded_file and is_student_user:
-            # Check file size (64 MiB = 64 * 1024 * 1024 bytes)
-            max_size = 64 * 1024 * 1024
-            if uploaded_file.size > max_size:
-                file_error = "File is too large. Maximum size is 64 MiB."
-            # Check file extension
-            elif not uploaded_file.name.lower().endswith('.pdf'):
-                file_error = "Only PDF files are accepted."
-            # Check file content
-            elif not next(uploaded_file.chunks()).startswith(b'%PDF-'):
-                uploaded_file.seek(0)  # Reset file pointer
-                file_error = "The file is not a valid PDF."
-            else:
-                uploaded_file.seek(0)  # Reset file pointer
-                if user_submission:
-                    # Update existing submission - keep the same grader
-                    user_submission.file = uploaded_file
-                    user_submission.save()
-                else:
-                    # Create new submission for the current user
-                    grader = pick_grader(assignment)
-                    
-                    user_submission = models.Submission.objects.create(
-                        assignment=assignment,
-                        author=user,
-                        grader=grader,
-                        score=None,
-                        file=uploaded_file
-                    )
+        if upload_error and is_student_user:
+            file_error = upload_error
+        elif uploaded_file and is_student_user:
+            save_upload(assignment, user, user_submission, uploaded_file)
                 
-                # Redirect back to assignment page
-                return redirect(f"/{assignment_id}/")
+            # Redirect back to assignment page
+            return redirect(f"/{course.slug}/{assignment_id}/")
     
     context = {
-        'title': f'{assignment.title} - CS 3550',
+        'title': f'{assignment.title} - {course.title}',
+        'course': course,
         'assignment': assignment,
         'total_submissions': total_submissions,
         'your_submissions': your_submissions,
@@ -192,193 +184,311 @@ def assignment(request, assignment_id):
     return render(request, "assignment.html", context)
 
 @login_required
-def submissions(request, assignment_id):
+@course_view
+def submissions(request, course, assignment_id):
     user = request.user
     is_admin = user.is_superuser
     
     # Check if user is a TA or admin
-    if not (is_ta(user) or is_admin):
+    if not (is_ta(user, course) or is_admin):
         raise PermissionDenied("Only TAs can access the submissions page")
     
-    assignment = get_object_or_404(models.Assignment, id=assignment_id)
+    # With its counters, for the statistics
+    assignment = get_object_or_404(
+        counters.with_counts(models.Assignment.objects.filter(course=course), user, course), id=assignment_id
+    )
     
-    # Get submissions based on user type
-    if is_admin:
-        # Admin sees all submissions
-        submissions = assignment.submission_set.all().order_by('author__username')
-    else:
-        # TAs see only their assigned submissions
-        submissions = assignment.submission_set.filter(
-            grader=user
-        ).order_by('author__username')
+    # One page of submissions at a time, with their authors and graders in
+    # the same query (see submission_pages.py)
+    sort = request.GET.get('sort', 'student')
+    descending = request.GET.get('dir') == 'desc'
+    ungraded = bool(request.GET.get('ungraded'))
+    grader = request.GET.get('grader', '')
     
     errors = {}  # Dictionary to store errors for each submission
     general_errors = []  # List for errors with invalid submission IDs
     
     if request.method == "POST":
-        # Process submitted grades
-        submissions_to_update = []
-        
-        for key in request.POST:
-            # Skip any keys that don't start with 'grade-'
-            if not key.startswith('grade-'):
-                continue
-            
-            try:
-                # Extract the submission ID from the key
-                submission_id = int(key.removeprefix('grade-'))
-                
-                # Get the submission object and verify it belongs to this assignment
-                try:
-                    submission = models.Submission.objects.get(id=submission_id)
-                    
-                    # Check if submission belongs to this assignment
-                    if submission.assignment.id != assignment.id:
-                        general_errors.append(f"Submission {submission_id} does not belong to this assignment")
-                        continue
-                    
-                    # Get the score value
-                    score_value = request.POST[key].strip()
-                    
-                    if score_value == '':
-                        # Empty string means no grade
-                        try:
-                            submission.change_grade(user, None)
-                            submissions_to_update.append(submission)
-                        except PermissionDenied:
-                            general_errors.append(f"You are not authorized to grade submission {submission_id}")
-                    else:
-                        try:
-                            # Convert to Decimal
-                            score = Decimal(score_value)
-                            
-                            # Validate the score range
-                            if score < 0:
-                                if submission_id not in errors:
-                                    errors[submission_id] = []
-                                errors[submission_id].append("Grade cannot be negative")
-                                continue
-                                
-                            if score > assignment.points:
-                                if submission_id not in errors:
-                                    errors[submission_id] = []
-                                errors[submission_id].append(f"Grade cannot exceed {assignment.points} points")
-                                continue
-                            
-                            # Use the permission-checked method
-                            try:
-                                submission.change_grade(user, score)
-                                submissions_to_update.append(submission)
-                            except PermissionDenied:
-                                general_errors.append(f"You are not authorized to grade submission {submission_id}")
-                            
-                        except (InvalidOperation, ValueError):
-                            # Handle invalid decimal values
-                            if submission_id not in errors:
-                                errors[submission_id] = []
-                            errors[submission_id].append("Grade must be a valid number")
-                            continue
-                    
-                except models.Submission.DoesNotExist:
-                    general_errors.append(f"Submission ID {submission_id} does not exist")
-                    continue
-                    
-            except ValueError:
-                # Handle case where ID is not a valid integer
-                general_errors.append(f"Invalid submission ID format in {key}")
-                continue
-        
-        # Save all valid changes at once using bulk_update
-        if submissions_to_update:
-            models.Submission.objects.bulk_update(submissions_to_update, ['score'])
+        # Check and save every grade in the form as one batch: a fixed
+        # number of queries however many rows there are
+        result = grade_import.import_grades(assignment, user, grade_import.form_rows(request.POST))
+        errors = result.errors
+        general_errors = result.general_errors
             
-        # If no errors, redirect back to the page
+        # If no errors, redirect back to the same page
         if not errors and not general_errors:
-            return redirect(f"/{assignment_id}/submissions/")
-        
-        # If there are errors, add error information to submissions for display
-        for submission in submissions:
-            submission.error_messages = errors.get(submission.id, [])
+            query = request.GET.urlencode()
+            return redirect(f"/{course.slug}/{assignment_id}/submissions/" + (f"?{query}" if query else ""))
+    
+    # Read the page after saving, so it shows the new grades
+    submissions = submission_pages.visible_submissions(assignment, user, ungraded, grader)
+    page = submission_pages.page(
+        submissions, sort, descending, request.GET.get('after'), request.GET.get('before')
+    )
+    
+    # If there are errors, add error information to submissions for display
+    for submission in page.submissions:
+        submission.error_messages = errors.get(submission.id, [])
+    
+    # Links keep the filters and sort, replacing only the cursor
+    filters = request.GET.copy()
+    for key in ('after', 'before'):
+        filters.pop(key, None)
+    
+    def link(**params):
+        query = filters.copy()
+        for key, value in params.items():
+            if value is None:
+                query.pop(key, None)
+            else:
+                query[key] = value
+        return f"?{query.urlencode()}"
+    
+    # Clicking a column header cycles through ascending, descending and the
+    # default order, like the client-side sorter in main.js
+    sorted_by = request.GET.get('sort')
+    sort_urls = {}
+    for column in submission_pages.SORTS:
+        if sorted_by != column:
+            sort_urls[column] = link(sort=column, dir=None)
+        elif not descending:
+            sort_urls[column] = link(sort=column, dir='desc')
+        else:
+            sort_urls[column] = link(sort=None, dir=None)
+    
+    # The counts in the statistics are from before any save above; a failed
+    # save re-renders the page, so they are at most one batch behind
+    stats = grade_stats.assignment_stats(course, assignment)
     
     return render(request, "submissions.html", {
-        'title': f'{assignment.title} - CS 3550',
+        'title': f'{assignment.title} - {course.title}',
+        'course': course,
         'assignment': assignment,
-        'submissions': submissions,
+        'submissions': page.submissions,
+        'previous_url': link(before=page.previous_cursor) if page.previous_cursor else None,
+        'next_url': link(after=page.next_cursor) if page.next_cursor else None,
+        'sorted_by': sorted_by,
+        'descending': descending,
+        'sort_urls': sort_urls,
+        'ungraded': ungraded,
+        'grader': grader,
+        'graders': submission_pages.graders(course) if is_admin else [],
+        'stats': stats,
+        'stats_rows': [
+            ("Assignment (points)", stats),
+            ("Final grades (%)", grade_stats.final_grade_stats(course)),
+        ],
         'general_errors': general_errors,
         'user': user,
         'is_admin': is_admin
     })
 
 @login_required
-def profile(request):
+@require_POST
+@course_view
+def import_grades(request, course, assignment_id):
+    """
+    Imports grades for one assignment from CSV or JSON, sent either as a
+    `grades` file upload or as the request body. The rows are read and saved
+    a batch at a time as they stream in. Responds with JSON listing how many
+    grades changed and any rows that were rejected. A file that can't be
+    read changes nothing.
+    """
     user = request.user
-    is_authenticated = user.is_authenticated
-    is_student_user = is_student(user) or not is_authenticated
-    is_ta_user = is_ta(user)
-    is_admin = user.is_superuser
-    
-    assignments = models.Assignment.objects.all().order_by('deadline')
-    current_grade = None
-    
-    if is_student_user and is_authenticated:
-        # For students, show submission status and grades
-        for assignment in assignments:
-            submission = assignment.submission_set.filter(author=user).first()
-            past_due = assignment.deadline < timezone.now()
+    if not (is_ta(user, course) or user.is_superuser):
+        raise PermissionDenied("Only TAs can import grades")
+    assignment = get_object_or_404(models.Assignment, course=course, id=assignment_id)
+
+    upload = request.FILES.get('grades')
+    if upload:
+        stream, is_json = upload, upload.name.lower().endswith(('.json', '.jsonl'))
+    else:
+        stream, is_json = request, 'json' in request.content_type
+    parse = grade_import.json_rows if is_json else grade_import.csv_rows
+
+    try:
+        with courses.atomic():
+            result = grade_import.import_grades(assignment, user, parse(grade_import.decode_lines(stream)))
+    except ValueError as e:
+        return HttpResponseBadRequest(f"Could not read grades: {e}")
+    return JsonResponse(result.as_dict())
+
+@login_required
+@require_GET
+@course_view
+def similar_submissions(request, course, assignment_id):
+    """
+    Submissions for the assignment whose files are identical or close to
+    another student's, in any course (see similarity.py). TAs only.
+    """
+    user = request.user
+    if not (is_ta(user, course) or user.is_superuser):
+        raise PermissionDenied("Only TAs can see similar submissions")
+    assignment = get_object_or_404(models.Assignment, course=course, id=assignment_id)
+    return render(request, "similar_submissions.html", {
+        'title': f'Similar submissions - {assignment.title}',
+        'course': course,
+        'assignment': assignment,
+        'rows': similarity.similar_submissions(assignment),
+        'threshold': similarity.THRESHOLD,
+    })
+
+@login_required
+@require_GET
+@course_view
+def export_gradebook(request, course):
+    """
+    Streams every student's scores, statuses and final grade in the course,
+    as CSV or (with ?format=jsonl) JSON Lines. Admins only.
+    """
+    if not request.user.is_superuser:
+        raise PermissionDenied("Only instructors can export the gradebook")
+    format = request.GET.get('format', 'csv')
+    if format not in export.FORMATS:
+        return HttpResponseBadRequest(f"Unknown format {format}")
+    content_type, filename = export.FORMATS[format]
+
+    lines = export.export_lines(course, format)
+    if isinstance(request, ASGIRequest):
+        # Under ASGI a plain generator would be collected in memory first
+        lines = export.aexport_lines(lines)
+    return StreamingHttpResponse(lines, content_type=content_type, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
+
+@require_GET
+def show_metrics(request):
+    """
+    Request metrics from every worker process, in the Prometheus text
+    format. Admins only, or a scraper sending GRADES_METRICS_TOKEN.
+    """
+    token = settings.GRADES_METRICS_TOKEN
+    scraper = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not (scraper or request.user.is_superuser):
+        raise PermissionDenied("Only instructors can read the metrics")
+    if not metrics.enabled():
+        raise Http404("Metrics are turned off")
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@login_required
+@require_GET
+def profiles(request):
+    """The saved request profiles, newest first. Admins only."""
+    if not request.user.is_superuser:
+        raise PermissionDenied("Only instructors can see request profiles")
+    found = [profiling.load(profile_id) for profile_id in profiling.profile_ids()]
+    return render(request, "profiles.html", {
+        'title': 'Request profiles - Graderific',
+        'profiles': [details for details in found if details],
+        'enabled': bool(profiling.directory_path()),
+    })
+
+@login_required
+@require_GET
+def show_profile(request, profile_id):
+    """One profile's SQL and slowest calls, or with ?download=1 its .prof file."""
+    if not request.user.is_superuser:
+        raise PermissionDenied("Only instructors can see request profiles")
+    details = profiling.load(profile_id)
+    if details is None:
+        raise Http404(f"Profile {profile_id} not found")
+    if request.GET.get('download'):
+        try:
+            return FileResponse(
+                open(profiling.path(profile_id, '.prof'), 'rb'),
+                as_attachment=True, filename=f'{profile_id}.prof'
+            )
+        except OSError:
+            raise Http404(f"Profile {profile_id} not found")
+    return render(request, "profile_detail.html", {
+        'title': f"Profile of {details['path']} - Graderific",
+        'details': details,
+    })
+
+def grade_table(user, course, is_student_user, is_ta_user, is_admin):
+    """
+    The profile page's table for the course: a student's statuses and
+    grade, or a TA's grading progress. Cached per user; a student's table
+    is rendered again when their submissions change or a deadline passes.
+    """
+    if is_student_user and user.is_authenticated:
+        def render_table():
+            # For students, show submission status and grades
+            assignments = gradebook.student_gradebook(user, course)
+            for assignment in assignments:
+                assignment.status = gradebook.submission_status(assignment, assignment.user_submission)
             
-            if submission and submission.score is not None:
-                # Graded submission
-                percentage = (submission.score / assignment.points) * 100
-                assignment.status = f"{percentage:.1f}%"
-            elif submission and past_due:
-                # Submitted, not graded, past due
-                assignment.status = "Ungraded"
-            elif submission:
-                # Submitted, not due
-                assignment.status = "Submitted"
-            elif past_due:
-                # Not submitted, past due
-                assignment.status = "Missing"
-            else:
-                # Not submitted, not due
-                assignment.status = "Not Due"
+            return render_to_string("profile_grades.html", {
+                'course': course,
+                'assignments': assignments,
+                'is_student': True,
+                # Read the student's stored grade
+                'current_grade': student_grades.get_grade(user, course)
+            })
         
-        # Compute the student's current grade
-        current_grade = compute_grade(user)
-    else:
-        # For TAs or admin, show grading progress
+        return mark_safe(fragments.cached(
+            'profile_student', [course.id, user.id],
+            [f'assignments:{course.id}', f'student:{course.id}:{user.id}'], render_table,
+            expires=fragments.next_deadline(course)
+        ))
+    
+    def render_table():
+        # For TAs or admin, show grading progress from the counters
+        assignments = counters.with_counts(
+            models.Assignment.objects.filter(course=course).order_by('deadline'), user, course
+        )
         for assignment in assignments:
             if is_admin:
                 # Admin sees all submissions
-                assigned = assignment.submission_set.count()
-                graded = assignment.submission_set.filter(score__isnull=False).count()
-            elif is_ta_user and is_authenticated:
+                assigned = assignment.total_submissions
+                graded = assignment.graded_submissions
+            elif is_ta_user and user.is_authenticated:
                 # TAs see their assigned submissions
-                assigned = assignment.submission_set.filter(grader=user).count()
-                graded = assignment.submission_set.filter(grader=user, score__isnull=False).count()
+                assigned = assignment.your_submissions
+                graded = assignment.your_graded
             else:
                 # Anonymous users see nothing
                 assigned = 0
                 graded = 0
             
             assignment.graded_count = f"{graded}/{assigned}"
+        
+        return render_to_string("profile_grades.html", {
+            'course': course,
+            'assignments': assignments,
+            'is_student': False
+        })
+    
+    role = 'admin' if is_admin else 'ta' if is_ta_user else 'other'
+    return mark_safe(fragments.cached(
+        'profile_grader', [course.id, user.id, role], [f'assignments:{course.id}', f'grading:{course.id}'], render_table
+    ))
+
+@login_required
+@course_view
+def profile(request, course):
+    user = request.user
+    is_authenticated = user.is_authenticated
+    is_student_user = is_student(user, course) or not is_authenticated
+    is_ta_user = is_ta(user, course)
+    is_admin = user.is_superuser
     
     return render(request, "profile.html", {
-        'title': 'Your Grades - CS 3550',
-        'assignments': assignments,
+        'title': f'Your Grades - {course.title}',
+        'course': course,
+        'grade_table': grade_table(user, course, is_student_user, is_ta_user, is_admin),
         'user': user,
         'is_student': is_student_user,
         'is_ta': is_ta_user,
-        'is_admin': is_admin,
-        'current_grade': current_grade
+        'is_admin': is_admin
     })
 
 @login_required
-def show_upload(request, filename):
+@course_view
+def show_upload(request, course, filename):
     try:
-        # Look for the submission with this filename
-        # Try to find the submission by matching the end of the file path
-        submission = models.Submission.objects.filter(file__endswith=filename).first()
+        # Look for the submission with this filename (an indexed lookup)
+        submission = models.Submission.objects.filter(assignment__course=course, served_name=filename).first()
         
         if not submission:
             raise Http404(f"File {filename} not found")
@@ -389,32 +499,28 @@ def show_upload(request, filename):
         except PermissionDenied:
             raise PermissionDenied("You are not authorized to view this file")
         
-        # Verify it's a PDF
-        if not is_pdf(file):
+        # Verify it's a PDF, unless it was already checked when uploaded
+        if not submission.sha256 and not is_pdf(file):
             raise Http404("Invalid PDF file")
         
-        # Open the file and return its contents
-        file_content = file.open()
-        
-        # Create response with proper headers
-        response = HttpResponse(file_content)
-        response['Content-Type'] = 'application/pdf'
-        response['Content-Disposition'] = f'attachment; filename="{file.name.split("/")[-1]}"'
-        
-        return response
+        # Stream the file in chunks, with Range support
+        return serving.serve_file(
+            request, file, submission.served_name, content_type='application/pdf',
+            etag=f'"{submission.sha256}"' if submission.sha256 else None
+        )
         
     except Exception as e:
         raise Http404(f"Error retrieving file: {str(e)}")
 
 def login_form(request):
     # Default next URL if not provided
-    next_url = request.GET.get('next', '/profile/')
+    next_url = request.GET.get('next', '/')
     error = None
     
     if request.method == 'POST':
         username = request.POST.get('username', '')
         password = request.POST.get('password', '')
-        next_url = request.POST.get('next', '/profile/')
+        next_url = request.POST.get('next', '/')
         
         user = authenticate(request, username=username, password=password)
         if user is not None:
@@ -429,7 +535,7 @@ def login_form(request):
             error = "Username and password do not match"
     
     return render(request, "login.html", {
-        'title': 'Log in - CS 3550',
+        'title': 'Log in - Graderific',
         'next': next_url,
         'error': error
     })
@@ -1,3 +1,4 @@
+import argparse
 import datetime
 
 import os, django
@@ -5,7 +6,8 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "graderific.settings")
 django.setup()
 
 from django.core.files.base import ContentFile
-from grades.models import User, Group, Assignment, Submission
+from grades.models import User, Group, Course, Assignment, Submission
+from grades import synthetic
 
 def midnight(month, day):
     if month < 11 or month == 11 and day < 3:
@@ -16,6 +18,7 @@ def midnight(month, day):
 
 def check_has_data():
     return Group.objects.all().count() or \
+        Course.objects.all().count() or \
         User.objects.all().count() or \
         Assignment.objects.all().count() or \
         Submission.objects.all().count()
@@ -23,6 +26,10 @@ def check_has_data():
 def initial_data():
     tas, _ = Group.objects.get_or_create(name='Teaching Assistants')
     students, _ = Group.objects.get_or_create(name='Students')
+    course = Course.objects.create(
+        slug="cs3550", title="CS 3550",
+        students=students, teaching_assistants=tas,
+    )
 
     prof = User.objects.create_superuser(
         "david", "david@cs.utah.edu", "david",
@@ -57,6 +64,7 @@ def initial_data():
     students.user_set.add(s1, s2, s3, s4)
 
     hw0 = Assignment.objects.create(
+        course=course,
         title="Github username",
         description="Submit a text file with your github username",
         deadline=midnight(8, 1),
@@ -64,6 +72,7 @@ def initial_data():
         points=1
     )
     hw1 = Assignment.objects.create(
+        course=course,
         title="Homework 1 (HTML)",
         description="""
 <p>In this assignment, you will set up a web server serving HTML web
@@ -83,6 +92,7 @@ pages for the grading application:</p>
         points=100
     )
     hw2 = Assignment.objects.create(
+        course=course,
         title="Homework 2 (CSS)",
         description="""
 <p>In this assignment, you will enhance the visual appearance of your grading application by applying CSS styles:</p>
@@ -108,6 +118,7 @@ pages for the grading application:</p>
         points=100
     )
     hw3 = Assignment.objects.create(
+        course=course,
         title="Homework 3 (Models and Views)",
         description="""
 <p>In this assignment, you will dive into the backend of your grading application by implementing models and views:</p>
@@ -139,6 +150,7 @@ pages for the grading application:</p>
         points=100
     )
     hw4 = Assignment.objects.create(
+        course=course,
         title="Homework 4 (Controllers)",
         description="""
 <p>In this assignment, you will implement controllers to handle complex operations in your grading application, focusing on assignment submission, grade editing, and auto-assignment features:</p>
@@ -178,6 +190,7 @@ pages for the grading application:</p>
         points=100
     )
     hw5 = Assignment.objects.create(
+        course=course,
         title="Homework 5 (Users and Permissions)",
         description="""
 <p>In this assignment, you will implement user authentication and authorization features for your grading application, ensuring that different user types (students, TAs, and administrators) have appropriate access and permissions:</p>
@@ -218,6 +231,7 @@ pages for the grading application:</p>
         points=100
     )
     hw6 = Assignment.objects.create(
+        course=course,
         title="Homework 6 (JavaScript)",
         description="""
 <p>In this assignment, you will enhance the interactivity and user experience of your grading application by implementing client-side JavaScript features:</p>
@@ -266,6 +280,7 @@ pages for the grading application:</p>
         points=100
     )
     hw6 = Assignment.objects.create(
+        course=course,
         title="Homework 7 (AWS)",
         description="""
 <p>In this final assignment, you will deploy your grading application to the cloud using Amazon Web Services (AWS) EC2:</p>
@@ -372,6 +387,22 @@ pages for the grading application:</p>
     )
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=(
+        "Fill an empty database with the sample course, or with --students, "
+        "a synthetic course of any size (see grades/synthetic.py)."
+    ))
+    parser.add_argument("--students", type=int,
+                        help="Generate this many synthetic students instead of the sample course")
+    parser.add_argument("--assignments", type=int, default=10,
+                        help="Synthetic assignments, a third of them not yet due (default: 10)")
+    parser.add_argument("--tas", type=int, default=5, help="Synthetic TAs (default: 5)")
+    parser.add_argument("--submit-rate", type=float, default=0.9,
+                        help="Chance a student submits each assignment (default: 0.9)")
+    parser.add_argument("--password", default="password",
+                        help="Password for every synthetic user (default: password)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
     if check_has_data():
         print("""It looks you've already run the makedata.py script.
 If you've changed the model and want to rerun the script, run:
@@ -382,4 +413,15 @@ If you've changed the model and want to rerun the script, run:
     python3 makedata.py
 """)
         exit(1)
-    initial_data()
\ No newline at end of file
+    if args.students is None:
+        initial_data()
+    else:
+        # An instructor to log in as, plus the synthetic course
+        User.objects.create_superuser(
+            "david", "david@cs.utah.edu", "david",
+            first_name="David", last_name="Johnson",
+        )
+        synthetic.generate(
+            students=args.students, assignments=args.assignments, tas=args.tas,
+            submit_rate=args.submit_rate, password=args.password, seed=args.seed, log=print
+        )
@@ -31,6 +31,13 @@ function makeHeaderSortable(headerCell, table) {
     
     // Add click event listener
     headerCell.addEventListener("click", function() {
+        // A paginated table is sorted on the server, which cycles through
+        // the same ascending, descending and original orders
+        if (headerCell.dataset.sortUrl) {
+            window.location.search = headerCell.dataset.sortUrl;
+            return;
+        }
+        
         // Get the column index
         const columnIndex = headerCell.cellIndex;
         
@@ -290,6 +297,35 @@ function updateFinalGrade(table) {
     }
 }
 
+// Get or create the status message element at the end of a form
+function status_message(form) {
+    let statusMessage = form.querySelector('.upload-status');
+    if (!statusMessage) {
+        statusMessage = document.createElement('p');
+        statusMessage.className = 'upload-status';
+        form.appendChild(statusMessage);
+    }
+    return statusMessage;
+}
+
+// Post a form to its JSON endpoint (the form's data-api attribute).
+// Returns the response and its parsed body, which is null if the server
+// didn't answer with JSON (for example a login redirect or an error page).
+async function post_form_json(form) {
+    const csrfToken = form.querySelector('[name=csrfmiddlewaretoken]').value;
+    const response = await fetch(form.dataset.api, {
+        method: 'POST',
+        body: new FormData(form),
+        headers: {
+            'X-CSRFToken': csrfToken,
+            'Accept': 'application/json'
+        },
+        credentials: 'same-origin'
+    });
+    const isJson = (response.headers.get('Content-Type') || '').includes('application/json');
+    return { response, data: isJson ? await response.json() : null };
+}
+
 // Asynchronous form submission function
 function make_form_async(form) {
     form.addEventListener("submit", async function(event) {
@@ -298,6 +334,48 @@ function make_form_async(form) {
         
         console.log("Async form submission started");
         
+        // With a JSON endpoint, update the page in place instead of reloading
+        if (form.dataset.api) {
+            const statusMessage = status_message(form);
+            const fieldError = form.querySelector('.field-error[data-field="submission_file"]');
+            try {
+                const { response, data } = await post_form_json(form);
+                console.log("Response received:", response.status);
+                
+                if (data && response.ok) {
+                    // Success - show the new submission status
+                    const status = document.querySelector('.submission-status');
+                    if (status) {
+                        status.textContent = data.status;
+                    }
+                    if (fieldError) {
+                        fieldError.textContent = '';
+                    }
+                    form.reset();
+                    statusMessage.textContent = "Upload succeeded";
+                    statusMessage.style.color = "green";
+                } else if (data && data.errors) {
+                    // Show the error next to the field it belongs to
+                    const messages = data.errors.submission_file || [];
+                    if (fieldError) {
+                        fieldError.textContent = messages.join(' ');
+                    }
+                    statusMessage.textContent = "Upload failed. Please try again.";
+                    statusMessage.style.color = "red";
+                } else {
+                    statusMessage.textContent = "Upload failed. Please try again.";
+                    statusMessage.style.color = "red";
+                    console.log("Upload failed with status:", response.status);
+                }
+            } catch (error) {
+                // Network or other error
+                console.error("Error during fetch:", error);
+                statusMessage.textContent = "Error: " + error.message;
+                statusMessage.style.color = "red";
+            }
+            return;
+        }
+        
         // Create a FormData object from the form
         const formData = new FormData(form);
         
@@ -318,12 +396,7 @@ function make_form_async(form) {
             console.log("Response received:", response.status);
             
             // Create or get the status message element
-            let statusMessage = form.querySelector('.upload-status');
-            if (!statusMessage) {
-                statusMessage = document.createElement('p');
-                statusMessage.className = 'upload-status';
-                form.appendChild(statusMessage);
-            }
+            const statusMessage = status_message(form);
             
             if (response.ok) {
                 // Success - display success message
@@ -346,13 +419,64 @@ function make_form_async(form) {
             // Network or other error
             console.error("Error during fetch:", error);
             
-            let statusMessage = form.querySelector('.upload-status');
-            if (!statusMessage) {
-                statusMessage = document.createElement('p');
-                statusMessage.className = 'upload-status';
-                form.appendChild(statusMessage);
+            const statusMessage = status_message(form);
+            statusMessage.textContent = "Error: " + error.message;
+            statusMessage.style.color = "red";
+        }
+    });
+}
+
+// Save grades from the submissions page without reloading it. Only forms
+// with a JSON endpoint are changed; others submit normally.
+function make_grading_form_async(form) {
+    if (!form.dataset.api) {
+        return;
+    }
+    form.addEventListener("submit", async function(event) {
+        event.preventDefault();
+        
+        const statusMessage = status_message(form);
+        try {
+            const { response, data } = await post_form_json(form);
+            console.log("Response received:", response.status);
+            
+            if (!data) {
+                // Not a JSON answer, so fall back to a normal submission
+                form.submit();
+                return;
+            }
+            
+            // Replace the errors in every row: rows that now pass are cleared
+            form.querySelectorAll('.field-error[data-submission]').forEach(cell => {
+                cell.replaceChildren(...(data.errors[cell.dataset.submission] || []).map(message => {
+                    const output = document.createElement('output');
+                    output.textContent = message;
+                    return output;
+                }));
+            });
+            const generalErrors = form.querySelector('.general-errors');
+            if (generalErrors) {
+                generalErrors.replaceChildren(...data.general_errors.map(message => {
+                    const output = document.createElement('output');
+                    output.className = 'general-error';
+                    output.textContent = message;
+                    return output;
+                }));
             }
             
+            const counts = data.counts;
+            const summary = data.updated + " grade" + (data.updated === 1 ? "" : "s") + " saved, " +
+                counts.your_graded + "/" + counts.your_submissions + " graded";
+            if (response.ok) {
+                statusMessage.textContent = summary;
+                statusMessage.style.color = "green";
+            } else {
+                statusMessage.textContent = summary + ". Please fix the errors above.";
+                statusMessage.style.color = "red";
+            }
+        } catch (error) {
+            // Network or other error
+            console.error("Error during fetch:", error);
             statusMessage.textContent = "Error: " + error.message;
             statusMessage.style.color = "red";
         }
@@ -375,6 +499,15 @@ document.addEventListener("DOMContentLoaded", function() {
         make_form_async(submissionForm);
     }
     
+    // And for the grading form on the submissions page
+    if (window.location.pathname.includes('/submissions')) {
+        const gradingForm = document.querySelector('form[data-api]');
+        if (gradingForm) {
+            console.log("Found grading form, making it async");
+            make_grading_form_async(gradingForm);
+        }
+    }
+    
     // Set up hypothesized grades on profile page for students
     if (window.location.pathname.includes('/profile')) {
         console.log("On profile page, looking for grades table");